@@ -1,146 +1,68 @@
 from __future__ import annotations
 
-import base64
-from io import BytesIO, StringIO
+import hashlib
+from collections.abc import Callable, Mapping
+from concurrent.futures import as_completed
+from contextlib import nullcontext
+from io import StringIO
 from logging import getLogger
 from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.style
-import numpy as np
 import pandas as pd
-import pdfkit
-import pingouin as pg
-import seaborn as sns
 import sklearn
-import sklearn.cluster
-from japanize_matplotlib import japanize
-from matplotlib.figure import Figure
-from scipy.stats import pearsonr
-from sklearn.discriminant_analysis import StandardScaler
-from sklearn.manifold import MDS, TSNE
-from xhtml2pdf import pisa
 
-sklearn.set_config(transform_output="pandas")
-
-LIKERT_SCALE_TEXTS = ["全く当てはまる", "当てはまる", "どちらともいえない", "あまり当てはまらない", "全く当てはまらない"]
-TIMESTAMP_TEXT = "タイムスタンプ"
-HTML_FONT_FAMILY = "HeiseiKakuGo-W5"
-PDFKIT_FONT_FAMILY = "IPAexGothic"
-MATPLOTLIB_FONT_FAMILY = "IPAexGothic"
-PRIVACY_TEXT = "公開範囲"
-
-LOG = getLogger(__name__)
+from .figures import figure_workers, set_font
+from .incremental import row_keys
+from .pdf import PdfRenderer
+from .profiling import add_worker_trace, run_traced, stage, trace_options
+from .report import ImageEncoding, export_multiple_frames_to_html, get_artifacts
+from .results import PRIVACY_TEXT, TIMESTAMP_TEXT, SurveyResults
+from .shards import write_shards
+from .store import ResponseStore
+from .workers import process_pool
 
+if TYPE_CHECKING:
+    from .report import ReportItem
 
-def export_multiple_frames_to_html(
-    dfs: list[pd.DataFrame | pd.Series | str | Figure],
-    path: Path | str,
-    pdf: bool = True,
-) -> None:
-    dfs = [df.to_frame() if isinstance(df, pd.Series) else df for df in dfs]
-    with open(path, "w", encoding="utf-8") as f:
-        # for xhtml2pdf support, set font-family to HeiseiKakuGo-W5
-        f.write(
-            """<html>
-<meta charset='UTF-8'>
-<style>
- @page {
-        size: A1;
-    }
-    body { font-family: HeiseiKakuGo-W5; font-size: 5pt; }
-    table { font-family: HeiseiKakuGo-W5; font-size: 5pt; }
-    th { font-family: HeiseiKakuGo-W5; font-size: 5pt; }
-    td { font-family: HeiseiKakuGo-W5; font-size: 5pt; }
-</style>
-<body>"""
-        )
-        for df in dfs:
-            if isinstance(df, str):
-                f.write(f"<h2>{df}</h2>")
-            elif isinstance(df, Figure):
-                with BytesIO() as buf:
-                    try:
-                        df.tight_layout()
-                    except Exception as e:
-                        LOG.warning(e)
-                    df.savefig(buf, format="png")
-                    f.write(
-                        "<img src='data:image/png;base64,"
-                        f"{base64.b64encode(buf.getvalue()).decode('utf-8')}'/>"
-                    )
-            else:
-                # replace \n with <br> tag
-                f.write(df.to_html().replace("\\n", "<br>"))
-        f.write("</body></html>")
+sklearn.set_config(transform_output="pandas")
 
-    if pdf:
-        pdf_path = Path(path).with_suffix(".pdf")
-        try:
-            content = (
-                Path(path)
-                .read_text(encoding="utf-8")
-                .replace(HTML_FONT_FAMILY, PDFKIT_FONT_FAMILY)
-            )
-            with StringIO(content) as f:
-                pdfkit.from_file(f, pdf_path)
-        except Exception as e:
-            LOG.exception(e)
-            LOG.warning("Failed to convert to pdf using pdfkit, trying xhtml2pdf")
-            with Path(path).with_suffix(".pdf").open("wb") as f:
-                pisa.CreatePDF(
-                    Path(path).read_text(encoding="utf-8"),
-                    f,
-                    encoding="utf-8",
-                    link_callback=lambda uri, _: uri.replace(" ", "%20"),
-                )
+LOG = getLogger(__name__)
 
 
-def find_best_k(
-    X: pd.DataFrame, max_k: int = 10
-) -> tuple[int, list[float], sklearn.cluster.KMeans]:
-    scores = []
-    models = []
-    for k in range(1, min(max_k, len(X)) + 1):
-        model = sklearn.cluster.KMeans(n_clusters=k, n_init="auto")
-        model.fit(X)
-        scores.append(model.inertia_)
-        models.append(model)
-    return np.argmin(scores) + 1, scores, models[np.argmin(scores)]
+def read_responses(csv_content: str) -> pd.DataFrame:
+    with StringIO(csv_content) as f:
+        return pd.read_csv(f, index_col=[2], header=0)
 
 
-def analyze(
-    csv_content: str,
-    *,
-    out_path: Path | str = "output.html",
-    add_numeral: bool = True,
-    pdf: bool = True,
-    privacy_scopes: list[str] | None = None,
-) -> None:
-    # matplotlib.style.use(matplotx.styles.dracula)
-    if MATPLOTLIB_FONT_FAMILY == "IPAexGothic":
-        japanize()
-    else:
-        matplotlib.rcParams["font.family"] = MATPLOTLIB_FONT_FAMILY
+def read_stored_responses(csv_content: str, store_dir: Path | str) -> pd.DataFrame:
+    # the responses from the store in store_dir if the export was stored before,
+    # otherwise parsed and appended to the store
+    store = ResponseStore(store_dir)
+    digest = hashlib.sha256(csv_content.encode()).hexdigest()
+    if store.digest == digest:
+        df = store.load()
+        if df is not None:
+            LOG.info(f"Loaded {len(df)} responses from {store_dir}")
+            return df
+    df = read_responses(csv_content)
+    store.append(df, row_keys(df[TIMESTAMP_TEXT]), digest)
+    return df
 
-    with StringIO(csv_content) as f:
-        df = pd.read_csv(f, index_col=[2], header=0)
-    last_timestamp = df[TIMESTAMP_TEXT].max()
-    PRIVACY_COL = df.columns[df.columns.str.contains(PRIVACY_TEXT)].tolist()[0]
-    if privacy_scopes is not None:
-        df = df[df[PRIVACY_COL].str.contains("|".join(privacy_scopes), regex=True)]
-    df = df.drop(columns=[TIMESTAMP_TEXT])
-    df = df.sort_index(axis=0)
 
-    # get metadata
+def read_metadata(columns: pd.Index) -> pd.DataFrame:
     metadata_path = Path("metadata.csv")
     if not metadata_path.exists():
-        df_meta = df.columns.to_frame()
+        df_meta = columns.to_frame()
         # group=None means the question is not in any group
         df_meta["group"] = None
         # higher_is_better=False means the lower the score, the better
         df_meta["higher_is_better"] = False
+        # scale=None means the default 5-point scale
+        df_meta["scale"] = None
+        # type="text" marks a free text question, see
+        # SurveyResults.free_text_columns
+        df_meta["type"] = None
         df_meta.to_csv(metadata_path, index=False)
         raise RuntimeError(
             "metadata.csv does not exist, please fill it in and run again. "
@@ -155,181 +77,151 @@ def analyze(
         group_names = pd.read_csv(metadata_group_name_path, index_col=0, header=None)
         for i, group_name in group_names.iterrows():
             df_meta.loc[df_meta["group"] == i, "group"] = group_name[1]
+    return df_meta
 
-    # extract likert scale questions and numerical columns
-    likert_cols = df_meta["group"].notna()
-    df_likert = df.loc[:, likert_cols].copy()
-    df_free = df.loc[:, ~likert_cols].copy()
-    df_likert_meta = df_meta[likert_cols].copy()
-
-    # convert likert scale to numerical values
-    for i, likert_scale in enumerate(LIKERT_SCALE_TEXTS):
-        df_likert = df_likert.replace(likert_scale, len(LIKERT_SCALE_TEXTS) - i)
-    df_likert = df_likert.astype(int)
-    df_likert.loc[:, ~df_likert_meta["higher_is_better"]] = len(LIKERT_SCALE_TEXTS) - (
-        df_likert.loc[:, ~df_likert_meta["higher_is_better"]] - 1
-    )
 
-    # multiindex by group and question
-    df_likert.columns = pd.MultiIndex.from_frame(
-        pd.DataFrame({"group": df_likert_meta["group"], "question": df_likert.columns})
+def analyze(
+    csv_content: str,
+    *,
+    out_path: Path | str = "output.html",
+    add_numeral: bool = True,
+    pdf: bool = True,
+    privacy_scopes: list[str] | None = None,
+    **kwargs: Any,
+) -> None:
+    with stage("parse"):
+        df = read_responses(csv_content)
+        df_meta = read_metadata(df.columns.drop(TIMESTAMP_TEXT))
+    analyze_responses(
+        df,
+        df_meta,
+        out_path=out_path,
+        add_numeral=add_numeral,
+        pdf=pdf,
+        privacy_scopes=privacy_scopes,
+        **kwargs,
     )
-    if add_numeral:
-        df_numeral = df.select_dtypes(include="number")
-        df_numeral_columns = df_numeral.columns
-        df_numeral.columns = pd.MultiIndex.from_frame(
-            pd.DataFrame({"group": df_numeral.columns, "question": df_numeral.columns})
-        )
-        df_likert = pd.concat([df_likert, df_numeral], axis=1, join="outer")
 
-    # clustering
-    if add_numeral:
-        df_likert_dropna = df_likert.drop(columns=df_numeral.columns)
-    df_likert_dropna = df_likert_dropna.dropna(axis=1)
-    df_likert_dropna = StandardScaler().fit_transform(df_likert_dropna)
-    best_k, scores, cluster_model = find_best_k(df_likert_dropna, max_k=3)
-    fig_c_elbow, ax = plt.subplots()
-    ax.set_title("Elbow method for optimal k")
-    ax.plot(range(1, len(scores) + 1), scores)
-
-    fig_c_scatters = []
-    for j, embedding in enumerate(
-        [
-            MDS(n_components=2, normalized_stress="auto"),
-        ]
-        + (
-            [TSNE(n_components=2, perplexity=min(2, len(df_likert_dropna) - 1))]
-            if len(df_likert_dropna) > 1
-            else []
-        )
-    ):
-        emb_res = pd.DataFrame(
-            embedding.fit_transform(df_likert_dropna), index=df_likert_dropna.index
-        )
-        emb_res["cluster"] = cluster_model.predict(df_likert_dropna)
-        fig_c_scatter, ax = plt.subplots(figsize=(7, 7))
-        fig_c_scatters.append(fig_c_scatter)
-        ax.set_title(f"Scatter plot of {embedding.__class__.__name__}")
-        # annotate index
-        sns.scatterplot(data=emb_res, x=0, y=1, hue="cluster", ax=ax)
-        for i, row in emb_res.iterrows():
-            ax.annotate(i, (row.iat[0], row.iat[1]))
 
-    # calculate mean and std for each group per row
-    df_likert_grouped = df_likert.groupby(level="group", axis=1, sort=False)
-    df_likert_mean = df_likert_grouped.mean()
-    if add_numeral:
-        df_likert_mean["mean"] = df_likert_mean.drop(columns=df_numeral_columns).mean(
-            axis=1
+def analyze_batch(
+    csv_content: str,
+    jobs: Mapping[Path | str, list[str] | None],
+    *,
+    add_numeral: bool = True,
+    pdf: bool = True,
+    max_workers: int | None = None,
+    image_mode: str = "inline",
+    on_artifact: Callable[[Path], None] | None = None,
+    store_dir: Path | str | None = None,
+    trend: str | None = None,
+    **kwargs: Any,
+) -> dict[Path | str, list[Path]]:
+    # parse the csv and the metadata once and share them between all scopes.
+    # Returns the artifacts of the shards of each job, see analyze_responses().
+    with stage("parse"):
+        df = (
+            read_stored_responses(csv_content, store_dir)
+            if store_dir is not None
+            else read_responses(csv_content)
         )
-    df_likert_std = df_likert_grouped.std()
-    if add_numeral:
-        df_likert_std["mean"] = df_likert_std.drop(columns=df_numeral_columns).mean(
-            axis=1
+        # the trends include the responses of the previous exports
+        df_history = (
+            ResponseStore(store_dir).load(latest=False)
+            if trend is not None and store_dir is not None
+            else None
         )
-    fig_mean, ax = plt.subplots(figsize=(12, 10), ncols=2)
-    sns.barplot(
-        y=df_likert_mean["mean"].index, x=df_likert_mean["mean"], orient="h", ax=ax[0]
-    )
-    df_likert_mean.sort_index(axis=0, inplace=False, ascending=False).drop(
-        columns=list(df_numeral_columns) + ["mean"], inplace=False
-    ).plot(kind="barh", ax=ax[1], stacked=True)
-    # sns.barplot(df_likert_mean, orient="h", ax=ax[1])
+        kwargs.update(trend=trend, df_history=df_history)
+        df_meta = read_metadata(df.columns.drop(TIMESTAMP_TEXT))
+    # the privacy answers are parsed and the group means of their responses
+    # summed once for all scopes
+    if any(privacy_scopes is not None for privacy_scopes in jobs.values()):
+        everyone = SurveyResults(df, df_meta, add_numeral=add_numeral)
+        kwargs["privacy_index"] = everyone.privacy_index
+        kwargs["scope_sums"] = everyone.scope_sums
+    shards: dict[Path | str, list[Path]] = {}
+    if len(jobs) <= 1 or max_workers == 1:
+        # the PDF of a scope is rendered while the next one is analyzed
+        with PdfRenderer() if pdf and len(jobs) > 1 else nullcontext() as renderer:
+            for out_path, privacy_scopes in jobs.items():
+                shards[out_path] = analyze_responses(
+                    df,
+                    df_meta,
+                    out_path=out_path,
+                    add_numeral=add_numeral,
+                    pdf=pdf,
+                    privacy_scopes=privacy_scopes,
+                    max_workers=max_workers,
+                    image_mode=image_mode,
+                    on_artifact=on_artifact,
+                    pdf_renderer=renderer,
+                    **kwargs,
+                )
+        return shards
 
-    # calculate corr
-    if len(df_likert_mean) < 2:
-        df_likert_mean_corr = pd.DataFrame()
-        fig_corr = plt.figure()
-        df_likert_mean_pval = pd.DataFrame()
-        df_likert_std = pd.DataFrame()
-        df_likert_colwise = pd.DataFrame()
-        fig_colwise = plt.figure()
-    else:
-        df_likert_mean_corr = df_likert_mean.corr()
-        fig_corr, ax_corr = plt.subplots(figsize=(10, 10))
-        sns.heatmap(df_likert_mean_corr, annot=True, ax=ax_corr)
-        if add_numeral:
-            fig_corr_dropped, ax_corr_dropped = plt.subplots(figsize=(10, 10))
-            df_corr_dropped = df_likert_mean_corr.drop(
-                index=df_numeral_columns, columns=df_numeral_columns
-            )
-            sns.heatmap(df_corr_dropped, annot=True, ax=ax_corr_dropped)
+    with process_pool(max_workers=min(max_workers or len(jobs), len(jobs))) as executor:
+        # the spans of the workers are added to the trace of this process
+        options = trace_options()
+        futures = {
+            executor.submit(
+                run_traced,
+                options,
+                analyze_responses,
+                df,
+                df_meta,
+                out_path=out_path,
+                add_numeral=add_numeral,
+                pdf=pdf,
+                privacy_scopes=privacy_scopes,
+                # the scopes are already rendered in parallel
+                max_workers=1,
+                image_mode=image_mode,
+                **kwargs,
+            ): out_path
+            for out_path, privacy_scopes in jobs.items()
+        }
+        for future in as_completed(futures):
+            out_path = futures[future]
+            shards[out_path] = add_worker_trace(future.result())
+            LOG.info(f"Analyzed {out_path}")
+            if on_artifact is not None:
+                for path in [
+                    *get_artifacts(out_path, pdf, image_mode),
+                    *shards[out_path],
+                ]:
+                    on_artifact(path)
+    return shards
 
-        # calculate p-values
-        def try_peasonr(x: pd.Series, y: pd.Series) -> float:
-            try:
-                return pearsonr(x, y)[1]
-            except Exception as e:
-                LOG.warning(e)
-                return float("nan")
 
-        df_likert_mean_pval = df_likert_mean.corr(
-            method=lambda x, y: try_peasonr(x, y)
-        ) - np.eye(len(df_likert_mean_corr))
+def survey_results(
+    csv_content: str, *, privacy_scopes: list[str] | None = None, **kwargs: Any
+) -> SurveyResults:
+    # the results of the responses in csv_content without writing a report,
+    # see SurveyResults for the options
+    with stage("parse"):
+        df = read_responses(csv_content)
+        df_meta = read_metadata(df.columns.drop(TIMESTAMP_TEXT))
+    return SurveyResults(df, df_meta, privacy_scopes=privacy_scopes, **kwargs)
 
-        # calculate mean and std for each column
-        df_likert_grouped_colwise = df_likert.T.groupby(
-            level="group", axis=0, sort=False
-        )
-        df_liekrt_mean_colwise = (
-            df_likert_grouped_colwise.mean().mean(axis=1).rename("mean")
-        )
-        df_likert_std_colwise = (
-            df_likert_grouped_colwise.std().mean(axis=1).rename("std")
-        )
-
-        def _parse_cronbach_alpha(x: pd.Series) -> dict[str, object]:
-            if x.shape[1] <= 1:
-                return {
-                    "alpha": float("nan"),
-                    "alpha_0.95": float("nan"),
-                    "internal_consistency": "N/A",
-                }
-            a = pg.cronbach_alpha(x)
-            internal_consistency = {
-                0.9: "Excellent",
-                0.8: "Good",
-                0.7: "Acceptable",
-                0.6: "Questionable",
-                0.5: "Poor",
-                float("-inf"): "Unacceptable",
-            }
-            # internal_consistency = {
-            #     0.9: "<span style='color: #00ff00'>Excellent</span>",
-            #     0.8: "<span style='color: #00dd00'>Good</span>",
-            #     0.7: "<span style='color: #00bb00'>Acceptable</span>",
-            #     0.6: "<span style='color: #009900'>Questionable</span>",
-            #     0.5: "<span style='color: #007700'>Poor</span>",
-            #     float("-inf"): "<span style='color: #005500'>Unacceptable</span>"
-            # }
-            return {
-                "alpha": a[0],
-                "alpha_0.95": a[1],
-                "internal_consistency": internal_consistency[
-                    max(
-                        list(filter(lambda x: x <= a[0], internal_consistency.keys()))
-                        or [float("-inf")]
-                    )
-                ],
-            }
-
-        df_likert_alpha = df_likert_grouped.apply(
-            lambda x: _parse_cronbach_alpha(x)
-        ).apply(pd.Series)
-        df_likert_colwise = pd.concat(
-            [df_liekrt_mean_colwise, df_likert_std_colwise, df_likert_alpha], axis=1
-        )
-        if add_numeral:
-            df_likert_colwise.drop(index=df_numeral_columns, inplace=False).plot(
-                kind="barh", subplots=True, figsize=(10, 10), sharex=False
-            )
-        else:
-            df_likert_colwise.plot(kind="barh", subplots=True, figsize=(10, 10))
-        fig_colwise = plt.gcf()
 
+def report_items(results: SurveyResults) -> list[ReportItem]:
+    # the sections of the report, which computes all results
+    df = results.df
     idx_unique = df.index.unique()
-    # export to html
-    dfs_to_write = [
+    privacy_scopes = results.privacy_scopes
+    last_timestamp = results.last_timestamp
+    trend_sections: list[ReportItem] = []
+    if results.trend is not None:
+        trend_sections = [
+            "期間ごとのグループに関する平均",
+            results.df_trend.round(2),
+            results.fig_trend,
+            "前の期間からの変化",
+            results.df_trend_means.diff().iloc[1:].round(2),
+            "期間ごとの指導教員ごとの平均",
+            results.df_trend_supervisor.round(2),
+        ]
+    p_adjust = results.p_adjust
+    return [
         "<h1>分析結果</h1>"
         f"最終更新: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')} "
         f"最終回答: {last_timestamp} 回答数: {len(df)} 指導教員数: {len(idx_unique)}/47 "
@@ -340,27 +232,92 @@ def analyze(
         f"{PRIVACY_TEXT}: "
         + (", ".join(privacy_scopes) if privacy_scopes is not None else "全て"),
         "自由記述",
-        df_free,
+        results.df_free,
+        "自由記述のキーワード（キーワードを含む回答の数）",
+        results.df_keywords,
+        "指導教員ごとの自由記述のキーワード",
+        results.df_supervisor_keywords,
         "回答ごとのグループに関する平均（質問によって、良い方向の回答が高い値になるように変換しております）",
-        df_likert_mean.round(2),
-        fig_mean,
-        "クラスタリング（失敗）",
-        fig_c_elbow,
-        *fig_c_scatters,
+        results.df_likert_mean.round(2),
+        results.fig_mean,
+        "クラスタリング",
+        results.fig_c_elbow,
+        *results.fig_c_scatters,
         "グループに関する平均の相関",
-        df_likert_mean_corr.round(2),
-        fig_corr,
-        fig_corr_dropped if add_numeral else pd.DataFrame(),
-        "グループに関する平均の相関のp値",
-        df_likert_mean_pval.round(2),
+        results.df_likert_mean_corr.round(2),
+        results.fig_corr,
+        results.fig_corr_dropped if results.add_numeral else pd.DataFrame(),
+        "グループに関する平均の相関のp値" + (f"（{p_adjust}で補正）" if p_adjust is not None else ""),
+        results.df_likert_mean_pval.round(2),
         "回答ごとのグループに関する分散",
-        df_likert_std.round(2),
+        results.df_likert_std.round(2),
         "グループに関する統計値",
-        df_likert_colwise.round(2),
-        fig_colwise,
+        results.df_likert_colwise.round(2),
+        results.fig_colwise,
+        *trend_sections,
         "選択型（質問によって、良い方向の回答が高い値になるように変換しております）",
-        df_likert,
+        results.df_likert,
+        # the free text is only in its section above
         "生の値",
-        df,
+        df.drop(columns=results.free_text_columns),
     ]
-    export_multiple_frames_to_html(dfs_to_write, Path(out_path), pdf=pdf)
+
+
+def analyze_responses(
+    df: pd.DataFrame,
+    df_meta: pd.DataFrame,
+    *,
+    out_path: Path | str = "output.html",
+    pdf: bool = True,
+    max_workers: int | None = None,
+    image_mode: str = "inline",
+    on_artifact: Callable[[Path], None] | None = None,
+    pdf_backend: str = "auto",
+    pdf_renderer: PdfRenderer | None = None,
+    table_mode: str = "html",
+    image_encoding: ImageEncoding = ImageEncoding(),
+    shard_by: str | None = None,
+    **kwargs: Any,
+) -> list[Path]:
+    # writes the report of SurveyResults(df, df_meta, **kwargs) to out_path and
+    # with shard_by, one of each supervisor or department next to it (see
+    # write_shards()). Returns the artifacts of the shards.
+    set_font()
+    results = SurveyResults(
+        df,
+        df_meta,
+        state_name=Path(out_path).stem,
+        max_workers=max_workers,
+        **kwargs,
+    )
+    results.save_state()
+    # the workers which render the figures of the report also write its shards
+    with figure_workers(max_workers) if max_workers != 1 else nullcontext() as pool:
+        export_multiple_frames_to_html(
+            report_items(results),
+            Path(out_path),
+            pdf=pdf,
+            max_workers=max_workers,
+            image_mode=image_mode,
+            on_artifact=on_artifact,
+            pdf_backend=pdf_backend,
+            pdf_renderer=pdf_renderer,
+            table_mode=table_mode,
+            image_encoding=image_encoding,
+            figure_pool=pool,
+        )
+        if shard_by is None:
+            return []
+        return write_shards(
+            results,
+            shard_by,
+            out_path,
+            pdf=pdf,
+            max_workers=max_workers,
+            image_mode=image_mode,
+            on_artifact=on_artifact,
+            pdf_backend=pdf_backend,
+            table_mode=table_mode,
+            image_encoding=image_encoding,
+            figure_pool=pool,
+        )
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+from logging import WARNING, basicConfig, getLogger
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+import click
+
+from .analyze import analyze
+from .profiling import record_stages
+from .report import TABLE_MODES
+from .synthetic import write_survey
+
+# in the order they run
+STAGES = [
+    "parse",
+    "free_text",
+    "encode",
+    "clustering",
+    "stats",
+    "figures",
+    "html",
+    "pdf",
+]
+
+LOG = getLogger(__name__)
+
+
+def report_digest(path: Path | str) -> str:
+    # hash of the tables of a report, without the figures and the time
+    # it was generated, to check that changes do not change the results
+    html = Path(path).read_text(encoding="utf-8")
+    html = re.sub(r"<img [^>]*>", "", html)
+    html = re.sub(r"最終更新: [\d\- :]+", "", html)
+    return hashlib.sha256(html.encode()).hexdigest()[:16]
+
+
+def run_case(
+    n_responses: int,
+    n_questions: int,
+    *,
+    seed: int = 0,
+    pdf: bool = True,
+    pdf_backend: str = "auto",
+    table_mode: str = "html",
+    max_workers: int | None = None,
+    trace_memory: bool = True,
+) -> dict[str, Any]:
+    # runs the whole analysis on a generated survey in a temporary directory
+    cwd = Path.cwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            csv_content = write_survey(
+                directory, n_responses=n_responses, n_questions=n_questions, seed=seed
+            )
+            start = perf_counter()
+            with record_stages(trace_memory) as recorder:
+                analyze(
+                    csv_content,
+                    out_path="output.html",
+                    pdf=pdf,
+                    pdf_backend=pdf_backend,
+                    table_mode=table_mode,
+                    max_workers=max_workers,
+                )
+            total = perf_counter() - start
+            digest = report_digest("output.html")
+        finally:
+            os.chdir(cwd)
+    return {
+        "total_seconds": round(total, 4),
+        "stages": {
+            name: {
+                "seconds": round(recorder.seconds[name], 4),
+                "peak_mb": round(recorder.peak_bytes[name] / 2**20, 2),
+            }
+            for name in STAGES
+            if name in recorder.seconds
+        },
+        "digest": digest,
+    }
+
+
+def compare(
+    result: dict[str, Any],
+    baseline: dict[str, Any],
+    *,
+    tolerance: float = 1.5,
+    min_seconds: float = 0.1,
+    min_mb: float = 1.0,
+) -> list[str]:
+    # the regressions of result compared to baseline. Changes smaller than
+    # min_seconds or min_mb are ignored as noise.
+    regressions = []
+    if result["digest"] != baseline["digest"]:
+        regressions.append(
+            f"results changed: digest {result['digest']} != {baseline['digest']}"
+        )
+    for name, stats in result["stages"].items():
+        if name not in baseline["stages"]:
+            continue
+        base = baseline["stages"][name]
+        if stats["seconds"] > max(
+            base["seconds"] * tolerance, base["seconds"] + min_seconds
+        ):
+            regressions.append(
+                f"{name}: {stats['seconds']:.3f} s (baseline {base['seconds']:.3f} s)"
+            )
+        if stats["peak_mb"] > max(
+            base["peak_mb"] * tolerance, base["peak_mb"] + min_mb
+        ):
+            regressions.append(
+                f"{name}: {stats['peak_mb']:.1f} MB (baseline {base['peak_mb']:.1f} MB)"
+            )
+    return regressions
+
+
+@click.command()
+@click.option(
+    "-n", "--responses", type=int, multiple=True, default=[100], show_default=True
+)
+@click.option(
+    "-q", "--questions", type=int, multiple=True, default=[20], show_default=True
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--pdf/--no-pdf", default=True)
+@click.option(
+    "--pdf-backend",
+    type=click.Choice(["auto", "wkhtmltopdf", "xhtml2pdf", "matplotlib"]),
+    default="auto",
+    show_default=True,
+)
+@click.option(
+    "--tables",
+    "table_mode",
+    type=click.Choice(TABLE_MODES),
+    default="html",
+    show_default=True,
+)
+@click.option("-j", "--jobs", "max_workers", type=int, default=None)
+@click.option(
+    "--memory/--no-memory",
+    default=True,
+    help="Trace the peak memory of each stage, which slows Python code down.",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(path_type=Path),
+    default=None,
+    help="JSON file with the results of a previous run to compare with.",
+)
+@click.option("--save-baseline", is_flag=True, help="Write the results to --baseline.")
+@click.option("--tolerance", type=float, default=1.5, show_default=True)
+def benchmark(
+    responses: tuple[int, ...],
+    questions: tuple[int, ...],
+    seed: int,
+    pdf: bool,
+    pdf_backend: str,
+    table_mode: str,
+    max_workers: int | None,
+    memory: bool,
+    baseline: Path | None,
+    save_baseline: bool,
+    tolerance: float,
+) -> None:
+    basicConfig(level=WARNING)
+    options = {
+        "seed": seed,
+        "pdf": pdf,
+        "pdf_backend": pdf_backend,
+        "table_mode": table_mode,
+        "max_workers": max_workers,
+        "memory": memory,
+    }
+    results: dict[str, Any] = {"options": options, "cases": {}}
+    for n_responses in responses:
+        for n_questions in questions:
+            case = f"{n_responses}x{n_questions}"
+            result = run_case(
+                n_responses,
+                n_questions,
+                seed=seed,
+                pdf=pdf,
+                pdf_backend=pdf_backend,
+                table_mode=table_mode,
+                max_workers=max_workers,
+                trace_memory=memory,
+            )
+            results["cases"][case] = result
+            click.echo(f"{case}: {result['total_seconds']:.3f} s")
+            for name, stats in result["stages"].items():
+                click.echo(
+                    f"  {name:<12}{stats['seconds']:>9.3f} s{stats['peak_mb']:>9.1f} MB"
+                )
+
+    if baseline is None:
+        return
+    if save_baseline:
+        baseline.write_text(json.dumps(results, indent=2))
+        click.echo(f"Saved the baseline to {baseline}")
+        return
+    stored = json.loads(baseline.read_text())
+    if stored["options"] != options:
+        raise click.ClickException(
+            f"The baseline was run with {stored['options']}, not {options}"
+        )
+    failed = False
+    for case, result in results["cases"].items():
+        if case not in stored["cases"]:
+            click.echo(f"{case}: not in the baseline")
+            continue
+        for regression in compare(result, stored["cases"][case], tolerance=tolerance):
+            click.echo(f"{case}: {regression}", err=True)
+            failed = True
+    if failed:
+        raise SystemExit(1)
+    click.echo("No regressions")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import warnings
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from .workers import process_pool
+
+# resamples per task. Fixed so that the result does not depend on max_workers
+SHARD_SIZE = 500
+# answers times resamples below which starting processes takes longer
+PARALLEL_MIN_SIZE = 10**8
+
+
+def resample_weights(
+    rng: np.random.Generator, n: int, size: int
+) -> npt.NDArray[np.int64]:
+    # how many times each of the n rows is drawn in each of the size resamples,
+    # from one array of indices
+    indices = rng.integers(0, n, size=(size, n))
+    offsets = np.arange(size)[:, None] * n
+    return np.bincount((indices + offsets).ravel(), minlength=size * n).reshape(size, n)
+
+
+def bootstrap_statistics(
+    X: npt.NDArray[np.float64],
+    item_groups: npt.NDArray[np.intp],
+    n_groups: int,
+    weights: npt.NDArray[np.int64],
+) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    # the mean of the per-respondent group means and Cronbach's alpha
+    # (pairwise covariances, as in pingouin) of each group for each resample.
+    # Returns two arrays of shape (resamples, groups).
+    mask = ~np.isnan(X)
+    M = mask.astype(float)
+    X0 = np.where(mask, X, 0.0)
+    W = weights.astype(float)
+
+    G = np.eye(n_groups)[item_groups]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        group_means = (X0 @ G) / (M @ G)
+    answered = ~np.isnan(group_means)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = (W @ np.where(answered, group_means, 0.0)) / (W @ answered)
+
+    alphas = np.full((len(W), n_groups), np.nan)
+    for group in range(n_groups):
+        idx = np.flatnonzero(item_groups == group)
+        k = len(idx)
+        if k < 2:
+            continue
+        Mg, Xg = M[:, idx], X0[:, idx]
+        # the moments of Moments.from_array for each resample
+        n = np.einsum("bi,ij,ik->bjk", W, Mg, Mg)
+        s = np.einsum("bi,ij,ik->bjk", W, Xg, Mg)
+        c = np.einsum("bi,ij,ik->bjk", W, Xg, Xg)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            C = (c - s * s.transpose(0, 2, 1) / n) / (n - 1)
+            alphas[:, group] = (k / (k - 1)) * (
+                1 - np.trace(C, axis1=1, axis2=2) / C.sum(axis=(1, 2))
+            )
+    return means, alphas
+
+
+def _bootstrap_shard(
+    X: npt.NDArray[np.float64],
+    item_groups: npt.NDArray[np.intp],
+    n_groups: int,
+    seed: np.random.SeedSequence,
+    size: int,
+) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    weights = resample_weights(np.random.default_rng(seed), len(X), size)
+    return bootstrap_statistics(X, item_groups, n_groups, weights)
+
+
+def bootstrap_ci(
+    df_likert: pd.DataFrame,
+    n_resamples: int = 1000,
+    *,
+    ci: float = 0.95,
+    seed: int = 0,
+    max_workers: int | None = None,
+) -> pd.DataFrame:
+    # percentile bootstrap CIs of the mean and alpha of each group of
+    # df_likert, whose columns are indexed by (group, question)
+    item_groups, groups = pd.factorize(df_likert.columns.get_level_values("group"))
+    X = df_likert.to_numpy(dtype=float)
+    sizes = [
+        min(SHARD_SIZE, n_resamples - start)
+        for start in range(0, n_resamples, SHARD_SIZE)
+    ]
+    # every shard has its own stream, so the result only depends on seed
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(X, item_groups, len(groups), s, size) for s, size in zip(seeds, sizes)]
+    if max_workers == 1 or len(sizes) <= 1 or X.size * n_resamples < PARALLEL_MIN_SIZE:
+        results = [_bootstrap_shard(*arg) for arg in args]
+    else:
+        with process_pool(
+            max_workers=min(max_workers or len(sizes), len(sizes))
+        ) as executor:
+            results = list(executor.map(_bootstrap_shard, *zip(*args)))
+    means = np.concatenate([result[0] for result in results])
+    alphas = np.concatenate([result[1] for result in results])
+
+    q = [(1 - ci) / 2 * 100, (1 + ci) / 2 * 100]
+
+    def _ci(values: npt.NDArray[np.float64]) -> list[npt.NDArray[np.float64] | float]:
+        with warnings.catch_warnings():
+            # groups without any answers
+            warnings.simplefilter("ignore", RuntimeWarning)
+            bounds = np.nanpercentile(values, q, axis=0).T
+        return [
+            np.round(bound, 3) if not np.isnan(bound).all() else np.nan
+            for bound in bounds
+        ]
+
+    return pd.DataFrame(
+        {f"mean_{ci}": _ci(means), f"alpha_{ci}_bootstrap": _ci(alphas)},
+        index=pd.Index(groups, name="group"),
+    )
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections.abc import Iterable
+from datetime import timedelta
+from logging import getLogger
+from pathlib import Path
+
+from . import __version__
+
+DEFAULT_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "lab-student-survey"
+)
+INPUT_PATHS = ["metadata.csv", "metadata_group_name.csv"]
+# directories of the default cache directory which are not cached reports
+RESERVED_NAMES = {"downloads", "responses"}
+
+LOG = getLogger(__name__)
+
+
+def cache_key(
+    csv_content: str,
+    privacy_scopes: list[str] | None,
+    *,
+    input_paths: Iterable[Path | str] = INPUT_PATHS,
+    **options: object,
+) -> str:
+    h = hashlib.sha256()
+    h.update(__version__.encode())
+    h.update(csv_content.encode())
+    for path in input_paths:
+        path = Path(path)
+        h.update(path.name.encode())
+        h.update(path.read_bytes() if path.exists() else b"")
+    h.update(
+        json.dumps(
+            {"privacy_scopes": privacy_scopes, **options}, sort_keys=True, default=str
+        ).encode()
+    )
+    return h.hexdigest()
+
+
+def md5sum(path: Path | str) -> str:
+    # the checksum Google Drive reports as md5Checksum
+    h = hashlib.md5(usedforsecurity=False)
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _copy(src: Path | str, dst: Path | str) -> None:
+    if Path(src).is_dir():
+        shutil.rmtree(dst, ignore_errors=True)
+        shutil.copytree(src, dst)
+    else:
+        shutil.copyfile(src, dst)
+
+
+class ResultCache:
+    # reports keyed by cache_key(), one directory per key.
+    # The mtime of the directory is the last time the entry was used.
+    def __init__(
+        self,
+        root: Path | str = DEFAULT_CACHE_DIR,
+        *,
+        max_entries: int = 32,
+        max_age: timedelta = timedelta(days=30),
+    ) -> None:
+        self.root = Path(root)
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+    def get(self, key: str, paths: Iterable[Path | str]) -> list[Path] | None:
+        # restores paths and the other files of the entry (e.g. the reports of
+        # the shards), which are restored next to the first of paths.
+        # Returns all restored files, None if any of paths is not cached.
+        entry = self.root / key
+        files = [Path(path) for path in paths]
+        if not all((entry / file.name).exists() for file in files):
+            return None
+        names = {file.name for file in files}
+        files += [
+            files[0].parent / cached.name
+            for cached in sorted(entry.iterdir())
+            if cached.name not in names
+        ]
+        for file in files:
+            _copy(entry / file.name, file)
+        os.utime(entry)
+        return files
+
+    def put(self, key: str, paths: Iterable[Path | str]) -> None:
+        entry = self.root / key
+        tmp = self.root / f".{key}.{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for path in paths:
+            _copy(path, tmp / Path(path).name)
+        shutil.rmtree(entry, ignore_errors=True)
+        tmp.rename(entry)
+
+    def evict(self) -> None:
+        if not self.root.exists():
+            return
+        entries = sorted(
+            (
+                entry
+                for entry in self.root.iterdir()
+                # the files next to the entries (downloads.json, credentials)
+                # are not entries
+                if entry.is_dir()
+                and not entry.name.startswith(".")
+                and entry.name not in RESERVED_NAMES
+            ),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )
+        now = time.time()
+        for i, entry in enumerate(entries):
+            if (
+                i >= self.max_entries
+                or now - entry.stat().st_mtime > self.max_age.total_seconds()
+            ):
+                LOG.info(f"Evicting {entry.name} from the cache")
+                shutil.rmtree(entry, ignore_errors=True)
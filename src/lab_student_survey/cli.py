@@ -1,26 +1,243 @@
 from __future__ import annotations
 
 import os
+from collections.abc import Callable, Iterable
+from contextlib import nullcontext
 from logging import INFO, basicConfig
 from pathlib import Path
+from typing import Any, TypeVar
 
 import click
 
-from .main import main
+from .cache import DEFAULT_CACHE_DIR
+from .profiling import trace
+from .report import IMAGE_FORMATS, IMAGE_MODES, TABLE_MODES, ImageEncoding
+
+ALL_SCOPES = "all"
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+# the options of the analysis shared with the server, see main_options()
+ANALYSIS_OPTIONS = [
+    click.option(
+        "--scope-match",
+        # privacy.SCOPE_MATCHES
+        type=click.Choice(["any", "all"]),
+        default="any",
+        show_default=True,
+        help="Analyze the responses which chose any or all of the privacy scopes "
+        "of a report.",
+    ),
+    click.option("-j", "--jobs", "max_workers", type=int, required=False, default=None),
+    click.option("--pdf/--no-pdf", default=True),
+    click.option(
+        "--state-dir",
+        type=click.Path(),
+        required=False,
+        default=None,
+        help="Directory to keep running statistics in, "
+        "so that only new responses are processed.",
+    ),
+    click.option(
+        "--embedding-threshold",
+        type=float,
+        default=0.0,
+        show_default=True,
+        help="Relative change of the number of responses "
+        "above which the embeddings are recomputed (requires --state-dir).",
+    ),
+    click.option(
+        "--correlation",
+        # correlation.CORRELATION_METHODS, not imported to keep the CLI fast
+        type=click.Choice(["pearson", "spearman"]),
+        default="pearson",
+        show_default=True,
+    ),
+    click.option(
+        "--p-adjust",
+        # correlation.P_ADJUST_METHODS
+        type=click.Choice(["holm", "fdr_bh"]),
+        default=None,
+        help="Correct the p-values of the correlations for multiple comparisons.",
+    ),
+    click.option(
+        "--cluster-criterion",
+        # clustering.CLUSTER_CRITERIA
+        type=click.Choice(["silhouette", "gap"]),
+        default="silhouette",
+        show_default=True,
+        help="Criterion to choose the number of clusters with.",
+    ),
+    click.option(
+        "--trend",
+        # trends.TREND_PERIODS
+        type=click.Choice(["year", "term"]),
+        default=None,
+        help="Add the means of each group by academic year or term, "
+        "including the responses of previous exports.",
+    ),
+    click.option(
+        "--shard-by",
+        # shards.SHARD_KEYS
+        type=click.Choice(["supervisor", "department"]),
+        default=None,
+        help="Also write a small report for each supervisor or department "
+        "which compares its means with all responses.",
+    ),
+    click.option(
+        "--bootstrap",
+        "n_bootstrap",
+        type=int,
+        default=0,
+        help="Number of bootstrap resamples for the confidence intervals "
+        "of the group means and Cronbach's alpha (0 to skip).",
+    ),
+    click.option(
+        "--cache-dir",
+        type=click.Path(),
+        default=DEFAULT_CACHE_DIR,
+        show_default=True,
+        help="Directory to cache reports in, keyed by the contents of the inputs.",
+    ),
+    click.option("--cache/--no-cache", default=True),
+    click.option(
+        "--pdf-backend",
+        # pdf.PDF_BACKENDS
+        type=click.Choice(["auto", "wkhtmltopdf", "xhtml2pdf", "matplotlib"]),
+        default="auto",
+        show_default=True,
+        help="Convert the HTML with wkhtmltopdf or xhtml2pdf, or draw the tables "
+        "and figures with matplotlib. auto uses wkhtmltopdf if it is installed.",
+    ),
+    click.option(
+        "--images",
+        "image_mode",
+        type=click.Choice(IMAGE_MODES),
+        default="inline",
+        show_default=True,
+        help="Embed the figures in the HTML, write them next to it "
+        "or bundle both in a zip file.",
+    ),
+    click.option(
+        "--image-format",
+        type=click.Choice(IMAGE_FORMATS),
+        default="png",
+        show_default=True,
+        help="svg keeps the figures of the HTML as vector graphics.",
+    ),
+    click.option(
+        "--dpi",
+        type=float,
+        default=None,
+        help="Resolution of the PNG figures (100 by default).",
+    ),
+    click.option(
+        "--png-colors",
+        type=click.IntRange(0, 256),
+        default=0,
+        show_default=True,
+        help="Quantize the PNG figures to a palette of this many colors (0 to keep "
+        "full color), which makes them several times smaller.",
+    ),
+    click.option(
+        "--image-budget",
+        type=float,
+        default=None,
+        help="Total size in MB of the PNG figures of a report. "
+        "Their resolution is reduced until they fit.",
+    ),
+    click.option(
+        "--tables",
+        "table_mode",
+        type=click.Choice(TABLE_MODES),
+        default="html",
+        show_default=True,
+        help="With paged, long tables are shown a page at a time in the HTML "
+        "and only their first rows are in the PDF.",
+    ),
+]
+
+
+def analysis_options(command: F) -> F:
+    for option in reversed(ANALYSIS_OPTIONS):
+        command = option(command)
+    return command
+
+
+def main_options(
+    *,
+    cache_dir: str | Path,
+    cache: bool,
+    image_format: str,
+    dpi: float | None,
+    png_colors: int,
+    image_budget: float | None,
+    **options: Any,
+) -> dict[str, Any]:
+    # the keyword arguments of main() of the values of ANALYSIS_OPTIONS
+    return {
+        **options,
+        "cache_dir": cache_dir if cache else None,
+        "image_encoding": ImageEncoding(
+            image_format,
+            dpi,
+            png_colors,
+            int(image_budget * 2**20) if image_budget is not None else None,
+        ),
+    }
+
+
+def scope_jobs(
+    privacy_scopes: Iterable[str], out_path: Path | str = "output.html"
+) -> dict[Path | str, list[str] | None]:
+    # the output path and the privacy scopes of the report of each
+    # comma-separated privacy scope, out_path for ALL_SCOPES
+    jobs: dict[Path | str, list[str] | None] = {}
+    for scopes in privacy_scopes:
+        if scopes == ALL_SCOPES:
+            jobs[out_path] = None
+        else:
+            jobs[f"output.{scopes.replace(',', '_')}.html"] = scopes.split(",")
+    return jobs
 
 
 @click.command()
 @click.argument("file_url", type=str, required=False, default=None)
 @click.option("-f", "--folder-url", type=str, required=False, default=None)
 @click.option("-o", "--out-path", type=click.Path(), required=False, default=None)
-@click.option("-p", "--privacy-scopes", type=str, required=False, default=None)
-@click.option("--pdf/--no-pdf", default=True)
+@click.option(
+    "-p",
+    "--privacy-scopes",
+    type=str,
+    multiple=True,
+    help="Comma-separated privacy scopes. "
+    f"Repeat to render several scopes in one run, '{ALL_SCOPES}' for all responses.",
+)
+@analysis_options
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write the wall time, CPU time and max RSS growth of each stage "
+    "as a Chrome trace (chrome://tracing or Perfetto) to this JSON file.",
+)
+@click.option(
+    "--profile-stage",
+    type=str,
+    default=None,
+    help="Also write the cProfile stats of this stage (e.g. figures) "
+    "next to the --profile file.",
+)
 def cli(
     file_url: str | None = None,
     out_path: str | Path | None = None,
     folder_url: str | None = None,
-    privacy_scopes: str | None = None,
-    pdf: bool = True,
+    privacy_scopes: tuple[str, ...] = (),
+    profile_path: str | None = None,
+    profile_stage: str | None = None,
+    **options: Any,
 ) -> None:
     basicConfig(level=INFO)
     if file_url is None:
@@ -29,14 +246,15 @@ def cli(
         folder_url = os.environ.get("LAB_STUDENT_SURVEY_FOLDER_URL")
     if out_path is None:
         out_path = "output.html"
-    if privacy_scopes is not None:
-        out_path = f"output.{privacy_scopes.replace(',', '_')}.html"
-    main(
-        file_url,
-        folder_url=folder_url,
-        out_path=out_path,
-        privacy_scopes=privacy_scopes.split(",")
-        if privacy_scopes is not None
-        else None,
-        pdf=pdf,
-    )
+    jobs = scope_jobs(privacy_scopes or (ALL_SCOPES,), out_path)
+    if profile_stage is not None and profile_path is None:
+        raise click.UsageError("--profile-stage requires --profile")
+    with (
+        trace(profile_path, profile_stage=profile_stage)
+        if profile_path is not None
+        else nullcontext()
+    ):
+        # the analysis stack is imported only when a report is generated
+        from .main import main
+
+        main(file_url, folder_url=folder_url, jobs=jobs, **main_options(**options))
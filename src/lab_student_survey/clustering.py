@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from collections.abc import Mapping
+from typing import NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import PCA
+from sklearn.manifold import MDS, TSNE
+from sklearn.metrics import silhouette_score
+
+from .workers import process_pool
+
+CLUSTER_CRITERIA = ("silhouette", "gap")
+# MiniBatchKMeans is used from this many responses
+MINIBATCH_MIN_SAMPLES = 1000
+# MDS takes O(n^2) time and memory, PCA is used instead above this
+MDS_MAX_SAMPLES = 500
+# reference datasets of the gap statistic
+GAP_REFERENCES = 10
+# the embeddings are initialized from the cached ones if at least this
+# fraction of the responses was embedded before
+WARM_START_MIN_OVERLAP = 0.5
+# responses times features times k below which starting processes takes longer
+PARALLEL_MIN_SIZE = 10**6
+
+
+class Clustering(NamedTuple):
+    k: int
+    # the score of the criterion for k = 1, 2, ... (NaN where undefined)
+    scores: list[float]
+    labels: npt.NDArray[np.intp]
+
+
+def _kmeans(k: int, n_samples: int, seed: int) -> KMeans | MiniBatchKMeans:
+    if n_samples >= MINIBATCH_MIN_SAMPLES:
+        return MiniBatchKMeans(n_clusters=k, n_init="auto", random_state=seed)
+    return KMeans(n_clusters=k, n_init="auto", random_state=seed)
+
+
+def _score_k(
+    X: npt.NDArray[np.float64], k: int, criterion: str, seed: int
+) -> tuple[float, float, npt.NDArray[np.intp]]:
+    # the score, its standard error and the labels of k clusters
+    model = _kmeans(k, len(X), seed)
+    labels = model.fit_predict(X)
+    if criterion == "silhouette":
+        if not 1 < len(np.unique(labels)) < len(X):
+            return float("nan"), 0.0, labels
+        return float(silhouette_score(X, labels)), 0.0, labels
+
+    # gap statistic: log inertia of uniform data in the bounding box minus
+    # the log inertia of the data (Tibshirani et al., 2001)
+    rng = np.random.default_rng(seed)
+    low, high = X.min(axis=0), X.max(axis=0)
+    log_w_ref = np.log(
+        [
+            _kmeans(k, len(X), seed).fit(rng.uniform(low, high, size=X.shape)).inertia_
+            for _ in range(GAP_REFERENCES)
+        ]
+    )
+    with np.errstate(divide="ignore"):
+        gap = float(log_w_ref.mean() - np.log(model.inertia_))
+    return gap, float(log_w_ref.std() * np.sqrt(1 + 1 / GAP_REFERENCES)), labels
+
+
+def select_k(
+    X: npt.NDArray[np.float64] | pd.DataFrame,
+    max_k: int = 8,
+    *,
+    criterion: str = "silhouette",
+    max_workers: int | None = None,
+    seed: int = 0,
+) -> Clustering:
+    # k-means for every k up to max_k, evaluated in parallel, choosing
+    # the k with the highest silhouette or the smallest k whose gap is
+    # within one standard error of the gap of k + 1
+    if criterion not in CLUSTER_CRITERIA:
+        raise ValueError(f"criterion must be one of {CLUSTER_CRITERIA}")
+    X = np.asarray(X, dtype=float)
+    # every response in its own cluster has no score
+    ks = list(range(1, min(max_k, max(len(X) - 1, 1)) + 1))
+    if not ks:
+        return Clustering(1, [], np.zeros(len(X), dtype=int))
+    if max_workers == 1 or len(ks) <= 1 or X.size * len(ks) < PARALLEL_MIN_SIZE:
+        results = [_score_k(X, k, criterion, seed) for k in ks]
+    else:
+        with process_pool(max_workers=min(max_workers or len(ks), len(ks))) as executor:
+            n = len(ks)
+            results = list(
+                executor.map(_score_k, [X] * n, ks, [criterion] * n, [seed] * n)
+            )
+    scores = [result[0] for result in results]
+    if criterion == "silhouette":
+        best = int(np.argmax(np.nan_to_num(scores, nan=-np.inf))) + 1
+    else:
+        best = next(
+            (k for k in ks[:-1] if scores[k - 1] >= scores[k] - results[k][1]),
+            ks[-1],
+        )
+    return Clustering(best, scores, results[best - 1][2])
+
+
+def warm_start(
+    X: npt.NDArray[np.float64] | pd.DataFrame, positions: npt.NDArray[np.float64]
+) -> npt.NDArray[np.float64]:
+    # positions of the responses which were embedded before, and the position
+    # of the nearest of them for new responses (rows of NaN)
+    X = np.asarray(X, dtype=float)
+    known = ~np.isnan(positions).any(axis=1)
+    init = positions.copy()
+    if known.any() and not known.all():
+        distances = ((X[~known, None, :] - X[None, known, :]) ** 2).sum(axis=2)
+        init[~known] = positions[known][distances.argmin(axis=1)]
+    return init
+
+
+def embed(
+    X: npt.NDArray[np.float64] | pd.DataFrame,
+    *,
+    init: Mapping[str, npt.NDArray[np.float64]] | None = None,
+    seed: int = 0,
+) -> dict[str, npt.NDArray[np.float64]]:
+    # 2D embeddings by name. init maps names to starting positions.
+    X = np.asarray(X, dtype=float)
+    init = init or {}
+    embeddings = {}
+    if len(X) <= MDS_MAX_SAMPLES:
+        embeddings["MDS"] = np.asarray(
+            MDS(
+                n_components=2, normalized_stress="auto", random_state=seed
+            ).fit_transform(X, init=init.get("MDS"))
+        )
+    else:
+        n_components = min(2, *X.shape)
+        embeddings["PCA"] = np.pad(
+            np.asarray(PCA(n_components, random_state=seed).fit_transform(X)),
+            ((0, 0), (0, 2 - n_components)),
+        )
+    if len(X) > 1:
+        embeddings["TSNE"] = np.asarray(
+            TSNE(
+                n_components=2,
+                perplexity=min(2, len(X) - 1),
+                init=init.get("TSNE", "pca"),
+                random_state=seed,
+            ).fit_transform(X)
+        )
+    return embeddings
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from typing import NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from .incremental import Moments, pearson_pvalues
+
+CORRELATION_METHODS = ("pearson", "spearman")
+# same names as statsmodels.stats.multitest.multipletests
+P_ADJUST_METHODS = ("holm", "fdr_bh")
+
+
+class Correlation(NamedTuple):
+    r: pd.DataFrame
+    pvalues: pd.DataFrame
+    # number of pairwise complete observations
+    n: pd.DataFrame
+
+
+def adjust_pvalues(p: npt.NDArray[np.float64], method: str) -> npt.NDArray[np.float64]:
+    # adjusts the p-values of each pair once, ignoring the diagonal
+    if method not in P_ADJUST_METHODS:
+        raise ValueError(f"method must be one of {P_ADJUST_METHODS}")
+    p = np.array(p, dtype=float)
+    rows, cols = np.triu_indices_from(p, k=1)
+    pairs = p[rows, cols]
+    valid = np.flatnonzero(~np.isnan(pairs))
+    order = valid[np.argsort(pairs[valid], kind="stable")]
+    m = len(order)
+    sorted_p = pairs[order]
+    if method == "holm":
+        adjusted = np.maximum.accumulate((m - np.arange(m)) * sorted_p)
+    else:
+        ranks = np.arange(1, m + 1)
+        adjusted = np.minimum.accumulate((m / ranks * sorted_p)[::-1])[::-1]
+    pairs[order] = np.minimum(adjusted, 1.0)
+    p[rows, cols] = pairs
+    p[cols, rows] = pairs
+    return p
+
+
+def correlate(
+    df: pd.DataFrame,
+    method: str = "pearson",
+    *,
+    p_adjust: str | None = None,
+    moments: Moments | None = None,
+) -> Correlation:
+    # r and the p-values of all pairs of columns with pairwise deletion of NaN,
+    # from the matrix products in Moments instead of one scipy call per pair.
+    # Spearman ranks each column over its own answers, so it differs from
+    # DataFrame.corr("spearman") only for pairs with missing values.
+    if method not in CORRELATION_METHODS:
+        raise ValueError(f"method must be one of {CORRELATION_METHODS}")
+    if moments is None:
+        X = (df.rank() if method == "spearman" else df).to_numpy(dtype=float)
+        # standardize first, r does not change but the sums do not cancel out
+        with np.errstate(divide="ignore", invalid="ignore"):
+            X = X - np.nanmean(X, axis=0)
+            scale = np.sqrt(np.nanmean(X**2, axis=0))
+        moments = Moments.from_array(X / np.where(scale > 0, scale, 1.0))
+    elif method != "pearson":
+        raise ValueError("moments of the answers can only give pearson correlations")
+
+    r = moments.corr()
+    p = pearson_pvalues(r, moments.n)
+    # like pearsonr(x, x) for columns with any answer
+    diag = np.diag_indices_from(p)
+    p[diag] = np.where(np.diag(moments.n) > 0, 0.0, np.nan)
+    if p_adjust is not None:
+        p = adjust_pvalues(p, p_adjust)
+    return Correlation(
+        pd.DataFrame(r, index=df.columns, columns=df.columns),
+        pd.DataFrame(p, index=df.columns, columns=df.columns),
+        pd.DataFrame(moments.n, index=df.columns, columns=df.columns),
+    )
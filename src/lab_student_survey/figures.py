@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+from collections import Counter, deque
+from collections.abc import Callable, Hashable, Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from logging import getLogger
+from typing import Any, NamedTuple
+
+import matplotlib
+import pandas as pd
+import seaborn as sns
+from japanize_matplotlib import japanize
+from matplotlib.figure import Figure
+
+from .profiling import add_worker_trace, run_traced, stage, trace_options
+from .report import ImageEncoding
+from .workers import process_pool
+
+MATPLOTLIB_FONT_FAMILY = "IPAexGothic"
+# how many times the figures are rendered again to fit ImageEncoding.budget
+BUDGET_ATTEMPTS = 3
+
+LOG = getLogger(__name__)
+
+
+class FigureSpec(NamedTuple):
+    # a figure which is built by calling func(*args, **kwargs),
+    # so that it can be rendered in another process.
+    # dpi overrides the resolution of ImageEncoding for this figure.
+    func: Callable[..., Figure]
+    args: tuple[Any, ...] = ()
+    kwargs: dict[str, Any] = {}
+    dpi: float | None = None
+
+    def build(self) -> Figure:
+        return self.func(*self.args, **self.kwargs)
+
+
+def set_font() -> None:
+    # matplotlib.style.use(matplotx.styles.dracula)
+    if MATPLOTLIB_FONT_FAMILY == "IPAexGothic":
+        japanize()
+    else:
+        matplotlib.rcParams["font.family"] = MATPLOTLIB_FONT_FAMILY
+
+
+def plot_empty() -> Figure:
+    return Figure()
+
+
+def plot_cluster_scores(scores: Sequence[float], criterion: str) -> Figure:
+    fig = Figure()
+    ax = fig.subplots()
+    ax.set_title(f"{criterion.capitalize()} of k-means for each k")
+    ax.plot(range(1, len(scores) + 1), scores, marker="o")
+    ax.set_xlabel("k")
+    return fig
+
+
+def plot_embedding(emb_res: pd.DataFrame, name: str) -> Figure:
+    fig = Figure(figsize=(7, 7))
+    ax = fig.subplots()
+    ax.set_title(f"Scatter plot of {name}")
+    # annotate index
+    sns.scatterplot(data=emb_res, x=0, y=1, hue="cluster", ax=ax)
+    for i, row in emb_res.iterrows():
+        ax.annotate(i, (row.iat[0], row.iat[1]))
+    return fig
+
+
+def plot_mean(df_likert_mean: pd.DataFrame, drop_columns: Sequence[str]) -> Figure:
+    fig = Figure(figsize=(12, 10))
+    ax = fig.subplots(ncols=2)
+    sns.barplot(
+        y=df_likert_mean["mean"].index, x=df_likert_mean["mean"], orient="h", ax=ax[0]
+    )
+    df_likert_mean.sort_index(axis=0, inplace=False, ascending=False).drop(
+        columns=list(drop_columns), inplace=False
+    ).plot(kind="barh", ax=ax[1], stacked=True)
+    return fig
+
+
+def plot_heatmap(df: pd.DataFrame) -> Figure:
+    fig = Figure(figsize=(10, 10))
+    sns.heatmap(df, annot=True, ax=fig.subplots())
+    return fig
+
+
+def plot_colwise(df_likert_colwise: pd.DataFrame, sharex: bool = True) -> Figure:
+    df_numeric = df_likert_colwise.select_dtypes("number")
+    fig = Figure(figsize=(10, 10))
+    axes = fig.subplots(nrows=df_numeric.shape[1], sharex=sharex, squeeze=False)
+    df_numeric.plot(kind="barh", subplots=True, ax=axes[:, 0], sharex=sharex)
+    return fig
+
+
+def plot_trend(df_trend: pd.DataFrame) -> Figure:
+    # one line per group over the periods (rows of df_trend)
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    df_trend.plot(ax=ax, marker="o")
+    ax.set_xticks(range(len(df_trend)), df_trend.index, rotation=45)
+    ax.set_title("Mean of each group by period")
+    return fig
+
+
+def plot_comparison(df_comparison: pd.DataFrame) -> Figure:
+    # the means of a shard and the overall means with their std by group,
+    # the first three columns of df_comparison (see shards.compare_shards)
+    mean, overall_mean, overall_std = df_comparison.columns[:3]
+    df = df_comparison.iloc[::-1]
+    fig = Figure(figsize=(10, 6))
+    df[[mean, overall_mean]].plot(
+        kind="barh", ax=fig.subplots(), xerr={overall_mean: df[overall_std]}
+    )
+    return fig
+
+
+def quantize_png(png: bytes, colors: int) -> bytes:
+    # png with a palette of at most colors colors, or png if that is not smaller
+    from PIL import Image
+
+    with Image.open(BytesIO(png)) as image, BytesIO() as buf:
+        image.quantize(colors, method=Image.Quantize.FASTOCTREE).save(
+            buf, format="png", optimize=True
+        )
+        quantized = buf.getvalue()
+    return quantized if len(quantized) < len(png) else png
+
+
+def render_figure(
+    figure: FigureSpec | Figure,
+    format: str = "png",
+    encoding: ImageEncoding = ImageEncoding(),
+    scale: float = 1.0,
+) -> bytes:
+    # the figure in format with the resolution and the palette of encoding,
+    # scale multiplies the resolution to fit the budget of a report
+    fig = figure.build() if isinstance(figure, FigureSpec) else figure
+    dpi = (
+        (figure.dpi if isinstance(figure, FigureSpec) else None)
+        or encoding.dpi
+        or fig.dpi
+    )
+    with BytesIO() as buf:
+        try:
+            fig.tight_layout()
+        except Exception as e:
+            LOG.warning(e)
+        fig.savefig(buf, format=format, dpi=dpi * scale)
+        data = buf.getvalue()
+    if format == "png" and encoding.colors:
+        data = quantize_png(data, encoding.colors)
+    return data
+
+
+def _encode_figure(spec: FigureSpec, encoding: ImageEncoding, scale: float) -> bytes:
+    return render_figure(spec, encoding.format, encoding, scale)
+
+
+def _encode_worker_figure(
+    spec: FigureSpec, encoding: ImageEncoding, scale: float
+) -> bytes:
+    # a span of its own in the trace of the worker, see run_traced()
+    with stage("figure", func=getattr(spec.func, "__name__", str(spec.func))):
+        return _encode_figure(spec, encoding, scale)
+
+
+def _spec_key(spec: FigureSpec, i: int) -> Hashable:
+    # equal for specs which draw the same figure, e.g. plot_empty(),
+    # specs with unhashable arguments such as DataFrames are all different
+    key = (spec.func, spec.args, tuple(sorted(spec.kwargs.items())), spec.dpi)
+    try:
+        hash(key)
+    except TypeError:
+        return i
+    return key
+
+
+def _init_worker() -> None:
+    matplotlib.use("Agg")
+    set_font()
+
+
+def figure_workers(max_workers: int | None = None) -> ProcessPoolExecutor:
+    # worker processes which render figures, to share between the
+    # render_figures() of several reports
+    return process_pool(max_workers=max_workers, initializer=_init_worker)
+
+
+def _encode_figures(
+    specs: Sequence[FigureSpec],
+    encoding: ImageEncoding,
+    scale: float,
+    executor: ProcessPoolExecutor | None,
+) -> Iterator[bytes]:
+    # starts encoding all figures right away in executor, in this process
+    # without it, and yields the bytes in order
+    if executor is None or len(specs) <= 1:
+        encode = partial(_encode_figure, encoding=encoding, scale=scale)
+        return (encode(spec) for spec in specs)
+
+    options = trace_options()
+    futures = deque(
+        executor.submit(
+            run_traced, options, _encode_worker_figure, spec, encoding, scale
+        )
+        for spec in specs
+    )
+    # pop the futures so that the bytes are not kept after they are consumed
+    return (add_worker_trace(futures.popleft().result()) for _ in range(len(futures)))
+
+
+def _fit_budget(
+    specs: Sequence[FigureSpec],
+    counts: Sequence[int],
+    encoding: ImageEncoding,
+    executor: ProcessPoolExecutor | None,
+) -> list[bytes]:
+    # the figures with their resolution reduced until the PNGs, each counted
+    # as many times as it is in the report, fit in encoding.budget bytes.
+    # The size of a PNG is roughly proportional to its number of pixels.
+    assert encoding.budget is not None
+    scale = 1.0
+    images = list(_encode_figures(specs, encoding, scale, executor))
+    for _ in range(BUDGET_ATTEMPTS):
+        total = sum(len(image) * count for image, count in zip(images, counts))
+        if total <= encoding.budget:
+            return images
+        scale *= 0.95 * (encoding.budget / total) ** 0.5
+        LOG.info(
+            f"The figures take {total} bytes, more than {encoding.budget} bytes, "
+            f"rendering them at {scale:.0%} of their resolution"
+        )
+        images = list(_encode_figures(specs, encoding, scale, executor))
+    total = sum(len(image) * count for image, count in zip(images, counts))
+    if total > encoding.budget:
+        LOG.warning(
+            f"The figures take {total} bytes, more than {encoding.budget} bytes"
+        )
+    return images
+
+
+def render_figures(
+    specs: Sequence[FigureSpec],
+    *,
+    max_workers: int | None = None,
+    encoding: ImageEncoding = ImageEncoding(),
+    executor: ProcessPoolExecutor | None = None,
+) -> Iterator[bytes]:
+    # starts rendering all figures right away and yields their bytes in order.
+    # Equal specs (see _spec_key()) are rendered once. With a budget, the PNGs
+    # are all rendered before the first is yielded. The figures are rendered
+    # in executor (see figure_workers()) if given, otherwise in a pool of
+    # max_workers processes started for this call, in this process with 1.
+    keys = [_spec_key(spec, i) for i, spec in enumerate(specs)]
+    unique = dict(zip(reversed(keys), reversed(specs)))
+    counts = Counter(keys)
+    unique_specs = [unique[key] for key in counts]
+    pool = None
+    if executor is None and max_workers != 1 and len(unique_specs) > 1:
+        # also used by every attempt to fit the budget
+        pool = executor = figure_workers(
+            min(max_workers or len(unique_specs), len(unique_specs))
+        )
+    try:
+        if encoding.budget is not None and encoding.format == "png":
+            images = iter(
+                _fit_budget(unique_specs, list(counts.values()), encoding, executor)
+            )
+        else:
+            images = _encode_figures(unique_specs, encoding, 1.0, executor)
+    finally:
+        if pool is not None:
+            # the submitted figures are still rendered after shutdown
+            pool.shutdown(wait=False)
+
+    def in_order() -> Iterator[bytes]:
+        # the bytes of a repeated figure are kept until its last use
+        rendered: dict[Hashable, bytes] = {}
+        for key in keys:
+            if key not in rendered:
+                rendered[key] = next(images)
+            image = rendered[key]
+            counts[key] -= 1
+            if not counts[key]:
+                del rendered[key]
+            yield image
+
+    return in_order()
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from collections.abc import Sequence
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+# changing tokenize() invalidates the cached tokens
+TOKENIZER_VERSION = 1
+# runs of kanji, katakana or latin letters and digits. Hiragana are mostly
+# particles and okurigana, which are dropped.
+TOKEN_PATTERN = re.compile(r"[一-鿿々〆ヵヶ]+|[ァ-ヺー]+|[a-z0-9]+")
+STOPWORDS = frozenset({"特記事項", "以上", "現状", "全般"})
+MIN_TOKEN_LENGTH = 2
+
+LOG = getLogger(__name__)
+
+
+def tokenize(text: str) -> list[str]:
+    # the keywords of a Japanese answer, in the order they appear
+    text = unicodedata.normalize("NFKC", text).lower()
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text)
+        if len(token) >= MIN_TOKEN_LENGTH and token not in STOPWORDS
+    ]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+class TokenCache:
+    # the tokens of each answer seen so far by the hash of its text, kept in
+    # path if given so that only new answers are tokenized in the next run
+    def __init__(self, path: Path | str | None = None) -> None:
+        self.path = Path(path) if path is not None else None
+        self.tokens: dict[str, list[str]] = {}
+        self.modified = False
+        if self.path is not None and self.path.exists():
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data["version"] == TOKENIZER_VERSION:
+                self.tokens = data["tokens"]
+            else:
+                LOG.info(f"Discarding outdated tokens {self.path}")
+
+    def get(self, texts: Sequence[str]) -> list[list[str]]:
+        # the tokens of each of texts, tokenizing those which are not cached
+        hashes = [text_hash(text) for text in texts]
+        new = [i for i, h in enumerate(hashes) if h not in self.tokens]
+        LOG.info(f"Tokenizing {len(new)} of {len(texts)} distinct answers")
+        for i in new:
+            self.tokens[hashes[i]] = tokenize(texts[i])
+        self.modified = self.modified or bool(new)
+        return [self.tokens[h] for h in hashes]
+
+    def save(self) -> None:
+        if self.path is None or not self.modified:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # the reports of several scopes may save at the same time
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+        tmp.write_text(
+            json.dumps(
+                {"version": TOKENIZER_VERSION, "tokens": self.tokens},
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+        os.replace(tmp, self.path)
+        self.modified = False
+
+
+@dataclass
+class FreeTextIndex:
+    # the keywords of the free text answers: each (response, keyword) pair
+    # once, with responses as positions into the rows of the answers
+    rows: npt.NDArray[np.intp]
+    keywords: npt.NDArray[np.object_]
+
+    @classmethod
+    def build(cls, answers: pd.DataFrame, cache: TokenCache) -> FreeTextIndex:
+        # answers has a row per response and a column per free text question.
+        # Each distinct answer is tokenized once.
+        values = answers.to_numpy(dtype=object)
+        rows = np.repeat(np.arange(len(values)), values.shape[1])
+        codes, uniques = pd.factorize(values.ravel())
+        tokens = cache.get([str(text) for text in uniques])
+        # the pairs of the code of each distinct answer and its keywords
+        token_codes = np.repeat(np.arange(len(tokens)), [len(t) for t in tokens])
+        answer_keywords = np.array([token for t in tokens for token in t], dtype=object)
+        pairs = pd.DataFrame({"row": rows[codes >= 0], "code": codes[codes >= 0]})
+        pairs = pairs.merge(
+            pd.DataFrame({"code": token_codes, "keyword": answer_keywords}), on="code"
+        ).drop_duplicates(["row", "keyword"])
+        return cls(pairs["row"].to_numpy(), pairs["keyword"].to_numpy(dtype=object))
+
+    @property
+    def postings(self) -> pd.Series:
+        # the inverted index: the sorted rows of the responses of each keyword
+        keywords = self.keywords.astype(str)
+        order = np.lexsort((self.rows, keywords))
+        names, starts = np.unique(keywords[order], return_index=True)
+        return pd.Series(
+            np.split(self.rows[order], starts[1:]) if len(names) else [],
+            index=names,
+            dtype=object,
+        )
+
+    def search(self, keyword: str) -> npt.NDArray[np.intp]:
+        # the rows of the responses which mention keyword
+        keyword = unicodedata.normalize("NFKC", keyword).lower()
+        return np.sort(self.rows[self.keywords == keyword])
+
+    def frequencies(self, labels: npt.NDArray[np.str_] | pd.Index) -> pd.DataFrame:
+        # the number of responses of each label which mention each keyword
+        return pd.crosstab(
+            self.keywords, np.asarray(labels)[self.rows], rownames=["キーワード"]
+        )
+
+
+def keyword_summary(
+    index: FreeTextIndex,
+    groups: npt.NDArray[np.str_],
+    supervisors: pd.Index,
+    n: int,
+) -> pd.DataFrame:
+    # the n most frequent keywords with the number of responses which mention
+    # them in total and in each group, and the number of supervisors
+    by_group = index.frequencies(groups)
+    by_supervisor = index.frequencies(supervisors)
+    summary = pd.concat(
+        [
+            by_group.sum(axis=1).rename("回答数"),
+            by_group,
+            (by_supervisor > 0).sum(axis=1).rename("指導教員数"),
+        ],
+        axis=1,
+    )
+    summary.columns.name = None
+    return summary.sort_values("回答数", ascending=False, kind="stable").head(n)
+
+
+def supervisor_keywords(
+    index: FreeTextIndex, supervisors: pd.Index, n: int
+) -> pd.Series:
+    # the n most frequent keywords of the responses of each supervisor
+    by_supervisor = index.frequencies(supervisors)
+    return pd.Series(
+        {
+            supervisor: ", ".join(
+                f"{keyword}({count})"
+                for keyword, count in counts[counts > 0]
+                .sort_values(ascending=False, kind="stable")
+                .head(n)
+                .items()
+            )
+            for supervisor, counts in by_supervisor.items()
+        },
+        name="キーワード",
+    ).rename_axis(supervisors.name)
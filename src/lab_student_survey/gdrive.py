@@ -1,11 +1,27 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import os
+from collections.abc import Iterable
+from functools import lru_cache
 from logging import getLogger
 from pathlib import Path
+from threading import Lock
 
+from googleapiclient.http import MediaFileUpload
 from pydrive2.auth import GoogleAuth
 from pydrive2.drive import GoogleDrive
+from pydrive2.files import GoogleDriveFile
+
+from .cache import DEFAULT_CACHE_DIR, md5sum
+
+# the metadata used by this package, requested instead of all fields
+FILE_FIELDS = "id,title,mimeType,md5Checksum,modifiedDate,alternateLink,parents"
+# files larger than this are uploaded in chunks which are retried on their own
+RESUMABLE_UPLOAD_THRESHOLD = 5 * 1024 * 1024
+# must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
 
 LOG = getLogger(__name__)
 
@@ -27,17 +43,179 @@ def get_auth() -> GoogleAuth:
                 auth.LocalWebserverAuth()
                 return auth
         LOG.info("Using service-secrets.json")
+        # cache the access token until it expires,
+        # per service account in case service-secrets.json changes
+        secrets_hash = hashlib.sha256(
+            Path("service-secrets.json").read_bytes()
+        ).hexdigest()[:16]
         auth = GoogleAuth(
             settings={
                 "client_config_backend": "service",
                 "service_config": {
                     "client_json_file_path": "service-secrets.json",
                 },
+                "save_credentials": True,
+                "save_credentials_backend": "file",
+                "save_credentials_file": str(
+                    DEFAULT_CACHE_DIR / f"credentials-{secrets_hash}.json"
+                ),
             }
         )
+        DEFAULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
         auth.ServiceAuth()
         return auth
 
 
+@lru_cache(maxsize=None)
 def get_drive() -> GoogleDrive:
+    # one authorized client (and HTTP connection per thread) per process
     return GoogleDrive(get_auth())
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+class DriveFolder:
+    # index of the files in a folder by title, listed with one query
+    # for all titles which are looked up later
+    def __init__(
+        self, drive: GoogleDrive, folder_id: str, titles: Iterable[str] = ()
+    ) -> None:
+        self.drive = drive
+        self.folder_id = folder_id
+        self.files: dict[str, GoogleDriveFile | None] = {}
+        self.fetch(titles)
+
+    def fetch(self, titles: Iterable[str]) -> None:
+        titles = [title for title in dict.fromkeys(titles) if title not in self.files]
+        if not titles:
+            return
+        query = " or ".join(f"title = {_quote(title)}" for title in titles)
+        filelist = self.drive.ListFile(
+            {
+                "q": f"{_quote(self.folder_id)} in parents and trashed=false "
+                f"and ({query})",
+                "fields": f"nextPageToken,items({FILE_FIELDS})",
+            }
+        ).GetList()
+        for title in titles:
+            self.files[title] = next(
+                (file for file in filelist if file["title"] == title), None
+            )
+
+    def get(self, title: str) -> GoogleDriveFile | None:
+        self.fetch([title])
+        return self.files[title]
+
+    def create_or_get(self, title: str, mimetype: str) -> GoogleDriveFile:
+        file = self.get(title)
+        if file is None:
+            file = self.drive.CreateFile(
+                {
+                    "title": title,
+                    "mime_type": mimetype,
+                    "parents": [{"id": self.folder_id}],
+                }
+            )
+            self.files[title] = file
+        return file
+
+
+class DownloadManifest:
+    # the remote revision of each downloaded file, so that a file is only
+    # downloaded again when it changed on Drive or locally
+    def __init__(self, path: Path | str = DEFAULT_CACHE_DIR / "downloads.json") -> None:
+        self.path = Path(path)
+        self.entries: dict[str, dict[str, str | None]] = (
+            json.loads(self.path.read_text()) if self.path.exists() else {}
+        )
+        # files are downloaded concurrently
+        self.lock = Lock()
+
+    def is_current(self, file: GoogleDriveFile, path: Path | str) -> bool:
+        path = Path(path)
+        if not path.exists():
+            return False
+        if file.get("md5Checksum") is not None:
+            return bool(file["md5Checksum"] == md5sum(path))
+        # Google Docs have no checksum, only a modification date
+        entry = self.entries.get(str(path.resolve()))
+        return (
+            entry is not None
+            and entry["id"] == file["id"]
+            and entry["modifiedDate"] == file.get("modifiedDate")
+            and entry["md5"] == md5sum(path)
+        )
+
+    def record(self, file: GoogleDriveFile, path: Path | str) -> None:
+        entry = {
+            "id": file["id"],
+            "modifiedDate": file.get("modifiedDate"),
+            "md5": md5sum(path),
+        }
+        with self.lock:
+            self.entries[str(Path(path).resolve())] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.entries, indent=2))
+
+
+def download_file(
+    file: GoogleDriveFile,
+    path: Path | str,
+    manifest: DownloadManifest | None,
+    *,
+    mimetype: str | None = None,
+) -> bool:
+    # returns False if the local copy is up to date.
+    # Without a manifest, the file is always downloaded.
+    if manifest is not None and manifest.is_current(file, path):
+        LOG.info(f"{path} is up to date, skipping download")
+        return False
+    LOG.info(f"Downloading {path}...")
+    file.GetContentFile(str(path), mimetype=mimetype)
+    if manifest is not None:
+        manifest.record(file, path)
+    return True
+
+
+def upload_file(
+    file: GoogleDriveFile, path: Path | str, mimetype: str, *, num_retries: int = 3
+) -> None:
+    path = Path(path)
+    if path.stat().st_size <= RESUMABLE_UPLOAD_THRESHOLD:
+        file.SetContentFile(str(path))
+        file.Upload()
+        return
+
+    media = MediaFileUpload(
+        str(path), mimetype=mimetype, chunksize=UPLOAD_CHUNK_SIZE, resumable=True
+    )
+    files = file.auth.service.files()
+    # httplib2 is not thread-safe, so every upload uses its own connection
+    http = file.auth.Get_Http_Object()
+    if file.get("id") is not None:
+        request = files.update(
+            fileId=file["id"],
+            media_body=media,
+            fields=FILE_FIELDS,
+            supportsAllDrives=True,
+        )
+    else:
+        request = files.insert(
+            body={
+                "title": file["title"],
+                "mimeType": mimetype,
+                "parents": file["parents"],
+            },
+            media_body=media,
+            fields=FILE_FIELDS,
+            supportsAllDrives=True,
+        )
+    response = None
+    while response is None:
+        status, response = request.next_chunk(http=http, num_retries=num_retries)
+        if status is not None:
+            LOG.debug(f"Uploaded {status.progress():.0%} of {path}")
+    file.UpdateMetadata(response)
+    file.uploaded = True
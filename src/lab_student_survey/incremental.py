@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from logging import getLogger
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+from scipy.special import stdtr
+from scipy.stats import f
+
+STATE_VERSION = 1
+
+LOG = getLogger(__name__)
+
+
+@dataclass
+class Moments:
+    # pairwise-complete moments of the columns of a matrix X with NaNs:
+    # n[i, j] is the number of rows where both x_i and x_j are present,
+    # s[i, j] and ss[i, j] are the sums of x_i and x_i ** 2 over those rows
+    # and c[i, j] is the sum of x_i * x_j
+    n: npt.NDArray[np.float64]
+    s: npt.NDArray[np.float64]
+    ss: npt.NDArray[np.float64]
+    c: npt.NDArray[np.float64]
+
+    @classmethod
+    def zeros(cls, k: int) -> Moments:
+        return cls(*(np.zeros((k, k)) for _ in range(4)))
+
+    @classmethod
+    def from_array(cls, X: npt.NDArray[np.float64]) -> Moments:
+        X = np.asarray(X, dtype=float)
+        mask = ~np.isnan(X)
+        M = mask.astype(float)
+        X0 = np.where(mask, X, 0.0)
+        return cls(M.T @ M, X0.T @ M, (X0**2).T @ M, X0.T @ X0)
+
+    def __add__(self, other: Moments) -> Moments:
+        return Moments(
+            self.n + other.n, self.s + other.s, self.ss + other.ss, self.c + other.c
+        )
+
+    def mean(self) -> npt.NDArray[np.float64]:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.diag(self.s) / np.diag(self.n)
+
+    def cov(self) -> npt.NDArray[np.float64]:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.c - self.s * self.s.T / self.n) / (self.n - 1)
+
+    def std(self) -> npt.NDArray[np.float64]:
+        return np.sqrt(np.diag(self.cov()))
+
+    def corr(self) -> npt.NDArray[np.float64]:
+        n, s, ss = self.n, self.s, self.ss
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = (n * self.c - s * s.T) / np.sqrt(
+                (n * ss - s**2) * (n * ss.T - s.T**2)
+            )
+        r = np.clip(r, -1.0, 1.0)
+        # like DataFrame.corr(), the diagonal is exactly 1 for non-constant columns
+        diag = np.diag_indices_from(r)
+        r[diag] = np.where(np.isnan(r[diag]), np.nan, 1.0)
+        return r
+
+
+def pearson_pvalues(
+    r: npt.NDArray[np.float64], n: npt.NDArray[np.float64]
+) -> npt.NDArray[np.float64]:
+    # two-sided p-values of the t-test for r with n - 2 degrees of freedom
+    # which is what scipy.stats.pearsonr computes
+    dof = n - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = r * np.sqrt(dof / ((1.0 - r) * (1.0 + r)))
+        p = 2 * stdtr(dof, -np.abs(t))
+    # two observations always fit a line
+    return np.where(dof > 0, p, np.where((dof == 0) & ~np.isnan(r), 1.0, np.nan))
+
+
+def cronbach_alpha(
+    C: npt.NDArray[np.float64], n: int, ci: float = 0.95
+) -> tuple[float, npt.NDArray[np.float64]]:
+    # same as pingouin.cronbach_alpha(nan_policy="pairwise") from
+    # the pairwise covariance matrix C of k items answered by n respondents
+    k = C.shape[0]
+    alpha = (k / (k - 1)) * (1 - np.trace(C) / C.sum())
+    dof1 = n - 1
+    dof2 = dof1 * (k - 1)
+    lower = 1 - (1 - alpha) * f.isf((1 - ci) / 2, dof1, dof2)
+    upper = 1 - (1 - alpha) * f.isf(1 - (1 - ci) / 2, dof1, dof2)
+    return alpha, np.round([lower, upper], 3)
+
+
+def row_keys(timestamps: pd.Series) -> npt.NDArray[np.str_]:
+    # responses are identified by their timestamp,
+    # numbered in case several responses share the same timestamp
+    timestamps = timestamps.astype(str)
+    occurrence = timestamps.groupby(timestamps).cumcount().astype(str)
+    return (timestamps + "#" + occurrence).to_numpy(dtype=str)
+
+
+@dataclass
+class SurveyState:
+    # running statistics of the responses seen so far, see Moments.
+    # items are the columns of df_likert and means the columns of df_likert_mean,
+    # std_sum and std_count accumulate the per-response std within each group
+    signature: str
+    keys: npt.NDArray[np.str_]
+    items: Moments
+    means: Moments
+    std_sum: npt.NDArray[np.float64]
+    std_count: npt.NDArray[np.float64]
+    embedding_keys: npt.NDArray[np.str_] = field(
+        default_factory=lambda: np.array([], dtype=str)
+    )
+    embedding_labels: npt.NDArray[np.str_] = field(
+        default_factory=lambda: np.array([], dtype=str)
+    )
+    cluster_scores: npt.NDArray[np.float64] = field(
+        default_factory=lambda: np.array([])
+    )
+    embeddings: dict[str, npt.NDArray[np.float64]] = field(default_factory=dict)
+
+    @classmethod
+    def empty(
+        cls, signature: str, n_items: int, n_means: int, n_groups: int
+    ) -> SurveyState:
+        return cls(
+            signature,
+            np.array([], dtype=str),
+            Moments.zeros(n_items),
+            Moments.zeros(n_means),
+            np.zeros(n_groups),
+            np.zeros(n_groups),
+        )
+
+    @classmethod
+    def load(cls, path: Path | str, signature: str) -> SurveyState | None:
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            if header["version"] != STATE_VERSION or header["signature"] != signature:
+                LOG.info(f"Discarding outdated state {path}")
+                return None
+            return cls(
+                signature,
+                data["keys"],
+                Moments(*(data[f"items_{name}"] for name in "n s ss c".split())),
+                Moments(*(data[f"means_{name}"] for name in "n s ss c".split())),
+                data["std_sum"],
+                data["std_count"],
+                data["embedding_keys"],
+                data["embedding_labels"],
+                data["cluster_scores"],
+                {name: data[f"embedding_{name}"] for name in header["embeddings"]},
+            )
+
+    def save(self, path: Path | str) -> None:
+        header = {
+            "version": STATE_VERSION,
+            "signature": self.signature,
+            "embeddings": list(self.embeddings),
+        }
+        arrays = {
+            f"{prefix}_{name}": getattr(moments, name)
+            for prefix, moments in [("items", self.items), ("means", self.means)]
+            for name in "n s ss c".split()
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with Path(path).open("wb") as f:
+            np.savez(
+                f,
+                header=np.array(json.dumps(header)),
+                keys=self.keys,
+                std_sum=self.std_sum,
+                std_count=self.std_count,
+                embedding_keys=self.embedding_keys,
+                embedding_labels=self.embedding_labels,
+                cluster_scores=self.cluster_scores,
+                **arrays,
+                **{f"embedding_{k}": v for k, v in self.embeddings.items()},
+            )
+
+    def is_consistent(self, keys: npt.NDArray[np.str_]) -> bool:
+        # responses which were deleted or edited require a full rebuild
+        return bool(np.isin(self.keys, keys).all())
+
+    def update(
+        self,
+        keys: npt.NDArray[np.str_],
+        items: npt.NDArray[np.float64],
+        means: npt.NDArray[np.float64],
+        within_std: npt.NDArray[np.float64],
+    ) -> None:
+        if len(keys) == 0:
+            return
+        self.keys = np.concatenate([self.keys, keys])
+        self.items = self.items + Moments.from_array(items)
+        self.means = self.means + Moments.from_array(means)
+        self.std_sum = self.std_sum + np.nansum(within_std, axis=0)
+        self.std_count = self.std_count + (~np.isnan(within_std)).sum(axis=0)
+
+    def get_embeddings(
+        self, keys: npt.NDArray[np.str_], threshold: float
+    ) -> tuple[list[float], dict[str, pd.DataFrame]] | None:
+        # reuse the embeddings while the number of responses changed by at most
+        # threshold (relative to the number of embedded responses)
+        n_cached = len(self.embedding_keys)
+        if (
+            n_cached == 0
+            or abs(len(keys) - n_cached) > threshold * n_cached
+            or not np.isin(self.embedding_keys, keys).all()
+        ):
+            return None
+        if len(keys) != n_cached:
+            LOG.info(
+                f"Reusing embeddings of {n_cached} responses, "
+                f"{len(keys) - n_cached} new responses are not plotted yet"
+            )
+        embeddings = {}
+        for name, values in self.embeddings.items():
+            emb_res = pd.DataFrame(values[:, :2], index=self.embedding_labels)
+            emb_res["cluster"] = values[:, 2].astype(int)
+            embeddings[name] = emb_res
+        return self.cluster_scores.tolist(), embeddings
+
+    def embedding_init(
+        self, keys: npt.NDArray[np.str_], min_overlap: float
+    ) -> dict[str, npt.NDArray[np.float64]]:
+        # the cached positions of keys, NaN for the responses which were not
+        # embedded, if at least min_overlap of the responses were embedded
+        rows = pd.Index(self.embedding_keys).get_indexer(keys)
+        if len(rows) == 0 or (rows >= 0).mean() < min_overlap:
+            return {}
+        return {
+            name: np.where(rows[:, None] >= 0, values[rows, :2], np.nan)
+            for name, values in self.embeddings.items()
+        }
+
+    def set_embeddings(
+        self,
+        keys: npt.NDArray[np.str_],
+        cluster_scores: list[float],
+        embeddings: dict[str, pd.DataFrame],
+    ) -> None:
+        self.embedding_keys = np.asarray(keys, dtype=str)
+        self.cluster_scores = np.asarray(cluster_scores, dtype=float)
+        self.embedding_labels = np.array([], dtype=str)
+        self.embeddings = {}
+        for name, emb_res in embeddings.items():
+            self.embedding_labels = emb_res.index.to_numpy(dtype=str)
+            self.embeddings[name] = emb_res[[0, 1, "cluster"]].to_numpy(dtype=float)
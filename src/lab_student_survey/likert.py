@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+from dataclasses import dataclass
+from logging import getLogger
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+# the first text is the most positive answer
+LIKERT_SCALE_TEXTS = ["全く当てはまる", "当てはまる", "どちらともいえない", "あまり当てはまらない", "全く当てはまらない"]
+LIKERT_SCALES = {
+    "3": ["当てはまる", "どちらともいえない", "当てはまらない"],
+    "5": LIKERT_SCALE_TEXTS,
+    "7": [
+        "全く当てはまる",
+        "当てはまる",
+        "やや当てはまる",
+        "どちらともいえない",
+        "やや当てはまらない",
+        "当てはまらない",
+        "全く当てはまらない",
+    ],
+}
+# separator of custom scales in the scale column of metadata.csv
+SCALE_SEPARATOR = "|"
+# encoded value of unknown or blank answers
+MISSING = 0
+
+LOG = getLogger(__name__)
+
+
+def get_scale(scale: object) -> list[str]:
+    if scale is None or (isinstance(scale, float) and np.isnan(scale)):
+        return LIKERT_SCALE_TEXTS
+    scale = str(scale).removesuffix(".0")
+    if scale in LIKERT_SCALES:
+        return LIKERT_SCALES[scale]
+    if SCALE_SEPARATOR in scale:
+        return scale.split(SCALE_SEPARATOR)
+    raise ValueError(
+        f"Unknown scale {scale!r}, use one of {list(LIKERT_SCALES)} "
+        f"or '{SCALE_SEPARATOR}'-separated answer texts"
+    )
+
+
+def get_scales(df_meta: pd.DataFrame) -> list[list[str]]:
+    if "scale" not in df_meta.columns:
+        return [LIKERT_SCALE_TEXTS] * len(df_meta)
+    return [get_scale(scale) for scale in df_meta["scale"]]
+
+
+@dataclass(frozen=True)
+class LikertEncoding:
+    # 1 (worst) ... n_points (best), MISSING for unknown or blank answers
+    values: npt.NDArray[np.int8]
+    n_points: npt.NDArray[np.int8]
+    index: pd.Index
+    columns: pd.Index
+
+    @property
+    def missing(self) -> npt.NDArray[np.bool_]:
+        return self.values == MISSING
+
+    def to_frame(self) -> pd.DataFrame:
+        if not self.missing.any():
+            return pd.DataFrame(self.values, index=self.index, columns=self.columns)
+        values = self.values.astype(np.float32)
+        values[self.missing] = np.nan
+        return pd.DataFrame(values, index=self.index, columns=self.columns)
+
+
+def encode_likert(
+    df: pd.DataFrame,
+    scales: Sequence[Sequence[str]],
+    higher_is_better: Sequence[bool] | npt.NDArray[np.bool_],
+    *,
+    strict: bool = False,
+) -> LikertEncoding:
+    if len(scales) != df.shape[1] or len(higher_is_better) != df.shape[1]:
+        raise ValueError("scales and higher_is_better must match the columns of df")
+    codes = np.empty(df.shape, dtype=np.int8, order="F")
+    # one categorical pass per distinct scale over all of its columns
+    columns_by_scale: dict[tuple[str, ...], list[int]] = {}
+    for i, scale in enumerate(scales):
+        columns_by_scale.setdefault(tuple(scale), []).append(i)
+    for scale, columns in columns_by_scale.items():
+        block = df.iloc[:, columns].to_numpy().ravel(order="F")
+        codes[:, columns] = pd.Categorical(block, categories=scale).codes.reshape(
+            -1, len(columns), order="F"
+        )
+
+    unknown = codes < 0
+    if unknown.any():
+        _report_unknown(df, unknown, strict=strict)
+
+    n_points = np.array([len(scale) for scale in scales], dtype=np.int8)
+    # the code of the most positive answer is 0, so that
+    # n_points - code is the score and code + 1 is the reversed score
+    values = np.where(
+        np.asarray(higher_is_better, dtype=bool), n_points - codes, codes + 1
+    ).astype(np.int8)
+    values[unknown] = MISSING
+    return LikertEncoding(values, n_points, df.index, df.columns)
+
+
+def _report_unknown(
+    df: pd.DataFrame, unknown: npt.NDArray[np.bool_], *, strict: bool
+) -> None:
+    messages = []
+    for i in np.flatnonzero(unknown.any(axis=0)):
+        answers = df.iloc[unknown[:, i], i]
+        blank = int(answers.isna().sum())
+        texts = answers.dropna().unique().tolist()
+        messages.append(
+            f"{df.columns[i]}: {blank} blank, {len(answers) - blank} unknown {texts}"
+        )
+    message = "Unknown or blank likert answers:\n" + "\n".join(messages)
+    if strict:
+        raise ValueError(message)
+    LOG.warning(message)
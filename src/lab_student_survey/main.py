@@ -1,43 +1,37 @@
 from __future__ import annotations
 
 import os
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from logging import getLogger
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
 
 from pydrive2.drive import GoogleDrive
 from pydrive2.files import GoogleDriveFile
 
-from .analyze import analyze
-from .gdrive import get_drive
+from .cache import DEFAULT_CACHE_DIR, ResultCache, cache_key, md5sum
+from .gdrive import DownloadManifest, DriveFolder, download_file, get_drive, upload_file
+from .profiling import stage
+from .report import get_artifacts
 
 IS_CI = os.environ.get("GITHUB_ACTIONS") == "true"
+METADATA_NAMES = ["metadata.csv", "metadata_group_name.csv"]
+# concurrent Drive requests
+IO_WORKERS = 8
 
 LOG = getLogger(__name__)
 
 
 def get_file(drive: GoogleDrive, name: str, folder_id: str) -> GoogleDriveFile | None:
-    filelist = drive.ListFile(
-        {"q": f"'{folder_id}' in parents and trashed=false"}
-    ).GetList()
-    file_candidates = [file for file in filelist if file["title"] == name]
-    if file_candidates:
-        return file_candidates[0]
-    return None
+    return DriveFolder(drive, folder_id, [name]).get(name)
 
 
 def create_or_get_file(
     drive: GoogleDrive, name: str, folder_id: str, mimetype: str
 ) -> GoogleDriveFile:
-    file = get_file(drive, name, folder_id)
-    if file is not None:
-        return file
-    return drive.CreateFile(
-        {
-            "title": name,
-            "mime_type": mimetype,
-            "parents": [{"id": folder_id}],
-        }
-    )
+    return DriveFolder(drive, folder_id, [name]).create_or_get(name, mimetype)
 
 
 def main(
@@ -47,39 +41,181 @@ def main(
     folder_url: str | None = None,
     pdf: bool = True,
     privacy_scopes: list[str] | None = None,
-) -> None:
+    jobs: Mapping[Path | str, list[str] | None] | None = None,
+    max_workers: int | None = None,
+    cache_dir: Path | str | None = DEFAULT_CACHE_DIR,
+    image_mode: str = "inline",
+    drive: GoogleDrive | None = None,
+    upload_reports: bool = True,
+    **kwargs: Any,
+) -> dict[Path | str, list[Path]]:
+    # jobs maps each output path to its privacy scopes (None means all responses).
+    # drive is an authorized client to reuse, with upload_reports=False the
+    # reports are only written locally. Returns the artifacts of each job,
+    # including the reports of its shards.
+    if jobs is None:
+        jobs = {out_path: privacy_scopes}
+
     file_id = file_url.split("/")[-1].split("?")[0]
-    drive = get_drive()
-    in_file = drive.CreateFile({"id": file_id})
-    csv_content = in_file.GetContentString(mimetype="text/csv")
+    if drive is None:
+        with stage("auth"):
+            drive = get_drive()
+    # without cache_dir, every file is downloaded again and nothing is kept
+    cache_root = Path(cache_dir) if cache_dir is not None else None
+    manifest = (
+        DownloadManifest(cache_root / "downloads.json")
+        if cache_root is not None
+        else None
+    )
+    # Drive requests run on threads while the main thread analyzes
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as io, TemporaryDirectory() as tmp:
+        with stage("metadata"):
+            in_file = drive.CreateFile({"id": file_id})
+            in_file.FetchMetadata(fields="id,title,mimeType,modifiedDate,parents")
+        # the exported sheet is kept so that it is only exported again when modified
+        downloads_dir = (
+            cache_root / "downloads" if cache_root is not None else Path(tmp)
+        )
+        csv_path = downloads_dir / f"{file_id}.csv"
+        csv_path.parent.mkdir(parents=True, exist_ok=True)
+        downloads = [
+            io.submit(download, in_file, csv_path, manifest, mimetype="text/csv")
+        ]
 
-    for n in ["metadata.csv", "metadata_group_name.csv"]:
-        metadata_file = get_file(drive, n, in_file["parents"][0]["id"])
-        if metadata_file is not None:
-            LOG.info(f"Downloading {n}...")
-            metadata_file.GetContentFile(n)
+        # list each folder once for all files which are looked up
+        source_folder_id = in_file["parents"][0]["id"]
+        folder_id = (
+            source_folder_id if folder_url is None else folder_url.split("/")[-1]
+        )
+        titles: dict[str, list[str]] = {source_folder_id: list(METADATA_NAMES)}
+        if upload_reports:
+            titles.setdefault(folder_id, []).extend(
+                path.name
+                for out_path in jobs
+                for path in get_artifacts(out_path, pdf, image_mode)
+            )
+        with stage("list_folders"):
+            folders = {
+                folder_id_: DriveFolder(drive, folder_id_, titles_)
+                for folder_id_, titles_ in titles.items()
+            }
 
-    analyze(csv_content, out_path=out_path, pdf=pdf, privacy_scopes=privacy_scopes)
+        for n in METADATA_NAMES:
+            metadata_file = folders[source_folder_id].get(n)
+            if metadata_file is not None:
+                downloads.append(io.submit(download, metadata_file, n, manifest))
+        with stage("wait_downloads"):
+            for downloading in downloads:
+                downloading.result()
+        csv_content = csv_path.read_text(encoding="utf-8")
 
-    folder_id = (
-        in_file["parents"][0]["id"] if folder_url is None else folder_url.split("/")[-1]
-    )
-    out_file = create_or_get_file(drive, Path(out_path).name, folder_id, "text/html")
-    out_file.SetContentFile(out_path)
-    out_file.Upload()
+        # each file is uploaded as soon as it is written
+        uploads: dict[Future[None], Path] = {}
+
+        def on_artifact(path: Path) -> None:
+            if upload_reports:
+                uploads[io.submit(upload, folders[folder_id], path)] = path
+
+        # skip the analysis of the reports whose inputs did not change.
+        # The options, e.g. shard_by, are part of the key.
+        cache = ResultCache(cache_root) if cache_root is not None else None
+        keys = {
+            out_path: cache_key(
+                csv_content, privacy_scopes, pdf=pdf, image_mode=image_mode, **kwargs
+            )
+            for out_path, privacy_scopes in jobs.items()
+        }
+        artifacts: dict[Path | str, list[Path]] = {}
+        pending = {}
+        for out_path, privacy_scopes in jobs.items():
+            cached = (
+                cache.get(keys[out_path], get_artifacts(out_path, pdf, image_mode))
+                if cache is not None
+                else None
+            )
+            if cached is not None:
+                LOG.info(f"Using the cached report for {out_path}")
+                artifacts[out_path] = cached
+                if upload_reports:
+                    # the shards, which are only known now, in one query
+                    folders[folder_id].fetch(path.name for path in cached)
+                for path in cached:
+                    on_artifact(path)
+            else:
+                pending[out_path] = privacy_scopes
+        if pending:
+            with stage("analyze"):
+                from .analyze import analyze_batch
+
+                shards = analyze_batch(
+                    csv_content,
+                    pending,
+                    pdf=pdf,
+                    max_workers=max_workers,
+                    image_mode=image_mode,
+                    on_artifact=on_artifact,
+                    # an unchanged export is loaded without parsing it again
+                    store_dir=(
+                        cache_root / "responses" / file_id
+                        if cache_root is not None
+                        else None
+                    ),
+                    **kwargs,
+                )
+            for out_path in pending:
+                artifacts[out_path] = [
+                    *get_artifacts(out_path, pdf, image_mode),
+                    *shards[out_path],
+                ]
+        if cache is not None:
+            for out_path in pending:
+                cache.put(keys[out_path], artifacts[out_path])
+            cache.evict()
+
+        failed = []
+        with stage("wait_uploads"):
+            for future in as_completed(uploads):
+                try:
+                    future.result()
+                except Exception as e:
+                    LOG.error(f"✘ Failed to upload {uploads[future]}: {e}")
+                    failed.append(str(uploads[future]))
+    if failed:
+        raise RuntimeError(f"Failed to upload {failed}")
+    return artifacts
+
+
+def download(
+    file: GoogleDriveFile,
+    path: Path | str,
+    manifest: DownloadManifest | None,
+    *,
+    mimetype: str | None = None,
+) -> bool:
+    with stage("download", file=Path(path).name):
+        return download_file(file, path, manifest, mimetype=mimetype)
+
+
+def upload(folder: DriveFolder, path: Path | str) -> None:
+    with stage("upload", file=Path(path).name):
+        _upload(folder, Path(path))
+
+
+def _upload(folder: DriveFolder, path: Path) -> None:
+    if path.is_dir():
+        LOG.info(f"Images in {path} are not uploaded")
+        return
+    kind, mimetype = {
+        ".html": ("HTML", "text/html"),
+        ".pdf": ("PDF", "application/pdf"),
+        ".zip": ("ZIP", "application/zip"),
+    }[path.suffix]
+    out_file = folder.create_or_get(path.name, mimetype)
+    if out_file.get("md5Checksum") == md5sum(path):
+        LOG.info(f"{kind} is up to date, skipping upload")
+    else:
+        upload_file(out_file, path, mimetype)
     if not IS_CI:
-        LOG.info(f"✔✨HTML saved to {out_file['alternateLink']} and {out_path}")
+        LOG.info(f"✔✨{kind} saved to {out_file['alternateLink']} and {path}")
     else:
-        LOG.info("✔✨HTML saved")
-
-    if pdf:
-        pdf_path = Path(out_path).with_suffix(".pdf")
-        out_file = create_or_get_file(
-            drive, pdf_path.name, folder_id, "application/pdf"
-        )
-        out_file.SetContentFile(pdf_path)
-        out_file.Upload()
-        if not IS_CI:
-            LOG.info(f"✔✨PDF saved to {out_file['alternateLink']} and {pdf_path}")
-        else:
-            LOG.info("✔✨PDF saved")
+        LOG.info(f"✔✨{kind} saved")
@@ -0,0 +1,435 @@
+from __future__ import annotations
+
+import re
+import shutil
+import textwrap
+import threading
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import Future
+from logging import getLogger
+from pathlib import Path
+from types import TracebackType
+from typing import TYPE_CHECKING, Any
+from unicodedata import east_asian_width
+
+from .workers import process_pool
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.figure import Figure
+
+    from .report import ReportItem
+
+# auto: wkhtmltopdf if it is installed, otherwise xhtml2pdf
+PDF_BACKENDS = ("auto", "wkhtmltopdf", "xhtml2pdf", "matplotlib")
+# the backends which convert the HTML report
+HTML_BACKENDS = ("wkhtmltopdf", "xhtml2pdf")
+# A4 landscape, in inches
+PAGE_SIZE = (11.69, 8.27)
+PAGE_MARGIN = 0.4
+TABLE_FONT_SIZE = 6.0
+# the distance between the lines of a table relative to the font size
+LINE_SPACING = 1.7
+TABLE_MAX_COLUMNS = 14
+# table cells are wrapped at this many characters
+CELL_WIDTH = 40
+# the width of a narrow character and the padding of a table cell in ems
+CHAR_WIDTH = 0.6
+CELL_PADDING = 0.5
+
+LOG = getLogger(__name__)
+
+
+def resolve_backend(backend: str) -> str:
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f"backend must be one of {PDF_BACKENDS}")
+    if backend != "auto":
+        return backend
+    return "wkhtmltopdf" if shutil.which("wkhtmltopdf") else "xhtml2pdf"
+
+
+def html_to_pdf(
+    path: Path | str,
+    pdf_html_path: Path | str,
+    *,
+    backend: str = "wkhtmltopdf",
+    local_files: bool = False,
+) -> None:
+    # converts the HTML report at path to {stem}.pdf from pdf_html_path, the
+    # copy of the report with the fonts of both backends and paged tables
+    # truncated, see HTMLReportWriter.
+    path = Path(path)
+    pdf_path = path.with_suffix(".pdf")
+    if backend == "wkhtmltopdf":
+        # pdfkit and xhtml2pdf are slow to import and only needed here
+        import pdfkit
+
+        try:
+            pdfkit.from_file(
+                str(pdf_html_path),
+                str(pdf_path),
+                options={"enable-local-file-access": None} if local_files else None,
+            )
+            return
+        except Exception as e:
+            LOG.exception(e)
+            LOG.warning("Failed to convert to pdf using pdfkit, trying xhtml2pdf")
+    from xhtml2pdf import pisa
+
+    def link_callback(uri: str, rel: str) -> str:
+        if uri.startswith("data:"):
+            return uri.replace(" ", "%20")
+        return str(path.parent / uri)
+
+    with Path(pdf_html_path).open("rb") as src, pdf_path.open("wb") as dest:
+        pisa.CreatePDF(src, dest, encoding="utf-8", link_callback=link_callback)
+
+
+def _text(text: str) -> str:
+    # headings may contain HTML
+    return re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", text)).strip()
+
+
+def _cell(value: object) -> str:
+    text = str(value).replace("\\n", "\n")
+    return "\n".join(
+        textwrap.fill(line, CELL_WIDTH) or " " for line in text.splitlines() or [""]
+    )
+
+
+def _label(label: object) -> str:
+    if isinstance(label, tuple):
+        return "\n".join(str(part) for part in label)
+    return str(label)
+
+
+def _width(text: str) -> float:
+    # the width of the longest line of text in ems, estimated from its
+    # characters: wide (e.g. Japanese) characters are 1 em, others CHAR_WIDTH
+    return max(
+        sum(1.0 if east_asian_width(c) in "WF" else CHAR_WIDTH for c in line)
+        for line in text.split("\n")
+    )
+
+
+def _column_widths(cells: pd.DataFrame) -> list[float]:
+    # in ems, with the header, CELL_PADDING on both sides
+    return [
+        max([_width(_label(column)), *map(_width, cells[column])]) + 2 * CELL_PADDING
+        for column in cells.columns
+    ]
+
+
+def table_pages(
+    df: pd.DataFrame, page_size: tuple[float, float] = PAGE_SIZE
+) -> Iterator[pd.DataFrame]:
+    # the parts of df which fit on a page: as many columns as fit in the width
+    # of the page next to the index (at most TABLE_MAX_COLUMNS) and as many
+    # rows as their wrapped lines fit in the height of the page
+    line_height = TABLE_FONT_SIZE * LINE_SPACING / 72
+    # the heading and the header take some lines
+    max_lines = max(int((page_size[1] - 2 * PAGE_MARGIN) / line_height) - 6, 1)
+    cells = df.map(_cell)
+    lines = [
+        max(value.count("\n") + 1 for value in row) if len(row) else 1
+        for row in cells.itertuples(index=False)
+    ]
+    ems = (page_size[0] - 2 * PAGE_MARGIN) * 72 / TABLE_FONT_SIZE
+    index_width = max(map(_width, map(_label, df.index)), default=0.0)
+    available = ems - index_width - 2 * CELL_PADDING
+    starts, used = [0], 0.0
+    for i, width in enumerate(_column_widths(cells)):
+        if i > starts[-1] and (
+            used + width > available or i - starts[-1] >= TABLE_MAX_COLUMNS
+        ):
+            starts.append(i)
+            used = 0.0
+        used += width
+    for start_column, stop_column in zip(starts, [*starts[1:], df.shape[1]]):
+        columns = df.iloc[:, start_column:stop_column]
+        start, used_lines = 0, 0
+        for i, n in enumerate(lines):
+            if used_lines + n > max_lines and i > start:
+                yield columns.iloc[start:i]
+                start, used_lines = i, 0
+            used_lines += n
+        yield columns.iloc[start:]
+
+
+class PdfPagesWriter:
+    # writes the report items as PDF pages with matplotlib: figures as vector
+    # graphics scaled to the page, tables split over pages, headings on top of
+    # the page of the next item
+    def __init__(
+        self, path: Path | str, *, page_size: tuple[float, float] = PAGE_SIZE
+    ) -> None:
+        from matplotlib.backends.backend_pdf import PdfPages
+
+        from .figures import set_font
+
+        set_font()
+        self.page_size = page_size
+        self.pages = PdfPages(path)
+        self.headings: list[str] = []
+
+    def _save(self, fig: Figure) -> None:
+        import matplotlib
+
+        if self.headings:
+            fig.text(
+                PAGE_MARGIN / fig.get_figwidth(),
+                1 - PAGE_MARGIN / fig.get_figheight() / 2,
+                "\n".join(self.headings),
+                va="top",
+                fontsize=TABLE_FONT_SIZE * 1.5,
+                wrap=True,
+            )
+            self.headings = []
+        # TrueType subsets are smaller and faster to write than Type 3 fonts
+        with matplotlib.rc_context({"pdf.fonttype": 42}):
+            self.pages.savefig(fig)
+
+    def write_heading(self, text: str) -> None:
+        self.headings.append(_text(text))
+
+    def write_table(self, df: pd.DataFrame) -> None:
+        # matplotlib's Table draws each cell as a patch and a text, which is
+        # slow for long tables. Instead each column is one multiline text,
+        # with the lines of the cells of a row padded to the same number,
+        # and the rows are separated by a collection of lines.
+        from matplotlib.collections import LineCollection
+        from matplotlib.figure import Figure
+
+        if df.empty:
+            return
+        width, height = self.page_size
+        for part in table_pages(df, self.page_size):
+            cells = part.map(_cell)
+            rows = [
+                ["", *map(_label, part.columns)],
+                *(
+                    [_label(index), *row]
+                    for index, row in zip(part.index, cells.itertuples(index=False))
+                ),
+            ]
+            widths = [
+                max(map(_width, map(_label, part.index))) + 2 * CELL_PADDING,
+                *_column_widths(cells),
+            ]
+            columns: list[list[str]] = [[] for _ in widths]
+            lines = []
+            for row in rows:
+                n = max(text.count("\n") + 1 for text in row)
+                for column, text in zip(columns, row):
+                    column.append(text + "\n" * (n - 1 - text.count("\n")))
+                lines.append(n)
+
+            fig = Figure(figsize=self.page_size)
+            em = TABLE_FONT_SIZE / 72
+            top = 1 - 2 * PAGE_MARGIN / height
+            x = PAGE_MARGIN / width
+            for column, column_width in zip(columns, widths):
+                fig.text(
+                    x + CELL_PADDING * em / width,
+                    top,
+                    "\n".join(column),
+                    va="top",
+                    fontsize=TABLE_FONT_SIZE,
+                    linespacing=LINE_SPACING,
+                )
+                x += column_width * em / width
+            # matplotlib spaces the lines of a text by LINE_SPACING times
+            # the font size, so the rules are at multiples of that
+            advance = TABLE_FONT_SIZE * LINE_SPACING / 72 / height
+            y = top
+            segments = [[(PAGE_MARGIN / width, y), (x, y)]]
+            for n in lines:
+                y -= n * advance
+                segments.append([(PAGE_MARGIN / width, y), (x, y)])
+            fig.add_artist(
+                LineCollection(
+                    segments, transform=fig.transFigure, linewidths=0.3, colors="0.6"
+                )
+            )
+            self._save(fig)
+
+    def write_figure(self, fig: Figure) -> None:
+        # scaled to fit in the page with the same aspect ratio
+        width, height = fig.get_size_inches()
+        scale = min(
+            (self.page_size[0] - 2 * PAGE_MARGIN) / width,
+            (self.page_size[1] - 3 * PAGE_MARGIN) / height,
+        )
+        fig.set_size_inches(width * scale, height * scale)
+        try:
+            fig.tight_layout()
+        except Exception as e:
+            LOG.warning(e)
+        self._save(fig)
+
+    def write_image(self, png: bytes) -> None:
+        from io import BytesIO
+
+        import matplotlib.image
+        from matplotlib.figure import Figure
+
+        image = matplotlib.image.imread(BytesIO(png), format="png")
+        fig = Figure(figsize=self.page_size)
+        ax = fig.add_axes((0.02, 0.02, 0.96, 0.9))
+        ax.imshow(image)
+        ax.axis("off")
+        self._save(fig)
+
+    def write(self, item: ReportItem) -> None:
+        import pandas as pd
+        from matplotlib.figure import Figure
+
+        from .figures import FigureSpec
+
+        if isinstance(item, str):
+            self.write_heading(item)
+        elif isinstance(item, bytes):
+            self.write_image(item)
+        elif isinstance(item, FigureSpec):
+            self.write_figure(item.build())
+        elif isinstance(item, Figure):
+            self.write_figure(item)
+        elif isinstance(item, pd.Series):
+            self.write_table(item.to_frame())
+        else:
+            self.write_table(item)
+
+    def close(self) -> None:
+        self.pages.close()
+
+    def __enter__(self) -> PdfPagesWriter:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+
+def items_to_pdf(
+    items: Sequence[ReportItem],
+    pdf_path: Path | str,
+    *,
+    page_size: tuple[float, float] = PAGE_SIZE,
+) -> None:
+    with PdfPagesWriter(pdf_path, page_size=page_size) as writer:
+        for item in items:
+            writer.write(item)
+
+
+def _render(
+    backend: str, path: Path | str, source: Any, *, local_files: bool = False
+) -> None:
+    # source is the list of report items for the matplotlib backend and
+    # the path of the HTML for wkhtmltopdf otherwise, which is removed
+    from .profiling import stage
+
+    with stage("pdf"):
+        if backend == "matplotlib":
+            items_to_pdf(source, Path(path).with_suffix(".pdf"))
+            return
+        try:
+            html_to_pdf(path, source, backend=backend, local_files=local_files)
+        finally:
+            Path(source).unlink(missing_ok=True)
+
+
+def _init_renderer() -> None:
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+class PdfRenderer:
+    # a process which renders the PDFs of several reports one after another
+    # while the next report is analyzed. It imports the PDF stack and loads
+    # the fonts once, and its memory is returned when it exits.
+    def __init__(self) -> None:
+        self.executor = process_pool(max_workers=1, initializer=_init_renderer)
+        self.pending: list[tuple[Future[Any], threading.Event]] = []
+
+    def submit(
+        self,
+        backend: str,
+        path: Path | str,
+        source: Any,
+        *,
+        local_files: bool = False,
+        on_done: Callable[[], None] | None = None,
+    ) -> Future[Any]:
+        # on_done is called on a thread of the executor once the PDF is written.
+        # The result of the future is that of run_traced(), see close().
+        from .profiling import run_traced, trace_options
+
+        future = self.executor.submit(
+            run_traced,
+            trace_options(),
+            _render,
+            backend,
+            path,
+            source,
+            local_files=local_files,
+        )
+        called = threading.Event()
+
+        def callback(future: Future[Any]) -> None:
+            try:
+                if future.exception() is None and on_done is not None:
+                    on_done()
+            finally:
+                called.set()
+
+        future.add_done_callback(callback)
+        self.pending.append((future, called))
+        return future
+
+    def close(self) -> None:
+        # waits for the PDFs and their on_done and raises the first error.
+        # The spans of the renderer are added to the trace of this process.
+        from .profiling import add_worker_trace, stage
+
+        try:
+            with stage("wait_pdf"):
+                for future, called in self.pending:
+                    called.wait()
+                    add_worker_trace(future.result())
+        finally:
+            self.executor.shutdown()
+
+    def __enter__(self) -> PdfRenderer:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+
+def render_pdf(
+    backend: str,
+    path: Path | str,
+    source: Any,
+    *,
+    local_files: bool = False,
+    renderer: PdfRenderer | None = None,
+    on_done: Callable[[], None] | None = None,
+) -> None:
+    # writes {stem}.pdf next to the report at path with backend
+    # (see _render for source), in renderer if given
+    if renderer is not None:
+        renderer.submit(backend, path, source, local_files=local_files, on_done=on_done)
+        return
+    _render(backend, path, source, local_files=local_files)
+    if on_done is not None:
+        on_done()
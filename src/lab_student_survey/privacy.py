@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+from logging import getLogger
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+# whether a response is selected if it chose any or all of the privacy scopes
+SCOPE_MATCHES = ("any", "all")
+# the sums, or means, and the numbers of values of each column
+PartialSums = tuple[npt.NDArray[np.float64], npt.NDArray[np.int64]]
+
+LOG = getLogger(__name__)
+
+
+class PrivacyIndex:
+    # the privacy scopes each respondent chose in the multi-select question,
+    # parsed once so that the responses of any scopes are selected with a
+    # boolean mask by the exact scope names. The distinct answers are kept as
+    # rows of a boolean matrix (patterns, one column per scope) and each
+    # response refers to its answer, the last row for no answer.
+    def __init__(self, answers: pd.Series) -> None:
+        codes, uniques = pd.factorize(answers)
+        # Google Forms joins the chosen checkboxes with ", "
+        chosen = [
+            {scope.strip() for scope in str(answer).split(",")} - {""}
+            for answer in uniques
+        ]
+        self.scopes: list[str] = sorted(set().union(*chosen))
+        self._columns = {scope: i for i, scope in enumerate(self.scopes)}
+        self.patterns = np.zeros((len(chosen) + 1, len(self.scopes)), dtype=bool)
+        for i, scopes in enumerate(chosen):
+            self.patterns[i, [self._columns[scope] for scope in scopes]] = True
+        # -1 (no answer) refers to the last row
+        self.codes = np.where(codes < 0, len(chosen), codes)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def matrix(self) -> npt.NDArray[np.bool_]:
+        # whether each response chose each scope
+        return self.patterns[self.codes]
+
+    def _selected_patterns(
+        self, scopes: Sequence[str], how: str, missing_ok: bool
+    ) -> npt.NDArray[np.bool_]:
+        if how not in SCOPE_MATCHES:
+            raise ValueError(f"how must be one of {SCOPE_MATCHES}, not {how!r}")
+        unknown = [scope for scope in scopes if scope not in self._columns]
+        if unknown and not missing_ok:
+            # the scopes used to be matched as substrings of the answers
+            similar = [
+                label
+                for label in self.scopes
+                if any(scope in label for scope in unknown)
+            ]
+            raise ValueError(
+                f"No response chose the privacy scopes {unknown}, scopes must be "
+                f"one of {self.scopes}"
+                + (f" (did you mean {similar}?)" if similar else "")
+            )
+        if unknown:
+            LOG.info(f"No response chose the privacy scopes {unknown}")
+        columns = self.patterns[
+            :, [self._columns[scope] for scope in scopes if scope in self._columns]
+        ]
+        if how == "any":
+            return columns.any(axis=1)
+        return columns.all(axis=1) & (not unknown)
+
+    def mask(
+        self, scopes: Sequence[str], how: str = "any", *, missing_ok: bool = False
+    ) -> npt.NDArray[np.bool_]:
+        # the responses which chose any or all of scopes. Scopes are the exact
+        # labels of the checkboxes, a scope which no response chose raises
+        # ValueError unless missing_ok (e.g. for the exports of previous years)
+        return self._selected_patterns(scopes, how, missing_ok)[self.codes]
+
+    def partial_sums(self, values: npt.NDArray[np.float64]) -> PartialSums:
+        # the sums and the numbers of the non-missing values of each column of
+        # values (one row per response) over the responses of each pattern,
+        # from which the statistics of any scopes are added up by aggregate()
+        valid = ~np.isnan(values)
+        sums = np.zeros((len(self.patterns), values.shape[1]))
+        counts = np.zeros((len(self.patterns), values.shape[1]), dtype=np.int64)
+        np.add.at(sums, self.codes, np.where(valid, values, 0.0))
+        np.add.at(counts, self.codes, valid)
+        return sums, counts
+
+    def aggregate(
+        self, partial_sums: PartialSums, scopes: Sequence[str], how: str = "any"
+    ) -> PartialSums:
+        # the means and the numbers of the values of the responses of scopes
+        # from partial_sums(), without going over the responses again
+        sums, counts = partial_sums
+        selected = self._selected_patterns(scopes, how, False)
+        total, count = sums[selected].sum(axis=0), counts[selected].sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return total / count, count
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from logging import getLogger
+from pathlib import Path
+from time import perf_counter, thread_time
+from typing import Any
+
+LOG = getLogger(__name__)
+
+# the recorder of record_stages(), None when stages are not recorded
+_recorder: StageRecorder | None = None
+# the tracer of trace(), None when stages are not traced
+_tracer: Tracer | None = None
+
+# the events and profiles traced in a worker process
+WorkerTrace = tuple[list[dict[str, Any]], list[dict[Any, Any]]]
+
+
+@dataclass
+class StageRecorder:
+    # seconds spent in and peak traced memory of each stage,
+    # summed and maxed over the times the stage was entered
+    trace_memory: bool = False
+    seconds: dict[str, float] = field(default_factory=dict)
+    peak_bytes: dict[str, int] = field(default_factory=dict)
+
+    def add(self, name: str, seconds: float, peak_bytes: int) -> None:
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), peak_bytes)
+
+
+def peak_rss() -> int | None:
+    # the highest resident set size of this process so far in bytes
+    if sys.platform == "win32":
+        return None
+    import resource
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class _Profile:
+    # the stats of a finished cProfile.Profile, as pstats.Stats loads them
+    def __init__(self, stats: dict[Any, Any]) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+@dataclass
+class Tracer:
+    # spans as Chrome trace events (chrome://tracing or https://ui.perfetto.dev)
+    # and the cProfile stats of the spans named profile_stage
+    profile_stage: str | None = None
+    events: list[dict[str, Any]] = field(default_factory=list)
+    profiles: list[dict[Any, Any]] = field(default_factory=list)
+    _profiler: cProfile.Profile | None = None
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def start_profile(self, name: str) -> bool:
+        # cProfile only follows the thread it is enabled in, so only
+        # the outermost span of profile_stage on the main thread is profiled
+        if name != self.profile_stage or self._profiler is not None:
+            return False
+        if threading.current_thread() is not threading.main_thread():
+            return False
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        return True
+
+    def stop_profile(self) -> None:
+        assert self._profiler is not None
+        self._profiler.disable()
+        self._profiler.create_stats()
+        self.profiles.append(self._profiler.stats)
+        self._profiler = None
+
+    def add(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        cpu: float,
+        rss_start: int | None,
+        args: dict[str, Any],
+    ) -> None:
+        # the RSS of the process so far is not that of the span: a span is
+        # charged with how much it raised it, which misses memory freed and
+        # reused within the span and that of concurrent spans
+        rss = peak_rss()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": round(start * 1e6),
+            "dur": round((end - start) * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": {
+                **args,
+                "cpu_ms": round(cpu * 1e3, 3),
+                "max_rss_so_far_mb": None if rss is None else round(rss / 2**20, 1),
+                "max_rss_growth_mb": (
+                    None
+                    if rss is None or rss_start is None
+                    else round((rss - rss_start) / 2**20, 1)
+                ),
+                "thread": threading.current_thread().name,
+            },
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self) -> dict[str, dict[str, Any]]:
+        # wall and CPU seconds summed and the RSS maxed over the spans of each name
+        stages: dict[str, dict[str, Any]] = {}
+        for event in self.events:
+            stats = stages.setdefault(
+                event["name"],
+                {
+                    "count": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "max_rss_so_far_mb": 0,
+                    "max_rss_growth_mb": 0,
+                },
+            )
+            stats["count"] += 1
+            stats["wall_seconds"] += event["dur"] / 1e6
+            stats["cpu_seconds"] += event["args"]["cpu_ms"] / 1e3
+            for key in ["max_rss_so_far_mb", "max_rss_growth_mb"]:
+                stats[key] = max(stats[key], event["args"][key] or 0)
+        for stats in stages.values():
+            stats["wall_seconds"] = round(stats["wall_seconds"], 4)
+            stats["cpu_seconds"] = round(stats["cpu_seconds"], 4)
+        return stages
+
+    def write(self, path: Path | str) -> None:
+        # timestamps are relative to the first span
+        origin = min((event["ts"] for event in self.events), default=0)
+        events = [{**event, "ts": event["ts"] - origin} for event in self.events]
+        threads = {
+            (event["pid"], event["tid"]): event["args"]["thread"] for event in events
+        }
+        events += [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": n},
+            }
+            for (pid, tid), n in threads.items()
+        ]
+        summary = self.summary()
+        Path(path).write_text(
+            json.dumps(
+                {"traceEvents": events, "displayTimeUnit": "ms", "stages": summary},
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+        for name, stats in summary.items():
+            LOG.info(
+                f"{name}: {stats['wall_seconds']:.3f} s wall, "
+                f"{stats['cpu_seconds']:.3f} s CPU, "
+                f"max RSS {stats['max_rss_so_far_mb']} MB so far "
+                f"(+{stats['max_rss_growth_mb']} MB)"
+            )
+        LOG.info(f"Wrote the trace to {path}")
+
+        if self.profile_stage is None:
+            return
+        if not self.profiles:
+            LOG.warning(f"The stage {self.profile_stage} was not run on a main thread")
+            return
+        merged = pstats.Stats(_Profile(self.profiles[0]))  # type: ignore[arg-type]
+        for profile in self.profiles[1:]:
+            merged.add(_Profile(profile))  # type: ignore[arg-type]
+        profile_path = Path(path).with_suffix(f".{self.profile_stage}.prof")
+        merged.dump_stats(profile_path)
+        LOG.info(f"Wrote the profile of {self.profile_stage} to {profile_path}")
+
+
+@contextmanager
+def stage(name: str, **args: Any) -> Iterator[None]:
+    # a named span of the pipeline, recorded by record_stages() and trace().
+    # args are added to the trace event. For record_stages(), stages must
+    # not be nested, the peak memory is reset when one starts.
+    recorder, tracer = _recorder, _tracer
+    if recorder is None and tracer is None:
+        yield
+        return
+    if recorder is not None and recorder.trace_memory:
+        tracemalloc.reset_peak()
+    profiled = tracer is not None and tracer.start_profile(name)
+    rss_start = peak_rss() if tracer is not None else None
+    start, cpu_start = perf_counter(), thread_time()
+    try:
+        yield
+    finally:
+        end, cpu = perf_counter(), thread_time() - cpu_start
+        if profiled:
+            assert tracer is not None
+            tracer.stop_profile()
+        if recorder is not None:
+            peak = tracemalloc.get_traced_memory()[1] if recorder.trace_memory else 0
+            recorder.add(name, end - start, peak)
+        if tracer is not None:
+            tracer.add(name, start, end, cpu, rss_start, args)
+
+
+@contextmanager
+def record_stages(trace_memory: bool = False) -> Iterator[StageRecorder]:
+    # records the stages run in this process (not in worker processes,
+    # whose results are waited for in the stage which consumes them)
+    global _recorder
+    recorder = StageRecorder(trace_memory)
+    previous, _recorder = _recorder, recorder
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+        if started:
+            tracemalloc.stop()
+
+
+@contextmanager
+def trace(path: Path | str, *, profile_stage: str | None = None) -> Iterator[Tracer]:
+    # writes the spans run in this block to path, including those of worker
+    # processes started with run_traced(), and the cProfile stats of
+    # profile_stage next to it (<path stem>.<profile_stage>.prof)
+    global _tracer
+    tracer = Tracer(profile_stage)
+    previous, _tracer = _tracer, tracer
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+        tracer.write(path)
+
+
+def trace_options() -> tuple[str | None] | None:
+    # what run_traced() needs to trace a worker like this process,
+    # None when this process is not traced
+    return None if _tracer is None else (_tracer.profile_stage,)
+
+
+def run_traced(
+    options: tuple[str | None] | None,
+    fn: Callable[..., Any],
+    *args: Any,
+    **kwargs: Any,
+) -> tuple[Any, WorkerTrace | None]:
+    # calls fn in a worker process with the spans traced as in the parent.
+    # Pass the result to add_worker_trace() in the parent.
+    global _tracer
+    if options is None:
+        return fn(*args, **kwargs), None
+    tracer = Tracer(*options)
+    previous, _tracer = _tracer, tracer
+    try:
+        value = fn(*args, **kwargs)
+    finally:
+        _tracer = previous
+    # the tracer has a lock, which cannot be pickled
+    return value, (tracer.events, tracer.profiles)
+
+
+def add_worker_trace(result: tuple[Any, WorkerTrace | None]) -> Any:
+    # the result of the function given to run_traced()
+    value, worker = result
+    if worker is not None and _tracer is not None:
+        events, profiles = worker
+        with _tracer._lock:
+            _tracer.events.extend(events)
+            _tracer.profiles.extend(profiles)
+    return value
@@ -0,0 +1,453 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import shutil
+import zipfile
+from collections.abc import Callable, Iterable
+from logging import getLogger
+from pathlib import Path
+from types import TracebackType
+from typing import IO, TYPE_CHECKING, NamedTuple, Union
+
+from .pdf import HTML_BACKENDS, render_pdf, resolve_backend
+from .profiling import stage
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    import pandas as pd
+    from matplotlib.figure import Figure
+
+    from .figures import FigureSpec
+    from .pdf import PdfRenderer
+
+    ReportItem = Union[pd.DataFrame, pd.Series, str, Figure, FigureSpec, bytes]
+
+HTML_FONT_FAMILY = "HeiseiKakuGo-W5"
+PDFKIT_FONT_FAMILY = "IPAexGothic"
+# the fonts of the copy for the PDF: wkhtmltopdf uses IPAexGothic and
+# xhtml2pdf, which does not know it, falls back to HeiseiKakuGo-W5
+PDF_FONT_FAMILY = f"{PDFKIT_FONT_FAMILY}, {HTML_FONT_FAMILY}"
+# inline: data URIs, files: image files in {stem}_files/,
+# zip: {stem}.zip containing the HTML and its files
+IMAGE_MODES = ("inline", "files", "zip")
+# svg keeps the figures as vector graphics, independent of the resolution
+IMAGE_FORMATS = ("png", "svg")
+IMAGE_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+# html: tables as HTML, paged: tables longer than PAGED_TABLE_ROWS as JSON
+# blocks which PAGED_TABLE_SCRIPT shows a page at a time
+TABLE_MODES = ("html", "paged")
+PAGED_TABLE_ROWS = 100
+TABLE_PAGE_ROWS = 50
+# the rows of a paged table are written in blocks of this many rows,
+# which the script only parses when one of their pages is shown
+TABLE_CHUNK_ROWS = 500
+# the number of rows of a paged table shown in the PDF
+PDF_TABLE_ROWS = 50
+PAGED_TABLE_SCRIPT = """<style>
+    .paged-table td { white-space: pre-line; }
+    .paged-table button { font-size: 5pt; }
+</style>
+<script>
+for (const div of document.querySelectorAll("div.paged-table")) {
+    const blocks = [...document.querySelectorAll(
+        `script[data-table="${div.id}"]`)];
+    const header = JSON.parse(blocks.shift().textContent);
+    const parsed = new Map();
+    const rowAt = (i) => {
+        const block = Math.floor(i / header.chunk);
+        if (!parsed.has(block)) {
+            parsed.set(block, JSON.parse(blocks[block].textContent));
+        }
+        return parsed.get(block)[i % header.chunk];
+    };
+    const cell = (tag, text) => {
+        const element = document.createElement(tag);
+        element.textContent = text;
+        return element;
+    };
+    const table = document.createElement("table");
+    table.border = 1;
+    table.className = "dataframe";
+    const head = table.createTHead();
+    for (const level of header.columns) {
+        const tr = head.insertRow();
+        for (const label of level) tr.append(cell("th", label));
+    }
+    const body = table.createTBody();
+    const pager = document.createElement("div");
+    const status = document.createElement("span");
+    let start = 0;
+    const show = () => {
+        body.replaceChildren();
+        const stop = Math.min(start + header.page, header.rows);
+        for (let i = start; i < stop; i++) {
+            const tr = body.insertRow();
+            rowAt(i).forEach((value, j) =>
+                tr.append(cell(j < header.index ? "th" : "td", value)));
+        }
+        status.textContent = ` ${start + 1}-${stop} / ${header.rows} `;
+    };
+    const button = (text, step) => {
+        const element = cell("button", text);
+        element.onclick = () => {
+            const last = Math.floor((header.rows - 1) / header.page) * header.page;
+            start = Math.min(Math.max(start + step, 0), last);
+            show();
+        };
+        return element;
+    };
+    pager.append(
+        button("<<", -header.rows), button("<", -header.page), status,
+        button(">", header.page), button(">>", header.rows));
+    div.append(pager, table);
+    show();
+}
+</script>"""
+
+LOG = getLogger(__name__)
+
+
+class ImageEncoding(NamedTuple):
+    # how the figures of the HTML are encoded: format (see IMAGE_FORMATS),
+    # the resolution of PNGs (the dpi of the figure if None), the number of
+    # colors of the palette PNGs are quantized to (0 to keep full color) and
+    # the total bytes of the PNGs of a report (None for no limit), which
+    # their resolution is reduced to fit
+    format: str = "png"
+    dpi: float | None = None
+    colors: int = 0
+    budget: int | None = None
+
+
+def _html_header(font_family: str) -> str:
+    return f"""<html>
+<meta charset='UTF-8'>
+<style>
+ @page {{
+        size: A1;
+    }}
+    body {{ font-family: {font_family}; font-size: 5pt; }}
+    table {{ font-family: {font_family}; font-size: 5pt; }}
+    th {{ font-family: {font_family}; font-size: 5pt; }}
+    td {{ font-family: {font_family}; font-size: 5pt; }}
+</style>
+<body>"""
+
+
+def _is_svg(image: bytes) -> bool:
+    return image.lstrip()[:5] in (b"<?xml", b"<svg ")
+
+
+def _table_html(df: pd.DataFrame) -> str:
+    # replace \n with <br> tag
+    return df.to_html().replace("\\n", "<br>")
+
+
+def _script_json(value: object) -> str:
+    # JSON which cannot end the <script> element it is in
+    return json.dumps(value, ensure_ascii=False).replace("</", "<\\/")
+
+
+def _json_rows(df: pd.DataFrame) -> str:
+    # the index values and the values of each row as text
+    values = df.astype(object).where(df.notna(), "").to_numpy()
+    return _script_json(
+        [
+            [
+                str(value).replace("\\n", "\n")
+                for value in (*(key if isinstance(key, tuple) else (key,)), *row)
+            ]
+            for key, row in zip(df.index, values)
+        ]
+    )
+
+
+def truncate_table(df: pd.DataFrame, max_rows: int = PDF_TABLE_ROWS) -> pd.DataFrame:
+    # the first max_rows rows of df and a row with the number of the others
+    import pandas as pd
+
+    if len(df) <= max_rows:
+        return df
+    label = f"他{len(df) - max_rows}行"
+    index = (
+        pd.MultiIndex.from_tuples([(label,) + ("",) * (df.index.nlevels - 1)])
+        if df.index.nlevels > 1
+        else pd.Index([label])
+    )
+    rest = pd.DataFrame([["…"] * df.shape[1]], index=index, columns=df.columns)
+    return pd.concat([df.iloc[:max_rows].astype(object), rest])
+
+
+def get_files_dir(path: Path | str) -> Path:
+    return Path(path).with_name(f"{Path(path).stem}_files")
+
+
+def get_artifacts(
+    out_path: Path | str, pdf: bool, image_mode: str = "inline"
+) -> list[Path]:
+    artifacts = {
+        "inline": [Path(out_path)],
+        "files": [Path(out_path), get_files_dir(out_path)],
+        "zip": [Path(out_path).with_suffix(".zip")],
+    }[image_mode]
+    if pdf:
+        artifacts.append(Path(out_path).with_suffix(".pdf"))
+    return artifacts
+
+
+class HTMLReportWriter:
+    # writes the report section by section. If pdf_html_path is given, a copy
+    # for the HTML PDF backends with PDF_FONT_FAMILY is written at the same time.
+    # With table_mode="paged", the copy has the first rows of paged tables.
+    # Figures are encoded with image_encoding, identical images are written to
+    # one file with image_mode files or zip.
+    def __init__(
+        self,
+        path: Path | str,
+        *,
+        pdf_html_path: Path | str | None = None,
+        image_mode: str = "inline",
+        table_mode: str = "html",
+        image_encoding: ImageEncoding = ImageEncoding(),
+    ) -> None:
+        if image_mode not in IMAGE_MODES:
+            raise ValueError(f"image_mode must be one of {IMAGE_MODES}")
+        if table_mode not in TABLE_MODES:
+            raise ValueError(f"table_mode must be one of {TABLE_MODES}")
+        if image_encoding.format not in IMAGE_FORMATS:
+            raise ValueError(f"image_encoding.format must be one of {IMAGE_FORMATS}")
+        self.path = Path(path)
+        self.image_mode = image_mode
+        self.table_mode = table_mode
+        self.image_encoding = image_encoding
+        self.n_images = 0
+        # the file of each image written, by its hash
+        self.image_files: dict[str, str] = {}
+        self.n_paged_tables = 0
+        if image_mode != "inline":
+            shutil.rmtree(get_files_dir(self.path), ignore_errors=True)
+        # for xhtml2pdf support, set font-family to HeiseiKakuGo-W5
+        self.files: list[tuple[IO[str], str]] = [
+            (self.path.open("w", encoding="utf-8"), HTML_FONT_FAMILY)
+        ]
+        if pdf_html_path is not None:
+            self.files.append(
+                (Path(pdf_html_path).open("w", encoding="utf-8"), PDF_FONT_FAMILY)
+            )
+        for f, font_family in self.files:
+            f.write(_html_header(font_family))
+
+    def _write(self, content: str) -> None:
+        for f, _ in self.files:
+            f.write(content)
+
+    def write_heading(self, text: str) -> None:
+        self._write(f"<h2>{text}</h2>")
+
+    def write_table(self, df: pd.DataFrame) -> None:
+        if self.table_mode == "paged" and len(df) > PAGED_TABLE_ROWS:
+            self.write_paged_table(df)
+        else:
+            self._write(_table_html(df))
+
+    def write_paged_table(self, df: pd.DataFrame) -> None:
+        # the rows are serialized block by block, so that the HTML of the
+        # whole table is never built
+        (f, _), *pdf_files = self.files
+        table_id = f"table-{self.n_paged_tables:03d}"
+        self.n_paged_tables += 1
+        index_names = ["" if name is None else str(name) for name in df.index.names]
+        header = {
+            "index": df.index.nlevels,
+            # the names of the index are in the last row of the header
+            "columns": [
+                (
+                    index_names
+                    if level == df.columns.nlevels - 1
+                    else [""] * df.index.nlevels
+                )
+                + [str(label) for label in df.columns.get_level_values(level)]
+                for level in range(df.columns.nlevels)
+            ],
+            "rows": len(df),
+            "page": TABLE_PAGE_ROWS,
+            "chunk": TABLE_CHUNK_ROWS,
+        }
+        f.write(f"<div class='paged-table' id='{table_id}'></div>")
+        f.write(
+            f"<script type='application/json' data-table='{table_id}'>"
+            f"{_script_json(header)}</script>"
+        )
+        for start in range(0, len(df), TABLE_CHUNK_ROWS):
+            f.write(
+                f"<script type='application/json' data-table='{table_id}'>"
+                f"{_json_rows(df.iloc[start : start + TABLE_CHUNK_ROWS])}</script>"
+            )
+        for pdf_file, _ in pdf_files:
+            pdf_file.write(_table_html(truncate_table(df)))
+
+    def write_image(self, image: bytes) -> None:
+        # a PNG or an SVG image
+        extension = "svg" if _is_svg(image) else "png"
+        if self.image_mode == "inline":
+            self._write(
+                f"<img src='data:{IMAGE_TYPES[extension]};base64,"
+                f"{base64.b64encode(image).decode('utf-8')}'/>"
+            )
+            return
+        digest = hashlib.sha256(image).hexdigest()
+        name = self.image_files.get(digest)
+        if name is None:
+            files_dir = get_files_dir(self.path)
+            files_dir.mkdir(exist_ok=True)
+            name = self.image_files[
+                digest
+            ] = f"{files_dir.name}/figure-{self.n_images:03d}.{extension}"
+            (files_dir / Path(name).name).write_bytes(image)
+            self.n_images += 1
+        self._write(f"<img src='{name}'/>")
+
+    def write(self, item: ReportItem) -> None:
+        import pandas as pd
+        from matplotlib.figure import Figure
+
+        from .figures import FigureSpec, render_figure
+
+        if isinstance(item, str):
+            self.write_heading(item)
+        elif isinstance(item, bytes):
+            self.write_image(item)
+        elif isinstance(item, (Figure, FigureSpec)):
+            encoding = self.image_encoding
+            self.write_image(render_figure(item, encoding.format, encoding))
+        elif isinstance(item, pd.Series):
+            self.write_table(item.to_frame())
+        else:
+            self.write_table(item)
+
+    def close(self) -> None:
+        if self.n_paged_tables:
+            self.files[0][0].write(PAGED_TABLE_SCRIPT)
+        for f, _ in self.files:
+            f.write("</body></html>")
+            f.close()
+
+    def __enter__(self) -> HTMLReportWriter:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+
+def export_multiple_frames_to_html(
+    dfs: Iterable[ReportItem],
+    path: Path | str,
+    pdf: bool = True,
+    max_workers: int | None = None,
+    image_mode: str = "inline",
+    on_artifact: Callable[[Path], None] | None = None,
+    pdf_backend: str = "auto",
+    pdf_renderer: PdfRenderer | None = None,
+    table_mode: str = "html",
+    image_encoding: ImageEncoding = ImageEncoding(),
+    figure_pool: ProcessPoolExecutor | None = None,
+) -> None:
+    # on_artifact is called with each file of get_artifacts() once it is
+    # complete, so that it can be uploaded while the rest is generated.
+    # With pdf_renderer, the PDF is written in its process after this returns
+    # and on_artifact is called from one of its threads. The figures are
+    # rendered in figure_pool if given, see render_figures().
+    if on_artifact is None:
+
+        def on_artifact(path: Path) -> None:
+            pass
+
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    from matplotlib.figure import Figure
+
+    from .figures import FigureSpec, render_figures
+
+    path = Path(path)
+    # the written sections are dropped from this copy, which frees those that
+    # the caller does not hold
+    items = list(dfs)
+    # render the figures in parallel while the tables are written
+    images = render_figures(
+        [item for item in items if isinstance(item, FigureSpec)],
+        max_workers=max_workers,
+        encoding=image_encoding,
+        executor=figure_pool,
+    )
+    backend = resolve_backend(pdf_backend)
+    pdf_html_path = (
+        path.with_suffix(".pdf.html") if pdf and backend in HTML_BACKENDS else None
+    )
+    # the matplotlib backend draws the figures again as vector graphics
+    pdf_items: list[ReportItem] | None = (
+        [] if pdf and backend not in HTML_BACKENDS else None
+    )
+    with HTMLReportWriter(
+        path,
+        pdf_html_path=pdf_html_path,
+        image_mode=image_mode,
+        table_mode=table_mode,
+        image_encoding=image_encoding,
+    ) as writer:
+        for i, item in enumerate(items):
+            if pdf_items is not None:
+                pdf_items.append(
+                    truncate_table(item)
+                    if table_mode == "paged"
+                    and isinstance(item, pd.DataFrame)
+                    and len(item) > PAGED_TABLE_ROWS
+                    else item
+                )
+            if isinstance(item, FigureSpec):
+                with stage("figures"):
+                    item = next(images)
+            with stage("html"):
+                writer.write(item)
+            # free the section as soon as it is written
+            items[i] = ""
+            if isinstance(item, Figure):
+                # figures of plt.subplots() are kept by pyplot until closed,
+                # closing keeps their contents for the matplotlib PDF
+                plt.close(item)
+                if pdf_items is None:
+                    item.clear()
+    if image_mode != "zip":
+        for artifact in get_artifacts(path, False, image_mode):
+            on_artifact(artifact)
+
+    if pdf:
+        pdf_path = path.with_suffix(".pdf")
+        render_pdf(
+            backend,
+            path,
+            pdf_html_path if pdf_items is None else pdf_items,
+            local_files=image_mode != "inline",
+            # the HTML and its files are zipped and removed below
+            renderer=(
+                pdf_renderer if pdf_items is not None or image_mode != "zip" else None
+            ),
+            on_done=lambda: on_artifact(pdf_path),
+        )
+
+    if image_mode == "zip":
+        files_dir = get_files_dir(path)
+        with zipfile.ZipFile(path.with_suffix(".zip"), "w") as f:
+            f.write(path, path.name)
+            for file in sorted(files_dir.glob("*")):
+                f.write(file, f"{files_dir.name}/{file.name}")
+        shutil.rmtree(files_dir, ignore_errors=True)
+        path.unlink()
+        on_artifact(path.with_suffix(".zip"))
@@ -0,0 +1,660 @@
+from __future__ import annotations
+
+import hashlib
+from functools import cached_property
+from logging import getLogger
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+from sklearn.discriminant_analysis import StandardScaler
+
+from .bootstrap import bootstrap_ci
+from .clustering import WARM_START_MIN_OVERLAP, embed, select_k, warm_start
+from .correlation import correlate
+from .figures import (
+    FigureSpec,
+    plot_cluster_scores,
+    plot_colwise,
+    plot_embedding,
+    plot_empty,
+    plot_heatmap,
+    plot_mean,
+    plot_trend,
+)
+from .freetext import FreeTextIndex, TokenCache, keyword_summary, supervisor_keywords
+from .incremental import SurveyState, cronbach_alpha, row_keys
+from .likert import encode_likert, get_scales
+from .privacy import PartialSums, PrivacyIndex
+from .profiling import stage
+from .shards import shard_labels
+from .trends import OVERALL, compute_trends, period_labels, trend_tables
+
+if TYPE_CHECKING:
+    from .correlation import Correlation
+
+TIMESTAMP_TEXT = "タイムスタンプ"
+PRIVACY_TEXT = "公開範囲"
+# the ratio of distinct answers to the answers of a free text question without
+# a type in metadata.csv, see free_text_columns
+FREE_TEXT_MIN_DISTINCT_RATIO = 0.5
+# the number of keywords of the free text summary and of each supervisor
+FREE_TEXT_KEYWORDS = 30
+SUPERVISOR_KEYWORDS = 5
+
+LOG = getLogger(__name__)
+
+
+def encode_responses(df: pd.DataFrame, df_meta: pd.DataFrame) -> pd.DataFrame:
+    # the likert scale questions of df as scores (see encode_likert),
+    # with columns indexed by group and question
+    df_likert_meta = df_meta[df_meta["group"].notna()]
+    df_likert = encode_likert(
+        df.reindex(columns=df_likert_meta.index),
+        get_scales(df_likert_meta),
+        df_likert_meta["higher_is_better"].to_numpy(dtype=bool),
+    ).to_frame()
+    df_likert.columns = pd.MultiIndex.from_frame(
+        pd.DataFrame({"group": df_likert_meta["group"], "question": df_likert.columns})
+    )
+    return df_likert
+
+
+def score_responses(
+    df: pd.DataFrame, df_meta: pd.DataFrame, numeral_columns: pd.Index
+) -> pd.DataFrame:
+    # encode_responses() of df and its numeral_columns as they are,
+    # with the question as their group
+    df_likert = encode_responses(df, df_meta)
+    if numeral_columns.empty:
+        return df_likert
+    df_numeral = df[numeral_columns]
+    df_numeral.columns = pd.MultiIndex.from_frame(
+        pd.DataFrame({"group": df_numeral.columns, "question": df_numeral.columns})
+    )
+    return pd.concat([df_likert, df_numeral], axis=1, join="outer")
+
+
+def _parse_cronbach_alpha(
+    a: tuple[float, npt.NDArray[np.float64]] | None
+) -> dict[str, object]:
+    if a is None:
+        return {
+            "alpha": float("nan"),
+            "alpha_0.95": float("nan"),
+            "internal_consistency": "N/A",
+        }
+    internal_consistency = {
+        0.9: "Excellent",
+        0.8: "Good",
+        0.7: "Acceptable",
+        0.6: "Questionable",
+        0.5: "Poor",
+        float("-inf"): "Unacceptable",
+    }
+    # internal_consistency = {
+    #     0.9: "<span style='color: #00ff00'>Excellent</span>",
+    #     0.8: "<span style='color: #00dd00'>Good</span>",
+    #     0.7: "<span style='color: #00bb00'>Acceptable</span>",
+    #     0.6: "<span style='color: #009900'>Questionable</span>",
+    #     0.5: "<span style='color: #007700'>Poor</span>",
+    #     float("-inf"): "<span style='color: #005500'>Unacceptable</span>"
+    # }
+    return {
+        "alpha": a[0],
+        "alpha_0.95": a[1],
+        "internal_consistency": internal_consistency[
+            max(
+                list(filter(lambda x: x <= a[0], internal_consistency.keys()))
+                or [float("-inf")]
+            )
+        ],
+    }
+
+
+class SurveyResults:
+    # the tables and figures of the analysis of the responses of one privacy
+    # scope. Each is computed when it is first accessed and then kept, so that
+    # e.g. the means and correlations can be read without the clustering.
+    # The stage of a property is entered after its dependencies are computed,
+    # so that stages are not nested.
+    def __init__(
+        self,
+        responses: pd.DataFrame,
+        df_meta: pd.DataFrame,
+        *,
+        add_numeral: bool = True,
+        privacy_scopes: list[str] | None = None,
+        scope_match: str = "any",
+        privacy_index: PrivacyIndex | None = None,
+        scope_sums: PartialSums | None = None,
+        state_dir: Path | str | None = None,
+        state_name: str = "output",
+        embedding_threshold: float = 0.0,
+        max_workers: int | None = None,
+        correlation: str = "pearson",
+        p_adjust: str | None = None,
+        n_bootstrap: int = 0,
+        cluster_criterion: str = "silhouette",
+        trend: str | None = None,
+        df_history: pd.DataFrame | None = None,
+    ) -> None:
+        # responses as read_responses() parses them, state_name is the name of
+        # the files of the state in state_dir (the stem of the report).
+        # trend is the period ("year" or "term") to show the means by, of
+        # df_history (the responses of every export, see ResponseStore) if given.
+        # The responses which chose any or all (scope_match) of privacy_scopes
+        # are analyzed, privacy_index is the parsed privacy answers of responses
+        # and scope_sums the partial sums of their group means (see scope_sums)
+        # to share between the scopes.
+        self.responses = responses
+        self.df_meta = df_meta
+        self.add_numeral = add_numeral
+        self.privacy_scopes = privacy_scopes
+        self.scope_match = scope_match
+        if privacy_index is not None:
+            self.privacy_index = privacy_index
+        if scope_sums is not None:
+            self.scope_sums = scope_sums
+        self.state_dir = state_dir
+        self.state_name = state_name
+        self.embedding_threshold = embedding_threshold
+        self.max_workers = max_workers
+        self.correlation = correlation
+        self.p_adjust = p_adjust
+        self.n_bootstrap = n_bootstrap
+        self.cluster_criterion = cluster_criterion
+        self.trend = trend
+        self.df_history = df_history
+
+    @cached_property
+    def privacy_col(self) -> str:
+        return self.responses.columns[
+            self.responses.columns.str.contains(PRIVACY_TEXT)
+        ].tolist()[0]
+
+    @cached_property
+    def privacy_index(self) -> PrivacyIndex:
+        return PrivacyIndex(self.responses[self.privacy_col])
+
+    @cached_property
+    def scope_sums(self) -> PartialSums:
+        # PrivacyIndex.partial_sums() of the group means of each of responses,
+        # from which the means of the groups of any scopes are added up
+        df, df_numeral_columns = (
+            self.responses.drop(columns=TIMESTAMP_TEXT),
+            self.df_numeral_columns,
+        )
+        with stage("encode"):
+            df_likert = score_responses(df, self.df_meta, df_numeral_columns)
+        with stage("stats"):
+            means = df_likert.T.groupby(level="group", sort=False).mean().T
+            return self.privacy_index.partial_sums(means.to_numpy(dtype=float))
+
+    @cached_property
+    def last_timestamp(self) -> Any:
+        return self.responses[TIMESTAMP_TEXT].max()
+
+    @cached_property
+    def _scoped(self) -> pd.DataFrame:
+        # the responses of the privacy scopes, sorted by supervisor
+        df = self.responses
+        if self.privacy_scopes is not None:
+            df = df[self.privacy_index.mask(self.privacy_scopes, self.scope_match)]
+        return df.sort_index(axis=0)
+
+    @cached_property
+    def df(self) -> pd.DataFrame:
+        # the responses of the privacy scopes without their timestamps
+        return self._scoped.drop(columns=TIMESTAMP_TEXT)
+
+    @cached_property
+    def timestamps(self) -> pd.Series:
+        return self._scoped[TIMESTAMP_TEXT]
+
+    @cached_property
+    def keys(self) -> npt.NDArray[np.str_]:
+        return row_keys(self.timestamps)
+
+    @cached_property
+    def history(self) -> pd.DataFrame | None:
+        # df_history in the privacy scopes
+        df_history = self.df_history
+        if df_history is None or self.privacy_scopes is None:
+            return df_history
+        # responses of older exports without the column are not shown
+        if self.privacy_col not in df_history.columns:
+            return df_history.iloc[:0]
+        return df_history[
+            PrivacyIndex(df_history[self.privacy_col]).mask(
+                self.privacy_scopes, self.scope_match, missing_ok=True
+            )
+        ]
+
+    @cached_property
+    def df_free(self) -> pd.DataFrame:
+        # the questions which are not likert scale questions
+        likert_cols = self.df_meta["group"].notna()
+        return self.df.loc[:, ~likert_cols].copy()
+
+    @cached_property
+    def free_text_columns(self) -> pd.Index:
+        # the questions of df_free which are answered with sentences, rather
+        # than with a choice such as the grade: those of type "text" in
+        # metadata.csv, or without a type, those whose answers mostly differ
+        df_free = self.df_free
+        types = self.df_meta.get("type", pd.Series(dtype=object))
+        types = types.reindex(df_free.columns)
+        is_text = []
+        for (column, answers), type_ in zip(df_free.items(), types):
+            if pd.notna(type_):
+                is_text.append(type_ == "text")
+                continue
+            answers = answers.dropna()
+            is_text.append(
+                not pd.api.types.is_numeric_dtype(answers)
+                and column != self.privacy_col
+                and len(answers) > 0
+                and answers.nunique() / len(answers) >= FREE_TEXT_MIN_DISTINCT_RATIO
+            )
+        return df_free.columns[is_text]
+
+    @cached_property
+    def free_text(self) -> FreeTextIndex:
+        # the keywords of the free text answers, whose tokens are kept in
+        # state_dir so that only new answers are tokenized
+        answers = self.df_free[self.free_text_columns]
+        with stage("free_text"):
+            cache = TokenCache(
+                Path(self.state_dir) / "free_text_tokens.json"
+                if self.state_dir is not None
+                else None
+            )
+            index = FreeTextIndex.build(answers, cache)
+            cache.save()
+        return index
+
+    @cached_property
+    def df_keywords(self) -> pd.DataFrame:
+        # the most frequent keywords of the free text by department
+        free_text = self.free_text
+        with stage("free_text"):
+            return keyword_summary(
+                free_text,
+                shard_labels(self.df.index, "department"),
+                self.df.index,
+                FREE_TEXT_KEYWORDS,
+            )
+
+    @cached_property
+    def df_supervisor_keywords(self) -> pd.Series:
+        free_text = self.free_text
+        with stage("free_text"):
+            return supervisor_keywords(free_text, self.df.index, SUPERVISOR_KEYWORDS)
+
+    @cached_property
+    def df_numeral_columns(self) -> pd.Index:
+        # the numerical questions added to df_likert, empty without add_numeral
+        if not self.add_numeral:
+            return pd.Index([])
+        return self.df.select_dtypes(include="number").columns
+
+    @cached_property
+    def df_likert(self) -> pd.DataFrame:
+        # the likert scale questions as scores and the numerical questions,
+        # multiindexed by group and question
+        df, df_numeral_columns = self.df, self.df_numeral_columns
+        with stage("encode"):
+            return score_responses(df, self.df_meta, df_numeral_columns)
+
+    @cached_property
+    def signature(self) -> str:
+        # what the state and the trends of state_dir were computed from
+        return hashlib.sha256(
+            "\n".join(
+                [
+                    self.df_meta.to_csv(),
+                    str(self.privacy_scopes),
+                    self.scope_match,
+                    str(self.add_numeral),
+                    str(self.df_likert.columns.tolist()),
+                    self.cluster_criterion,
+                ]
+            ).encode()
+        ).hexdigest()
+
+    @property
+    def state_path(self) -> Path | None:
+        if self.state_dir is None:
+            return None
+        return Path(self.state_dir) / f"{self.state_name}.npz"
+
+    @cached_property
+    def _loaded_state(self) -> SurveyState | None:
+        # the statistics of the previous runs
+        if self.state_path is None:
+            return None
+        state = SurveyState.load(self.state_path, self.signature)
+        if state is not None and not state.is_consistent(self.keys):
+            LOG.info("Responses were edited or deleted, rebuilding the state")
+            state = None
+        if state is None:
+            n_groups = self.df_likert.columns.get_level_values("group").nunique()
+            state = SurveyState.empty(
+                self.signature,
+                self.df_likert.shape[1],
+                n_groups + int(self.add_numeral),
+                n_groups,
+            )
+        return state
+
+    @cached_property
+    def state(self) -> SurveyState | None:
+        # the statistics of the previous runs updated with the responses
+        # added since the last run, None without state_dir. See save_state().
+        state, df_likert = self._loaded_state, self.df_likert
+        if state is None:
+            return None
+        df_likert_mean = self.df_likert_mean
+        with stage("stats"):
+            new = ~np.isin(self.keys, state.keys)
+            LOG.info(f"Updating the state with {new.sum()} new responses")
+            state.update(
+                self.keys[new],
+                df_likert.to_numpy(dtype=float)[new],
+                df_likert_mean.to_numpy(dtype=float)[new],
+                df_likert[new]
+                .T.groupby(level="group", sort=False)
+                .std()
+                .T.to_numpy(dtype=float),
+            )
+        return state
+
+    def save_state(self) -> None:
+        # saves the updated state for the next run, whether or not a statistic
+        # of the report used it. Does nothing without state_dir.
+        state = self.state
+        if state is not None:
+            assert self.state_path is not None
+            state.save(self.state_path)
+
+    @cached_property
+    def embeddings(self) -> tuple[list[float], dict[str, pd.DataFrame]]:
+        # the scores of each number of clusters and the embedding of each
+        # method with the cluster of each response
+        state, df_likert = self._loaded_state, self.df_likert
+        with stage("clustering"):
+            embeddings = (
+                state.get_embeddings(self.keys, self.embedding_threshold)
+                if state is not None
+                else None
+            )
+            if embeddings is not None:
+                return embeddings
+            df_likert_dropna = df_likert.drop(
+                columns=self.df_numeral_columns, level=0
+            ).dropna(axis=1)
+            df_likert_dropna = StandardScaler().fit_transform(df_likert_dropna)
+            clustering = select_k(
+                df_likert_dropna,
+                criterion=self.cluster_criterion,
+                max_workers=self.max_workers,
+            )
+            # start from the previous embeddings if most responses are the same
+            init = (
+                state.embedding_init(self.keys, WARM_START_MIN_OVERLAP)
+                if state is not None
+                else {}
+            )
+            emb_results = {}
+            for name, values in embed(
+                df_likert_dropna,
+                init={
+                    name: warm_start(df_likert_dropna, positions)
+                    for name, positions in init.items()
+                },
+            ).items():
+                emb_res = pd.DataFrame(values, index=df_likert_dropna.index)
+                emb_res["cluster"] = clustering.labels
+                emb_results[name] = emb_res
+            if state is not None:
+                state.set_embeddings(self.keys, clustering.scores, emb_results)
+                assert self.state_path is not None
+                state.save(self.state_path)
+        return clustering.scores, emb_results
+
+    @cached_property
+    def fig_c_elbow(self) -> FigureSpec:
+        return FigureSpec(
+            plot_cluster_scores, (self.embeddings[0], self.cluster_criterion)
+        )
+
+    @cached_property
+    def fig_c_scatters(self) -> list[FigureSpec]:
+        return [
+            FigureSpec(plot_embedding, (emb_res, name))
+            for name, emb_res in self.embeddings[1].items()
+        ]
+
+    def _group_stat(self, stat: str) -> pd.DataFrame:
+        # the mean or std of each group per row, and their mean over the
+        # likert groups as "mean" with add_numeral
+        df_likert = self.df_likert
+        with stage("stats"):
+            df = getattr(df_likert.T.groupby(level="group", sort=False), stat)().T
+            df.columns.name = "group"
+            if self.add_numeral:
+                df["mean"] = df.drop(columns=self.df_numeral_columns).mean(axis=1)
+        return df
+
+    @cached_property
+    def df_likert_mean(self) -> pd.DataFrame:
+        return self._group_stat("mean")
+
+    @cached_property
+    def df_likert_std(self) -> pd.DataFrame:
+        # empty with less than 2 responses
+        if len(self.df) < 2:
+            return pd.DataFrame()
+        return self._group_stat("std")
+
+    @cached_property
+    def fig_mean(self) -> FigureSpec:
+        return FigureSpec(
+            plot_mean, (self.df_likert_mean, list(self.df_numeral_columns) + ["mean"])
+        )
+
+    @cached_property
+    def _correlation(self) -> Correlation | None:
+        # r and p-values of all pairs at once, None with less than 2 responses
+        df_likert_mean = self.df_likert_mean
+        if len(df_likert_mean) < 2:
+            return None
+        state = self.state
+        with stage("stats"):
+            return correlate(
+                df_likert_mean,
+                self.correlation,
+                p_adjust=self.p_adjust,
+                moments=(
+                    state.means
+                    if state is not None and self.correlation == "pearson"
+                    else None
+                ),
+            )
+
+    @cached_property
+    def df_likert_mean_corr(self) -> pd.DataFrame:
+        return pd.DataFrame() if self._correlation is None else self._correlation.r
+
+    @cached_property
+    def df_likert_mean_pval(self) -> pd.DataFrame:
+        if self._correlation is None:
+            return pd.DataFrame()
+        return self._correlation.pvalues
+
+    @cached_property
+    def fig_corr(self) -> FigureSpec:
+        if self._correlation is None:
+            return FigureSpec(plot_empty)
+        return FigureSpec(plot_heatmap, (self.df_likert_mean_corr,))
+
+    @cached_property
+    def fig_corr_dropped(self) -> FigureSpec:
+        # the correlations without the numerical questions
+        if self._correlation is None:
+            return FigureSpec(plot_empty)
+        df_corr_dropped = self.df_likert_mean_corr.drop(
+            index=self.df_numeral_columns, columns=self.df_numeral_columns
+        )
+        return FigureSpec(plot_heatmap, (df_corr_dropped,))
+
+    @cached_property
+    def df_likert_colwise(self) -> pd.DataFrame:
+        # the mean, std and Cronbach's alpha of each group,
+        # empty with less than 2 responses
+        if len(self.df) < 2:
+            return pd.DataFrame()
+        df_likert, state = self.df_likert, self.state
+        with stage("stats"):
+            groups = pd.Index(
+                df_likert.columns.get_level_values("group").unique(), name="group"
+            )
+            # calculate mean and std for each column
+            if state is not None:
+                df_likert_mean_colwise = pd.Series(
+                    state.means.mean()[: len(groups)], index=groups, name="mean"
+                )
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    df_likert_std_colwise = pd.Series(
+                        state.std_sum / state.std_count, index=groups, name="std"
+                    )
+                item_groups = df_likert.columns.get_level_values("group")
+                cov = state.items.cov()
+                alphas = []
+                for group in groups:
+                    idx = np.flatnonzero(item_groups == group)
+                    alphas.append(
+                        cronbach_alpha(cov[np.ix_(idx, idx)], len(state.keys))
+                        if len(idx) > 1
+                        else None
+                    )
+                df_likert_alpha = pd.DataFrame(
+                    [_parse_cronbach_alpha(a) for a in alphas], index=groups
+                )
+            else:
+                df_likert_grouped_colwise = df_likert.T.groupby(
+                    level="group", sort=False
+                )
+                if self.privacy_scopes is not None:
+                    # added up from the sums of all responses by privacy answer
+                    means, _ = self.privacy_index.aggregate(
+                        self.scope_sums, self.privacy_scopes, self.scope_match
+                    )
+                    df_likert_mean_colwise = pd.Series(means, index=groups, name="mean")
+                else:
+                    df_likert_mean_colwise = (
+                        df_likert_grouped_colwise.mean().mean(axis=1).rename("mean")
+                    )
+                df_likert_std_colwise = (
+                    df_likert_grouped_colwise.std().mean(axis=1).rename("std")
+                )
+                # pingouin takes seconds to import and is not needed with a state
+                import pingouin as pg
+
+                df_likert_alpha = pd.DataFrame(
+                    [
+                        _parse_cronbach_alpha(
+                            pg.cronbach_alpha(df_likert[group])
+                            if df_likert[group].shape[1] > 1
+                            else None
+                        )
+                        for group in groups
+                    ],
+                    index=groups,
+                )
+            df_likert_colwise = pd.concat(
+                [df_likert_mean_colwise, df_likert_std_colwise, df_likert_alpha],
+                axis=1,
+            )
+            if self.n_bootstrap > 0:
+                df_likert_colwise = df_likert_colwise.join(
+                    bootstrap_ci(
+                        df_likert, self.n_bootstrap, max_workers=self.max_workers
+                    )
+                )
+        return df_likert_colwise
+
+    @cached_property
+    def fig_colwise(self) -> FigureSpec:
+        if self.df_likert_colwise.empty:
+            return FigureSpec(plot_empty)
+        if self.add_numeral:
+            return FigureSpec(
+                plot_colwise,
+                (self.df_likert_colwise.drop(index=self.df_numeral_columns),),
+                {"sharex": False},
+            )
+        return FigureSpec(plot_colwise, (self.df_likert_colwise,))
+
+    @cached_property
+    def trend_stats(self) -> pd.DataFrame:
+        # period_stats() of the responses by trend, see compute_trends()
+        if self.trend is None:
+            raise ValueError("trend is not set")
+        history = self.history
+        if history is None:
+            df_likert, df_numeral_columns = self.df_likert, self.df_numeral_columns
+        signature = self.signature if self.state_dir is not None else ""
+        with stage("trends"):
+            if history is not None:
+                trend_timestamps = history[TIMESTAMP_TEXT]
+                trend_supervisors = history.index
+            else:
+                trend_timestamps, trend_supervisors = self.timestamps, self.df.index
+
+            def trend_means(rows: npt.NDArray[np.bool_]) -> pd.DataFrame:
+                # the group means of the likert questions and their mean
+                if history is not None:
+                    df_rows = encode_responses(history[rows], self.df_meta)
+                else:
+                    df_rows = df_likert[rows].drop(columns=df_numeral_columns, level=0)
+                means = df_rows.T.groupby(level="group", sort=False).mean().T
+                means[OVERALL] = means.mean(axis=1)
+                return means
+
+            return compute_trends(
+                period_labels(trend_timestamps, self.trend),
+                trend_supervisors,
+                trend_means,
+                state_path=(
+                    Path(self.state_dir) / f"{self.state_name}.trends.{self.trend}.npz"
+                    if self.state_dir is not None
+                    else None
+                ),
+                signature=(
+                    f"{signature}\n{self.trend}\n{history is not None}"
+                    if self.state_dir is not None
+                    else ""
+                ),
+            )
+
+    @cached_property
+    def df_trend(self) -> pd.DataFrame:
+        # the mean of each group by period, see trend_tables()
+        return trend_tables(self.trend_stats)[0]
+
+    @cached_property
+    def df_trend_supervisor(self) -> pd.DataFrame:
+        # the overall mean by supervisor and period
+        return trend_tables(self.trend_stats)[1]
+
+    @cached_property
+    def df_trend_means(self) -> pd.DataFrame:
+        return self.df_trend.drop(columns=["回答数", f"{OVERALL}_std"])
+
+    @cached_property
+    def fig_trend(self) -> FigureSpec:
+        return FigureSpec(plot_trend, (self.df_trend_means,))
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import json
+import threading
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from logging import INFO, basicConfig, getLogger
+from pathlib import Path
+from time import monotonic
+from typing import Any, TypeVar
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import click
+
+from .cli import ALL_SCOPES, analysis_options, main_options, scope_jobs
+
+T = TypeVar("T")
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".pdf": "application/pdf",
+    ".zip": "application/zip",
+}
+
+LOG = getLogger(__name__)
+
+
+class SingleFlight:
+    # calls with the same key while one is running wait for
+    # and share its result instead of running again
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._running: dict[Hashable, Future[Any]] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._running.get(key)
+            leader = future is None
+            if future is None:
+                future = self._running[key] = Future()
+        if not leader:
+            LOG.info(f"Waiting for the running request for {key}")
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._running[key]
+
+
+class ReportService:
+    # generates the reports of a sheet with main() in a process which keeps
+    # the analysis stack imported, the fonts loaded and Drive authorized.
+    # Reports whose inputs did not change are served from the cache of main().
+    def __init__(
+        self,
+        file_url: str,
+        *,
+        folder_url: str | None = None,
+        privacy_scopes: tuple[str, ...] = (ALL_SCOPES,),
+        **options: Any,
+    ) -> None:
+        # privacy_scopes are the reports of /refresh without scopes,
+        # options are passed to main()
+        self.file_url = file_url
+        self.folder_url = folder_url
+        self.privacy_scopes = privacy_scopes
+        self.options = options
+        self.drive: Any = None
+        self.started = monotonic()
+        # runs of main() share the downloads and the state, so they do not overlap
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def warm(self) -> None:
+        from .figures import set_font
+        from .gdrive import get_drive
+
+        # the analysis stack is imported by main() otherwise
+        import_module(".analyze", __package__)
+        set_font()
+        self.drive = get_drive()
+
+    def render(self, scopes: str, *, upload: bool = False) -> list[Path]:
+        # the artifacts of the report of the comma-separated privacy scopes,
+        # generated or taken from the cache and uploaded if upload
+        ((out_path, privacy_scopes),) = scope_jobs([scopes]).items()
+
+        def run() -> list[Path]:
+            from .main import main
+
+            with self._lock:
+                return main(
+                    self.file_url,
+                    folder_url=self.folder_url,
+                    jobs={out_path: privacy_scopes},
+                    drive=self.drive,
+                    upload_reports=upload,
+                    **self.options,
+                )[out_path]
+
+        return self._flight.do((scopes, upload), run)
+
+    def refresh(self, privacy_scopes: list[str] | None = None) -> dict[str, Any]:
+        return {
+            scopes: [str(path) for path in self.render(scopes, upload=True)]
+            for scopes in privacy_scopes or self.privacy_scopes
+        }
+
+    def health(self) -> dict[str, Any]:
+        return {
+            "status": "ok",
+            "authorized": self.drive is not None,
+            "uptime_seconds": round(monotonic() - self.started, 1),
+        }
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    # GET /health, POST /refresh?scope=全体&scope=all and
+    # GET /reports/<comma-separated scopes>.<html|pdf|zip>
+    service: ReportService
+
+    def _send(self, status: HTTPStatus, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: HTTPStatus, value: Any) -> None:
+        self._send(
+            status,
+            json.dumps(value, ensure_ascii=False).encode(),
+            "application/json; charset=utf-8",
+        )
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path == "/health":
+            self._send_json(HTTPStatus.OK, self.service.health())
+            return
+        if not url.path.startswith("/reports/"):
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        name = Path(unquote(url.path.removeprefix("/reports/")))
+        if name.suffix not in CONTENT_TYPES:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        try:
+            artifacts = self.service.render(name.stem)
+        except Exception as e:
+            LOG.exception(e)
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+        path = next((path for path in artifacts if path.suffix == name.suffix), None)
+        if path is None:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"no {name.suffix} file"})
+            return
+        self._send(HTTPStatus.OK, path.read_bytes(), CONTENT_TYPES[name.suffix])
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        if url.path != "/refresh":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        try:
+            reports = self.service.refresh(parse_qs(url.query).get("scope"))
+        except Exception as e:
+            LOG.exception(e)
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+        self._send_json(HTTPStatus.OK, {"reports": reports})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        LOG.info(format % args)
+
+
+def make_server(
+    service: ReportService, host: str = "127.0.0.1", port: int = 8000
+) -> ThreadingHTTPServer:
+    handler = type("Handler", (ReportHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+@click.command()
+@click.argument("file_url", type=str)
+@click.option("--host", type=str, default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8000, show_default=True)
+@click.option("-f", "--folder-url", type=str, required=False, default=None)
+@click.option(
+    "-p",
+    "--privacy-scopes",
+    type=str,
+    multiple=True,
+    default=[ALL_SCOPES],
+    show_default=True,
+    help="Comma-separated privacy scopes which POST /refresh renders by default.",
+)
+@analysis_options
+def serve(
+    file_url: str,
+    host: str,
+    port: int,
+    folder_url: str | None,
+    privacy_scopes: tuple[str, ...],
+    **options: Any,
+) -> None:
+    basicConfig(level=INFO)
+    service = ReportService(
+        file_url,
+        folder_url=folder_url,
+        privacy_scopes=privacy_scopes,
+        **main_options(**options),
+    )
+    LOG.info("Loading the analysis stack and authorizing Google Drive")
+    service.warm()
+    server = make_server(service, host, port)
+    LOG.info(f"Serving the reports on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
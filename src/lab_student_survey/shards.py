@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import os
+import re
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from logging import getLogger
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from .figures import FigureSpec, plot_comparison, set_font
+from .profiling import add_worker_trace, run_traced, stage, trace_options
+from .report import export_multiple_frames_to_html, get_artifacts
+from .workers import process_pool
+
+if TYPE_CHECKING:
+    from .report import ReportItem
+    from .results import SurveyResults
+
+SHARD_KEYS = ("supervisor", "department")
+DEPARTMENT_B = "機械B"
+
+# the columns of the comparison of a shard, see compare_shards()
+COMPARISON_COLUMNS = ["平均", "全体の平均", "全体の標準偏差", "差", "z", "順位(%)"]
+
+LOG = getLogger(__name__)
+
+
+def shard_labels(index: pd.Index, by: str) -> npt.NDArray[np.str_]:
+    # the shard of each response: its supervisor or its department (機械A/機械B)
+    supervisors = index.astype(str)
+    if by == "supervisor":
+        return supervisors.to_numpy()
+    if by == "department":
+        return np.where(supervisors.str.contains(DEPARTMENT_B), DEPARTMENT_B, "機械A")
+    raise ValueError(f"by must be one of {SHARD_KEYS}, not {by!r}")
+
+
+def shard_slices(
+    labels: npt.NDArray[np.str_],
+) -> tuple[npt.NDArray[np.intp] | None, dict[str, slice]]:
+    # an order of the rows in which the rows of each shard are contiguous
+    # (None if they already are) and the rows of each shard in that order
+    order = np.argsort(labels, kind="stable")
+    names, starts = np.unique(labels[order], return_index=True)
+    stops = np.append(starts[1:], len(labels))
+    slices = {
+        str(name): slice(start, stop) for name, start, stop in zip(names, starts, stops)
+    }
+    if np.array_equal(order, np.arange(len(labels))):
+        return None, slices
+    return order, slices
+
+
+def compare_shards(
+    df: pd.DataFrame, slices: dict[str, slice]
+) -> dict[str, pd.DataFrame]:
+    # the mean of each column of each shard of df (whose rows are in the order
+    # of the slices) compared to the distribution of all rows: the overall mean
+    # and std, the difference to the mean, its z-score and the percentile of
+    # the shard among the means of all shards
+    shard_means = pd.DataFrame(
+        [df.iloc[rows].mean() for rows in slices.values()], index=list(slices)
+    )
+    ranks = shard_means.rank(pct=True) * 100
+    overall_mean, overall_std = df.mean(), df.std()
+    comparisons = {}
+    for name in slices:
+        diff = shard_means.loc[name] - overall_mean
+        comparisons[name] = pd.DataFrame(
+            dict(
+                zip(
+                    COMPARISON_COLUMNS,
+                    [
+                        shard_means.loc[name],
+                        overall_mean,
+                        overall_std,
+                        diff,
+                        diff / overall_std,
+                        ranks.loc[name],
+                    ],
+                )
+            ),
+            index=df.columns,
+        )
+    return comparisons
+
+
+def shard_path(out_path: Path | str, name: str) -> Path:
+    # the report of a shard next to out_path, with characters which are not
+    # allowed in file names replaced
+    safe_name = re.sub(r'[\\/:*?"<>|\s]+', "_", name)
+    return Path(out_path).with_name(f"{Path(out_path).stem}.{safe_name}.html")
+
+
+def shard_items(results: SurveyResults, by: str) -> dict[str, list[ReportItem]]:
+    # the sections of the report of each shard. The statistics of all rows
+    # are computed once and each shard is a slice of the sorted rows.
+    df_likert, df_likert_mean = results.df_likert, results.df_likert_mean
+    timestamps = results.timestamps
+    with stage("shards"):
+        labels = shard_labels(df_likert.index, by)
+        order, slices = shard_slices(labels)
+        # the rows are sorted by supervisor already, by department they are
+        # reordered once and the shards are views of the reordered rows
+        if order is not None:
+            df_likert = df_likert.iloc[order]
+            df_likert_mean = df_likert_mean.iloc[order]
+            timestamps = timestamps.iloc[order]
+        group_comparisons = compare_shards(df_likert_mean, slices)
+        question_comparisons = compare_shards(df_likert, slices)
+        shards = {}
+        for name, rows in slices.items():
+            group_comparison = group_comparisons[name]
+            shards[name] = [
+                f"<h1>{name}の分析結果</h1>"
+                f"最終回答: {timestamps.iloc[rows].max()} "
+                f"回答数: {rows.stop - rows.start}/{len(labels)}",
+                "全体とのグループに関する平均の比較",
+                group_comparison.round(2),
+                FigureSpec(plot_comparison, (group_comparison,)),
+                "全体との質問ごとの平均の比較",
+                question_comparisons[name].round(2),
+                "回答ごとのグループに関する平均",
+                df_likert_mean.iloc[rows].round(2),
+            ]
+    return shards
+
+
+def _write_shard(items: list[ReportItem], path: Path, **options: Any) -> None:
+    # in a worker process, which needs the fonts
+    set_font()
+    export_multiple_frames_to_html(items, path, **options)
+
+
+def write_shards(
+    results: SurveyResults,
+    by: str,
+    out_path: Path | str,
+    *,
+    pdf: bool = True,
+    max_workers: int | None = None,
+    image_mode: str = "inline",
+    on_artifact: Callable[[Path], None] | None = None,
+    figure_pool: ProcessPoolExecutor | None = None,
+    **options: Any,
+) -> list[Path]:
+    # writes a report of each supervisor or department (see SHARD_KEYS) of
+    # results next to out_path, in parallel, and returns their artifacts.
+    # The reports are written by the processes of figure_pool (see
+    # figure_workers()) if given. options are passed to
+    # export_multiple_frames_to_html().
+    shards = {
+        shard_path(out_path, name): items
+        for name, items in shard_items(results, by).items()
+    }
+    LOG.info(f"Writing {len(shards)} reports by {by}")
+    if len(shards) <= 1 or max_workers == 1:
+        for path, items in shards.items():
+            export_multiple_frames_to_html(
+                items,
+                path,
+                pdf=pdf,
+                max_workers=max_workers,
+                image_mode=image_mode,
+                on_artifact=on_artifact,
+                figure_pool=figure_pool,
+                **options,
+            )
+    else:
+        with (
+            nullcontext(figure_pool)
+            if figure_pool is not None
+            else process_pool(
+                max_workers=min(max_workers or os.cpu_count() or 1, len(shards))
+            )
+        ) as executor:
+            trace = trace_options()
+            futures = {
+                executor.submit(
+                    run_traced,
+                    trace,
+                    _write_shard,
+                    items,
+                    path,
+                    pdf=pdf,
+                    # the shards are already rendered in parallel
+                    max_workers=1,
+                    image_mode=image_mode,
+                    **options,
+                ): path
+                for path, items in shards.items()
+            }
+            for future in as_completed(futures):
+                add_worker_trace(future.result())
+                if on_artifact is not None:
+                    for artifact in get_artifacts(futures[future], pdf, image_mode):
+                        on_artifact(artifact)
+    return [
+        artifact for path in shards for artifact in get_artifacts(path, pdf, image_mode)
+    ]
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from logging import getLogger
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+STORE_VERSION = 1
+
+LOG = getLogger(__name__)
+
+
+class ResponseStore:
+    # the parsed responses of every export of a sheet, one .npy file per column
+    # which is memory-mapped when loaded. Text columns are stored as int32 codes
+    # into their categories, so each distinct answer is stored once.
+    # Rows are identified by keys (row_keys() of the timestamps): the rows of
+    # a new export replace the stored rows with the same key and are kept last,
+    # so that the latest export is a contiguous slice of every column.
+    # The survey is anonymous, so a response is only identified by its
+    # timestamp: a response edited in the form gets a new timestamp and is kept
+    # twice, once as it was in the older exports.
+    def __init__(self, root: Path | str) -> None:
+        self.root = Path(root).expanduser()
+
+    def _read_header(self) -> dict[str, Any] | None:
+        path = self.root / "store.json"
+        if not path.exists():
+            return None
+        header = json.loads(path.read_text(encoding="utf-8"))
+        if header["version"] != STORE_VERSION:
+            LOG.info(f"Discarding outdated response store {self.root}")
+            return None
+        return header
+
+    @property
+    def digest(self) -> str | None:
+        # the digest of the latest export, see append()
+        header = self._read_header()
+        return None if header is None else header["digest"]
+
+    def load(self, *, latest: bool = True) -> pd.DataFrame | None:
+        # the responses of the latest export as read_responses() parses them,
+        # or those of every export with the union of their columns
+        header = self._read_header()
+        if header is None:
+            return None
+        start = header["n_rows"] - header["n_latest"] if latest else 0
+        names = header["latest_columns"] if latest else list(header["columns"])
+        data = {}
+        for name in names:
+            column = header["columns"][name]
+            values = np.load(self.root / column["file"], mmap_mode="r")[start:]
+            if column["categories"] is not None:
+                # the categories are sorted, so the codes compare like the strings
+                data[name] = pd.Categorical.from_codes(
+                    values, categories=column["categories"], ordered=True
+                )
+            elif latest:
+                # the rows of the latest export have its dtypes
+                data[name] = values.astype(column["dtype"], copy=False)
+            else:
+                data[name] = values
+        # the index is materialized so that it sorts and compares like strings
+        name = header["index"]
+        index = pd.Index(np.asarray(data.pop(name), dtype=object), name=name)
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def keys(self, *, latest: bool = True) -> npt.NDArray[np.str_]:
+        header = self._read_header()
+        if header is None:
+            return np.array([], dtype=str)
+        start = header["n_rows"] - header["n_latest"] if latest else 0
+        return np.load(self.root / "keys.npy", mmap_mode="r")[start:]
+
+    def append(self, df: pd.DataFrame, keys: npt.NDArray[np.str_], digest: str) -> None:
+        # adds an export parsed by read_responses() with the keys of its rows,
+        # identified by digest (e.g. the hash of its CSV)
+        df = df.reset_index()
+        previous = self.load(latest=False)
+        if previous is not None:
+            kept = ~np.isin(self.keys(latest=False), keys)
+            LOG.info(f"Appending {len(df)} responses to {kept.sum()} stored responses")
+            previous = previous.reset_index()[kept]
+            keys = np.concatenate([self.keys(latest=False)[kept], keys])
+            combined = pd.concat(
+                [previous.astype(object), df.astype(object)], ignore_index=True
+            )
+            # the index column first, as in the latest export
+            combined = combined[
+                list(df.columns)
+                + [column for column in previous.columns if column not in df.columns]
+            ]
+        else:
+            combined = df
+
+        header: dict[str, Any] = {
+            "version": STORE_VERSION,
+            "digest": digest,
+            "index": df.columns[0],
+            "n_rows": len(combined),
+            "n_latest": len(df),
+            "latest_columns": list(df.columns),
+            "columns": {},
+        }
+        tmp = self.root.parent / f".{self.root.name}.{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        np.save(tmp / "keys.npy", keys.astype(str))
+        # the dtype of the export each column was last in
+        dtypes = dict(df.dtypes)
+        if previous is not None:
+            dtypes = {**dict(previous.dtypes), **dtypes}
+        for i, name in enumerate(combined.columns):
+            dtype = dtypes[name]
+            column: dict[str, Any] = {"file": f"{i}.npy", "dtype": str(dtype)}
+            if pd.api.types.is_numeric_dtype(dtype):
+                values = pd.to_numeric(combined[name]).to_numpy()
+                column["categories"] = None
+            else:
+                codes, categories = pd.factorize(combined[name], sort=True)
+                values = codes.astype(np.int32)
+                column["categories"] = categories.astype(str).tolist()
+            np.save(tmp / column["file"], values)
+            header["columns"][name] = column
+        (tmp / "store.json").write_text(
+            json.dumps(header, ensure_ascii=False), encoding="utf-8"
+        )
+        # arrays which are still mapped stay valid after their files are removed
+        shutil.rmtree(self.root, ignore_errors=True)
+        tmp.rename(self.root)
+
+    def to_parquet(self, path: Path | str, *, latest: bool = False) -> None:
+        # requires pyarrow or fastparquet, which are not installed by default
+        df = self.load(latest=latest)
+        if df is None:
+            raise RuntimeError(f"No responses are stored in {self.root}")
+        df.to_parquet(path)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .analyze import PRIVACY_TEXT, TIMESTAMP_TEXT
+from .likert import LIKERT_SCALE_TEXTS
+
+GRADES = ["B4", "M1", "M2", "D1", "D2", "D3"]
+PRIVACY_SCOPES = ["全体", "研究室内", "全体, 研究室内"]
+FREE_TEXTS = [
+    "研究室の雰囲気は良いです",
+    "特になし",
+    "指導が丁寧で良い\n満足",
+    "ミーティングの頻度を増やしてほしい",
+    "実験設備が充実している",
+    "",
+]
+
+
+def generate_survey(
+    n_responses: int = 30,
+    n_questions: int = 8,
+    *,
+    n_groups: int = 3,
+    n_supervisors: int = 8,
+    missing_rate: float = 0.02,
+    seed: int = 0,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # responses like those exported from Google Forms, with metadata.csv and
+    # metadata_group_name.csv. Answers within a group are correlated
+    # through a latent score per respondent and group.
+    rng = np.random.default_rng(seed)
+    seconds = np.cumsum(rng.integers(1, 3 * 24 * 3600, n_responses))
+    timestamps = pd.Timestamp("2023-04-01") + pd.to_timedelta(seconds, unit="s")
+    supervisors = [
+        f"教員{i}" + ("機械B" if i % 3 == 0 else "") for i in range(n_supervisors)
+    ]
+    columns: dict[str, object] = {
+        TIMESTAMP_TEXT: timestamps.strftime("%Y/%m/%d %H:%M:%S"),
+        "学年": rng.choice(GRADES, n_responses),
+        # the index of read_responses()
+        "指導教員": rng.choice(supervisors, n_responses),
+    }
+
+    question_groups = np.arange(n_questions) % n_groups
+    higher_is_better = rng.random(n_questions) < 0.5
+    latent = rng.normal(size=(n_responses, n_groups))
+    scores = latent[:, question_groups] + rng.normal(size=(n_responses, n_questions))
+    # code 0 is the most positive answer
+    scores = np.where(higher_is_better, -scores, scores)
+    codes = np.clip(np.round(scores + 2), 0, len(LIKERT_SCALE_TEXTS) - 1).astype(int)
+    # only the last question is optional, the clustering drops questions
+    # with any missing answer
+    codes[rng.random(n_responses) < missing_rate, -1] = -1
+    for i in range(n_questions):
+        columns[f"Q{i}"] = pd.Categorical.from_codes(
+            codes[:, i], categories=LIKERT_SCALE_TEXTS
+        )
+
+    columns["年齢"] = rng.integers(20, 30, n_responses)
+    columns["自由記述"] = rng.choice(FREE_TEXTS, n_responses)
+    columns[PRIVACY_TEXT] = rng.choice(PRIVACY_SCOPES, n_responses)
+    df = pd.DataFrame(columns)
+
+    questions = [
+        column for column in df.columns if column not in (TIMESTAMP_TEXT, "指導教員")
+    ]
+    df_meta = pd.DataFrame(
+        {"group": None, "higher_is_better": False, "scale": None, "type": None},
+        index=pd.Index(questions, name="question"),
+    )
+    # the answers are chosen from a few sentences, which are not detected as free text
+    df_meta.loc["自由記述", "type"] = "text"
+    df_meta["group"] = df_meta["group"].astype(object)
+    for i in range(n_questions):
+        df_meta.loc[f"Q{i}", ["group", "higher_is_better"]] = [
+            question_groups[i],
+            bool(higher_is_better[i]),
+        ]
+    df_group_names = pd.DataFrame({"name": [f"グループ{i}" for i in range(n_groups)]})
+    return df, df_meta, df_group_names
+
+
+def write_survey(directory: Path | str, **kwargs: object) -> str:
+    # writes metadata.csv and metadata_group_name.csv to directory
+    # and returns the responses as the CSV exported from the sheet
+    directory = Path(directory)
+    df, df_meta, df_group_names = generate_survey(**kwargs)  # type: ignore[arg-type]
+    df_meta.to_csv(directory / "metadata.csv")
+    df_group_names.to_csv(directory / "metadata_group_name.csv", header=False)
+    return df.to_csv(index=False)
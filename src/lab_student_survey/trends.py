@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import json
+from collections.abc import Callable
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+TREND_PERIODS = ("year", "term")
+# the academic year starts in April and its second term in October
+ACADEMIC_YEAR_START_MONTH = 4
+SECOND_TERM_START_MONTH = 10
+TREND_STATE_VERSION = 1
+STATS = ("n", "sum", "sumsq")
+# the column of the mean over all groups
+OVERALL = "mean"
+
+LOG = getLogger(__name__)
+
+
+def period_labels(timestamps: pd.Series, period: str) -> pd.Series:
+    # labels like 2023年度 or 2023年度前期, which sort chronologically
+    if period not in TREND_PERIODS:
+        raise ValueError(f"period must be one of {TREND_PERIODS}")
+    # exports of different years may format the timestamps differently
+    t = pd.to_datetime(pd.Series(timestamps).astype(str), format="mixed")
+    year = (t.dt.year - (t.dt.month < ACADEMIC_YEAR_START_MONTH)).astype(str) + "年度"
+    if period == "year":
+        return year
+    first = (t.dt.month >= ACADEMIC_YEAR_START_MONTH) & (
+        t.dt.month < SECOND_TERM_START_MONTH
+    )
+    return year + np.where(first, "前期", "後期")
+
+
+def period_stats(
+    means: pd.DataFrame,
+    periods: pd.Series,
+    supervisors: pd.Index | npt.NDArray[np.str_],
+) -> pd.DataFrame:
+    # the number, sum and sum of squares of the per-respondent means of
+    # each group (columns of means) by period and supervisor.
+    # Sums can be added, so periods are computed once and combined.
+    values = means.to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    values = np.where(present, values, 0.0)
+    index = pd.MultiIndex.from_arrays(
+        [np.asarray(periods), np.asarray(supervisors)], names=["period", "supervisor"]
+    )
+    # as stored by TrendState
+    columns = pd.Index(means.columns.astype(str), name="group")
+    frames = {
+        "n": pd.DataFrame(present.astype(float), index=index, columns=columns),
+        "sum": pd.DataFrame(values, index=index, columns=columns),
+        "sumsq": pd.DataFrame(values**2, index=index, columns=columns),
+    }
+    return pd.concat(frames, axis=1).groupby(level=[0, 1]).sum()
+
+
+def trend_tables(stats: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # the mean of each group by period, with the number of responses and
+    # the standard deviation of the overall mean, and the overall mean
+    # by supervisor and period
+    by_period = stats.groupby(level="period").sum()
+    n, s, ss = (by_period[stat] for stat in STATS)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df_trend = s / n
+        std = np.sqrt((ss[OVERALL] - s[OVERALL] ** 2 / n[OVERALL]) / (n[OVERALL] - 1))
+    df_trend.insert(0, "回答数", n.max(axis=1).astype(int))
+    df_trend[f"{OVERALL}_std"] = std
+    df_trend.columns.name = None
+
+    n, s = stats["n"][OVERALL], stats["sum"][OVERALL]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df_supervisor = (s / n).unstack("period")
+    df_supervisor.columns.name = None
+    return df_trend, df_supervisor
+
+
+@dataclass
+class TrendState:
+    # period_stats() of the periods which are over, with the number of
+    # responses of each, so that only the current period is computed
+    signature: str
+    stats: pd.DataFrame
+    counts: dict[str, int]
+
+    @classmethod
+    def load(cls, path: Path | str, signature: str) -> TrendState | None:
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            if (
+                header["version"] != TREND_STATE_VERSION
+                or header["signature"] != signature
+            ):
+                LOG.info(f"Discarding outdated trends {path}")
+                return None
+            index = pd.MultiIndex.from_arrays(
+                [data["periods"], data["supervisors"]], names=["period", "supervisor"]
+            )
+            columns = pd.MultiIndex.from_product(
+                [STATS, header["groups"]], names=[None, "group"]
+            )
+            stats = pd.DataFrame(data["values"], index=index, columns=columns)
+        return cls(signature, stats, header["counts"])
+
+    def save(self, path: Path | str) -> None:
+        header = {
+            "version": TREND_STATE_VERSION,
+            "signature": self.signature,
+            "groups": self.stats.columns.get_level_values(1)[
+                : self.stats.shape[1] // len(STATS)
+            ].tolist(),
+            "counts": self.counts,
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with Path(path).open("wb") as f:
+            np.savez(
+                f,
+                header=np.array(json.dumps(header, ensure_ascii=False)),
+                periods=self.stats.index.get_level_values(0).to_numpy(dtype=str),
+                supervisors=self.stats.index.get_level_values(1).to_numpy(dtype=str),
+                values=self.stats.to_numpy(dtype=float),
+            )
+
+
+def compute_trends(
+    periods: pd.Series,
+    supervisors: pd.Index | npt.NDArray[np.str_],
+    group_means: Callable[[npt.NDArray[np.bool_]], pd.DataFrame],
+    *,
+    state_path: Path | str | None = None,
+    signature: str = "",
+) -> pd.DataFrame:
+    # period_stats() of all responses. group_means(rows) returns the
+    # per-respondent group means of the rows selected by a boolean mask.
+    # With state_path, the stats of the periods before the latest one are
+    # kept and only recomputed when their number of responses changes.
+    periods = pd.Series(np.asarray(periods))
+    counts = periods.value_counts()
+    state = TrendState.load(state_path, signature) if state_path is not None else None
+    cached: list[str] = []
+    if state is not None:
+        cached = [
+            period
+            for period, count in state.counts.items()
+            if counts.get(period, 0) == count
+        ]
+    rows = ~periods.isin(cached).to_numpy()
+    LOG.info(f"Computing trends of {rows.sum()} responses, {len(cached)} periods kept")
+    stats = period_stats(
+        group_means(rows), periods[rows], np.asarray(supervisors)[rows]
+    )
+    if state is not None and cached:
+        stats = pd.concat(
+            [state.stats[state.stats.index.get_level_values(0).isin(cached)], stats]
+        ).sort_index()
+
+    if state_path is not None:
+        # the latest period may still get responses
+        closed = sorted(counts.index)[:-1]
+        TrendState(
+            signature,
+            stats[stats.index.get_level_values(0).isin(closed)],
+            {period: int(counts[period]) for period in closed},
+        ).save(state_path)
+    return stats
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+# Forking a process while other threads hold locks (the Drive transfers,
+# the request threads of the server) can deadlock the child, so workers are
+# forked from a server process without threads, or spawned where there is none
+START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+# imported once by the server process, which the workers are forked from,
+# instead of by every worker
+PRELOAD_MODULES = ["lab_student_survey.figures", "lab_student_survey.results"]
+
+
+def process_pool(max_workers: int | None = None, **kwargs: Any) -> ProcessPoolExecutor:
+    # a ProcessPoolExecutor which is safe to start from a threaded process.
+    # The functions and arguments given to it must be picklable.
+    context = multiprocessing.get_context(START_METHOD)
+    if START_METHOD == "forkserver":
+        # only used when the server process is started
+        context.set_forkserver_preload(PRELOAD_MODULES)
+    return ProcessPoolExecutor(max_workers, mp_context=context, **kwargs)
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from pathlib import Path
+from threading import Event
+from typing import Any
+
+
+class FakeFile(dict[str, Any]):
+    def __init__(self, drive: "FakeDrive", content: bytes = b"", **metadata: Any):
+        super().__init__(metadata)
+        self.drive = drive
+        self.content = content
+        self.downloads = 0
+
+    def FetchMetadata(self, fields: str | None = None) -> None:
+        pass
+
+    def GetContentFile(self, filename: str, mimetype: str | None = None) -> None:
+        self.downloads += 1
+        Path(filename).write_bytes(self.content)
+
+    def SetContentFile(self, filename: str) -> None:
+        self.content = Path(filename).read_bytes()
+
+    def Upload(self) -> None:
+        if self["title"] in self.drive.fail_titles:
+            raise OSError("upload failed")
+        self.setdefault("id", f"id-{len(self.drive.files)}")
+        self["md5Checksum"] = hashlib.md5(self.content).hexdigest()
+        self["alternateLink"] = f"https://drive.example/{self['id']}"
+        self.drive.files[self["id"]] = self
+        self.drive.uploaded.set()
+
+
+class FakeFileList:
+    def __init__(self, items: list[FakeFile]) -> None:
+        self.items = items
+
+    def GetList(self) -> list[FakeFile]:
+        return self.items
+
+
+class FakeDrive:
+    # an in-memory stand-in for pydrive2.drive.GoogleDrive
+    def __init__(self) -> None:
+        self.files: dict[str, FakeFile] = {}
+        self.queries: list[dict[str, str]] = []
+        self.fail_titles: set[str] = set()
+        self.uploaded = Event()
+
+    def add(
+        self, title: str, content: bytes, folder_id: str, **metadata: Any
+    ) -> FakeFile:
+        file = FakeFile(
+            self,
+            content,
+            id=f"id-{len(self.files)}",
+            title=title,
+            parents=[{"id": folder_id}],
+            **metadata,
+        )
+        self.files[file["id"]] = file
+        return file
+
+    def ListFile(self, param: dict[str, str]) -> FakeFileList:
+        self.queries.append(param)
+        parents = re.match(r"'([^']*)' in parents", param["q"])
+        assert parents is not None
+        folder_id = parents[1]
+        titles = {
+            title.replace("\\'", "'")
+            for title in re.findall(r"title = '((?:[^'\\]|\\.)*)'", param["q"])
+        }
+        return FakeFileList(
+            [
+                file
+                for file in self.files.values()
+                if file["title"] in titles
+                and {"id": folder_id} in file.get("parents", [])
+            ]
+        )
+
+    def CreateFile(self, metadata: dict[str, Any]) -> FakeFile:
+        if "id" in metadata:
+            return self.files[metadata["id"]]
+        return FakeFile(self, **metadata)
@@ -0,0 +1,68 @@
+import time
+from pathlib import Path
+
+from lab_student_survey.analyze import read_responses
+from lab_student_survey.benchmark import compare
+from lab_student_survey.likert import LIKERT_SCALE_TEXTS, encode_likert
+from lab_student_survey.profiling import record_stages, stage
+from lab_student_survey.synthetic import generate_survey, write_survey
+
+
+def test_generate_survey(tmp_path: Path) -> None:
+    df, df_meta, df_group_names = generate_survey(40, 6, n_groups=2, seed=1)
+    assert df.shape == (40, 12)
+    assert df_meta["group"].dropna().nunique() == 2
+    assert len(df_group_names) == 2
+
+    csv_content = write_survey(tmp_path, n_responses=40, n_questions=6, seed=1)
+    assert (tmp_path / "metadata.csv").exists()
+    df_read = read_responses(csv_content)
+    assert df_read.index.name == "指導教員"
+    questions = [f"Q{i}" for i in range(6)]
+    encoding = encode_likert(
+        df_read[questions],
+        [LIKERT_SCALE_TEXTS] * 6,
+        df_meta.loc[questions, "higher_is_better"].to_numpy(),
+    )
+    # only the last question has missing answers
+    assert not encoding.missing[:, :-1].any()
+    assert generate_survey(40, 6, seed=1)[0].equals(generate_survey(40, 6, seed=1)[0])
+
+
+def test_record_stages() -> None:
+    with stage("ignored"):
+        pass
+    with record_stages(trace_memory=True) as recorder:
+        for _ in range(2):
+            with stage("sleep"):
+                time.sleep(0.01)
+        with stage("allocate"):
+            data = bytearray(2**20)
+    del data
+    assert recorder.seconds["sleep"] >= 0.02
+    assert recorder.peak_bytes["allocate"] >= 2**20
+    assert "ignored" not in recorder.seconds
+
+
+def test_compare() -> None:
+    baseline = {
+        "digest": "a",
+        "stages": {
+            "stats": {"seconds": 1.0, "peak_mb": 10.0},
+            "figures": {"seconds": 0.01, "peak_mb": 0.1},
+        },
+    }
+    same = {
+        "digest": "a",
+        "stages": {
+            "stats": {"seconds": 1.2, "peak_mb": 10.5},
+            # below the noise thresholds
+            "figures": {"seconds": 0.05, "peak_mb": 0.5},
+        },
+    }
+    assert compare(same, baseline) == []
+    slower = {
+        "digest": "b",
+        "stages": {"stats": {"seconds": 2.0, "peak_mb": 20.0}},
+    }
+    assert len(compare(slower, baseline)) == 3
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pingouin as pg
+import pytest
+
+import lab_student_survey.bootstrap
+from lab_student_survey.bootstrap import (
+    bootstrap_ci,
+    bootstrap_statistics,
+    resample_weights,
+)
+
+
+def _data() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    X = rng.integers(1, 6, size=(50, 5)).astype(float)
+    X[:, 1] += X[:, 0]
+    X[rng.random(X.shape) < 0.1] = np.nan
+    columns = pd.MultiIndex.from_tuples(
+        [("a", "q0"), ("a", "q1"), ("b", "q2"), ("a", "q3"), ("c", "q4")],
+        names=["group", "question"],
+    )
+    return pd.DataFrame(X, columns=columns)
+
+
+def test_resample_weights() -> None:
+    weights = resample_weights(np.random.default_rng(0), 10, 3)
+    assert weights.shape == (3, 10)
+    assert (weights.sum(axis=1) == 10).all()
+
+
+def test_statistics_without_resampling() -> None:
+    df = _data()
+    item_groups, groups = pd.factorize(df.columns.get_level_values("group"))
+    means, alphas = bootstrap_statistics(
+        df.to_numpy(), item_groups, len(groups), np.ones((1, len(df)), dtype=np.int64)
+    )
+    expected = df.T.groupby(level="group", sort=False).mean().mean(axis=1)
+    np.testing.assert_allclose(means[0], expected)
+    np.testing.assert_allclose(alphas[0, 0], pg.cronbach_alpha(df["a"])[0])
+    assert np.isnan(alphas[0, 2])
+
+
+def test_bootstrap_ci_is_reproducible(monkeypatch: pytest.MonkeyPatch) -> None:
+    df = _data()
+    result = bootstrap_ci(df, 1200, max_workers=1)
+    monkeypatch.setattr(lab_student_survey.bootstrap, "PARALLEL_MIN_SIZE", 0)
+    pd.testing.assert_frame_equal(bootstrap_ci(df, 1200, max_workers=2), result)
+    lower, upper = result.loc["a", "mean_0.95"]
+    assert lower < df["a"].mean(axis=1).mean() < upper
+    assert np.isnan(result.loc["c", "alpha_0.95_bootstrap"])
@@ -0,0 +1,56 @@
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from lab_student_survey.cache import ResultCache, cache_key
+
+
+def test_cache_key(tmp_path: Path) -> None:
+    metadata = tmp_path / "metadata.csv"
+    metadata.write_text("question,group\n")
+    key = cache_key("a,b\n", None, input_paths=[metadata], pdf=True)
+    assert key == cache_key("a,b\n", None, input_paths=[metadata], pdf=True)
+    assert key != cache_key("a,b\n", ["全体"], input_paths=[metadata], pdf=True)
+    assert key != cache_key("a,b\n", None, input_paths=[metadata], pdf=False)
+    metadata.write_text("question,group,higher_is_better\n")
+    assert key != cache_key("a,b\n", None, input_paths=[metadata], pdf=True)
+
+
+def test_result_cache(tmp_path: Path) -> None:
+    cache = ResultCache(tmp_path / "cache", max_entries=2, max_age=timedelta(days=1))
+    report = tmp_path / "output.html"
+    assert not cache.get("a", [report])
+    report.write_text("a")
+    cache.put("a", [report])
+    report.write_text("b")
+    assert cache.get("a", [report])
+    assert report.read_text() == "a"
+
+    cache.put("b", [report])
+    cache.put("c", [report])
+    os.utime(tmp_path / "cache" / "a", (0, 0))
+    cache.evict()
+    assert sorted(p.name for p in (tmp_path / "cache").iterdir()) == ["b", "c"]
+
+
+def test_evict_keeps_reserved_directories(tmp_path: Path) -> None:
+    cache = ResultCache(tmp_path, max_entries=0)
+    (tmp_path / "responses").mkdir()
+    (tmp_path / "old").mkdir()
+    cache.evict()
+    assert [p.name for p in tmp_path.iterdir()] == ["responses"]
+
+
+def test_evict_ignores_files(tmp_path: Path) -> None:
+    cache = ResultCache(tmp_path, max_entries=1)
+    (tmp_path / "old").mkdir()
+    (tmp_path / "new").mkdir()
+    os.utime(tmp_path / "old", (0, 0))
+    (tmp_path / "downloads.json").write_text("{}")
+    (tmp_path / "credentials-a.json").write_text("{}")
+    cache.evict()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "credentials-a.json",
+        "downloads.json",
+        "new",
+    ]
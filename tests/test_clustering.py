@@ -0,0 +1,48 @@
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+import lab_student_survey.clustering
+from lab_student_survey.clustering import embed, select_k, warm_start
+from lab_student_survey.incremental import SurveyState
+
+
+def _blobs() -> npt.NDArray[np.float64]:
+    rng = np.random.default_rng(0)
+    centers = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+    return np.concatenate([center + rng.normal(size=(10, 2)) for center in centers])
+
+
+def test_select_k(monkeypatch: pytest.MonkeyPatch) -> None:
+    X = _blobs()
+    silhouette = select_k(X, 6, max_workers=1)
+    assert silhouette.k == 3
+    assert np.isnan(silhouette.scores[0])
+    assert len(np.unique(silhouette.labels[:10])) == 1
+    assert select_k(X, 6, criterion="gap", max_workers=1).k == 3
+    # the same result in parallel
+    monkeypatch.setattr(lab_student_survey.clustering, "PARALLEL_MIN_SIZE", 0)
+    parallel = select_k(X, 6, max_workers=2)
+    np.testing.assert_allclose(parallel.scores, silhouette.scores)
+
+
+def test_embed(monkeypatch: pytest.MonkeyPatch) -> None:
+    X = _blobs()
+    assert set(embed(X)) == {"MDS", "TSNE"}
+    monkeypatch.setattr(lab_student_survey.clustering, "MDS_MAX_SAMPLES", 10)
+    embeddings = embed(X, init={"TSNE": X[:, :2] * 1e-4})
+    assert set(embeddings) == {"PCA", "TSNE"}
+    assert embeddings["TSNE"].shape == (30, 2)
+
+
+def test_warm_start() -> None:
+    X = np.array([[0.0], [10.0], [9.0]])
+    positions = np.array([[1.0, 1.0], [2.0, 2.0], [np.nan, np.nan]])
+    np.testing.assert_array_equal(warm_start(X, positions)[2], [2.0, 2.0])
+
+    state = SurveyState.empty("", 1, 1, 1)
+    state.embedding_keys = np.array(["a", "b"])
+    state.embeddings = {"MDS": np.array([[1.0, 1.0, 0], [2.0, 2.0, 1]])}
+    init = state.embedding_init(np.array(["b", "c"]), 0.5)
+    np.testing.assert_array_equal(init["MDS"], [[2.0, 2.0], [np.nan, np.nan]])
+    assert state.embedding_init(np.array(["c", "d", "b"]), 0.5) == {}
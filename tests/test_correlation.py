@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pingouin as pg
+import pytest
+from scipy.stats import pearsonr, spearmanr
+
+from lab_student_survey.correlation import adjust_pvalues, correlate
+from lab_student_survey.incremental import Moments
+
+
+def _data() -> pd.DataFrame:
+    rng = np.random.default_rng(1)
+    X = rng.integers(1, 6, size=(30, 5)).astype(float)
+    X[:, 1] += X[:, 0]
+    X[:, 4] = 3.0
+    return pd.DataFrame(X, columns=list("abcde"))
+
+
+def test_pearson_matches_scipy() -> None:
+    df = _data()
+    df.iloc[::7, 0] = np.nan
+    result = correlate(df)
+    pd.testing.assert_frame_equal(result.r, df.corr())
+    for x, y in [("a", "b"), ("b", "c")]:
+        complete = df[[x, y]].dropna()
+        assert result.pvalues.loc[x, y] == pytest.approx(
+            pearsonr(complete[x], complete[y])[1]
+        )
+    assert result.n.loc["a", "b"] == df["a"].count()
+    assert np.isnan(result.pvalues.loc["a", "e"])
+    assert result.pvalues.loc["a", "a"] == 0.0
+    # from the moments kept in a state
+    moments = Moments.from_array(df.to_numpy())
+    pd.testing.assert_frame_equal(
+        correlate(df, moments=moments).pvalues, result.pvalues
+    )
+
+
+def test_spearman_matches_scipy() -> None:
+    df = _data().drop(columns="e")
+    result = correlate(df, "spearman")
+    r, p = spearmanr(df)
+    np.testing.assert_allclose(result.r, r)
+    np.testing.assert_allclose(
+        result.pvalues.to_numpy()[np.triu_indices(4, 1)], p[np.triu_indices(4, 1)]
+    )
+
+
+@pytest.mark.parametrize("method", ["holm", "fdr_bh"])
+def test_adjust_pvalues(method: str) -> None:
+    p = correlate(_data()).pvalues.to_numpy()
+    adjusted = adjust_pvalues(p, method)
+    np.testing.assert_array_equal(adjusted, adjusted.T)
+    upper = np.triu_indices_from(p, 1)
+    valid = ~np.isnan(p[upper])
+    expected = pg.multicomp(p[upper][valid], method=method)[1]
+    np.testing.assert_allclose(adjusted[upper][valid], expected)
+    assert np.isnan(adjusted[upper][~valid]).all()
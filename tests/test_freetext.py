@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lab_student_survey.freetext import (
+    FreeTextIndex,
+    TokenCache,
+    keyword_summary,
+    supervisor_keywords,
+    tokenize,
+)
+
+
+def test_tokenize() -> None:
+    assert tokenize("ミーティングの頻度を増やしてほしい") == ["ミーティング", "頻度"]
+    assert tokenize("ＧＰＵサーバーが遅い、特記事項") == ["gpu", "サーバー"]
+    assert tokenize("") == []
+
+
+ANSWERS = pd.DataFrame(
+    {
+        "a": ["研究室の雰囲気", "実験設備", None, "研究室の雰囲気"],
+        "b": ["研究室の設備", "", "実験設備と研究室", "特になし"],
+    },
+    index=pd.Index(["x", "y", "y機械B", "x"], name="指導教員"),
+)
+
+
+def test_index() -> None:
+    cache = TokenCache()
+    index = FreeTextIndex.build(ANSWERS, cache)
+    # each response is counted once per keyword
+    assert list(index.search("研究室")) == [0, 2, 3]
+    # kanji compounds are kept whole
+    assert list(index.postings["実験設備"]) == [1, 2]
+    assert list(index.postings["設備"]) == [0]
+    # each distinct answer is tokenized once
+    assert len(cache.tokens) == 6
+    summary = keyword_summary(index, np.array(["A", "A", "B", "A"]), ANSWERS.index, n=2)
+    assert summary.index.tolist() == ["研究室", "実験設備"]
+    assert summary.loc["研究室"].tolist() == [3, 2, 1, 2]
+    keywords = supervisor_keywords(index, ANSWERS.index, n=2)
+    assert keywords["x"] == "研究室(2), 雰囲気(2)"
+
+
+def test_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = tmp_path / "tokens.json"
+    cache = TokenCache(path)
+    FreeTextIndex.build(ANSWERS, cache)
+    cache.save()
+
+    def tokenize(text: str) -> list[str]:
+        raise AssertionError(f"{text} was tokenized again")
+
+    monkeypatch.setattr("lab_student_survey.freetext.tokenize", tokenize)
+    cached = TokenCache(path)
+    assert FreeTextIndex.build(ANSWERS.iloc[:2], cached).rows.size
+    assert not cached.modified
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+import lab_student_survey.analyze
+import lab_student_survey.main
+from lab_student_survey.gdrive import DownloadManifest, DriveFolder, download_file
+from lab_student_survey.main import main
+from lab_student_survey.profiling import trace
+
+from .fake_drive import FakeDrive
+
+
+def test_download_file(tmp_path: Path) -> None:
+    drive = FakeDrive()
+    manifest = DownloadManifest(tmp_path / "downloads.json")
+    path = tmp_path / "metadata.csv"
+    # files with a checksum
+    file = drive.add("metadata.csv", b"a", "folder")
+    file["md5Checksum"] = hashlib.md5(b"a").hexdigest()
+    assert download_file(file, path, manifest)
+    assert not download_file(file, path, manifest)
+    path.write_bytes(b"b")
+    assert download_file(file, path, manifest)
+    assert path.read_bytes() == b"a"
+
+    # exported Google Sheets
+    path = tmp_path / "sheet.csv"
+    sheet = drive.add("sheet", b"a,b", "folder", modifiedDate="2024-01-01")
+    assert download_file(sheet, path, manifest)
+    manifest = DownloadManifest(tmp_path / "downloads.json")
+    assert not download_file(sheet, path, manifest)
+    sheet["modifiedDate"] = "2024-01-02"
+    assert download_file(sheet, path, manifest)
+    assert sheet.downloads == 2
+
+
+def test_drive_folder() -> None:
+    drive = FakeDrive()
+    metadata = drive.add("metadata.csv", b"", "folder")
+    folder = DriveFolder(drive, "folder", ["metadata.csv", "output.html"])
+    assert len(drive.queries) == 1
+    assert "title = 'metadata.csv' or title = 'output.html'" in drive.queries[0]["q"]
+    assert folder.get("metadata.csv") is metadata
+    assert folder.get("output.html") is None
+    created = folder.create_or_get("output.html", "text/html")
+    assert created["parents"] == [{"id": "folder"}]
+    assert folder.create_or_get("output.html", "text/html") is created
+    # everything was looked up by the first query
+    assert len(drive.queries) == 1
+    folder.get("it's.csv")
+    assert "title = 'it\\'s.csv'" in drive.queries[1]["q"]
+
+
+@pytest.fixture
+def drive(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> FakeDrive:
+    drive = FakeDrive()
+    drive.add("survey", b"a,b\n", "folder", modifiedDate="2024-01-01")
+    drive.add("metadata.csv", b"question,group\n", "folder")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(lab_student_survey.main, "get_drive", lambda: drive)
+    # only the cache_dir given to main() is written to
+    monkeypatch.setattr(
+        lab_student_survey.main, "DEFAULT_CACHE_DIR", tmp_path / "default"
+    )
+    return drive
+
+
+def fake_analyze_batch(
+    csv_content: str,
+    jobs: dict[str, Any],
+    *,
+    on_artifact: Any,
+    shard_by: str | None = None,
+    **kwargs: Any,
+) -> dict[str, list[Path]]:
+    shards: dict[str, list[Path]] = {}
+    for out_path in jobs:
+        path = Path(out_path)
+        path.write_text(csv_content)
+        on_artifact(path)
+        path.with_suffix(".pdf").write_bytes(b"%PDF")
+        on_artifact(path.with_suffix(".pdf"))
+        shards[out_path] = []
+        if shard_by is not None:
+            shard = path.with_name(f"{path.stem}.x.html")
+            shard.write_text(shard_by)
+            on_artifact(shard)
+            shards[out_path].append(shard)
+    return shards
+
+
+def test_main_pipeline(
+    drive: FakeDrive, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    def analyze_batch(
+        *args: Any, on_artifact: Any, **kwargs: Any
+    ) -> dict[str, list[Path]]:
+        def on_html(path: Path) -> None:
+            on_artifact(path)
+            # the HTML is uploaded while the PDF is generated
+            if path.suffix == ".html":
+                assert drive.uploaded.wait(10)
+
+        return fake_analyze_batch(*args, on_artifact=on_html, **kwargs)
+
+    monkeypatch.setattr(lab_student_survey.analyze, "analyze_batch", analyze_batch)
+    main("https://sheet/id-0", jobs={"a.html": None, "b.html": ["x"]}, cache_dir=None)
+    assert Path("metadata.csv").read_text() == "question,group\n"
+    assert sorted(
+        file["title"] for file in drive.files.values() if "md5Checksum" in file
+    ) == ["a.html", "a.pdf", "b.html", "b.pdf"]
+    # nothing is cached without cache_dir
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "a.html",
+        "a.pdf",
+        "b.html",
+        "b.pdf",
+        "metadata.csv",
+    ]
+
+
+def test_main_caches_shards(
+    drive: FakeDrive, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    calls = []
+
+    def analyze_batch(*args: Any, **kwargs: Any) -> dict[str, list[Path]]:
+        calls.append(kwargs.get("shard_by"))
+        return fake_analyze_batch(*args, **kwargs)
+
+    monkeypatch.setattr(lab_student_survey.analyze, "analyze_batch", analyze_batch)
+    cache_dir = tmp_path / "cache"
+    shards = [Path("output.html"), Path("output.pdf"), Path("output.x.html")]
+    assert main("https://sheet/id-0", cache_dir=cache_dir, shard_by="supervisor") == {
+        "output.html": shards
+    }
+    Path("output.x.html").unlink()
+    # the shards are restored from the cache and uploaded again
+    assert main("https://sheet/id-0", cache_dir=cache_dir, shard_by="supervisor") == {
+        "output.html": shards
+    }
+    assert Path("output.x.html").read_text() == "supervisor"
+    assert (cache_dir / "downloads.json").exists()
+    assert (cache_dir / "downloads" / "id-0.csv").exists()
+    assert not (tmp_path / "default").exists()
+    assert "output.x.html" in {file["title"] for file in drive.files.values()}
+    # the reports of other shards are not the cached ones
+    main("https://sheet/id-0", cache_dir=cache_dir, shard_by="department")
+    assert calls == ["supervisor", "department"]
+
+
+def test_main_upload_failure(drive: FakeDrive, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(lab_student_survey.analyze, "analyze_batch", fake_analyze_batch)
+    drive.fail_titles.add("output.pdf")
+    with pytest.raises(RuntimeError, match="output.pdf"):
+        main("https://sheet/id-0", cache_dir=None)
+    # the other files are still uploaded
+    assert "output.html" in {file["title"] for file in drive.files.values()}
+
+
+def test_main_trace(
+    drive: FakeDrive, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.setattr(lab_student_survey.analyze, "analyze_batch", fake_analyze_batch)
+    with trace(tmp_path / "trace.json"):
+        main("https://sheet/id-0", cache_dir=None)
+    result = json.loads((tmp_path / "trace.json").read_text())
+    spans = [event for event in result["traceEvents"] if event["ph"] == "X"]
+    uploads = {event["args"]["file"] for event in spans if event["name"] == "upload"}
+    assert uploads == {"output.html", "output.pdf"}
+    assert {"metadata", "download", "analyze", "wait_uploads"} <= set(result["stages"])
@@ -0,0 +1,47 @@
+import subprocess
+import sys
+
+# imported only by the stages which use them
+HEAVY_MODULES = {
+    "matplotlib",
+    "pandas",
+    "pdfkit",
+    "pingouin",
+    "pydrive2",
+    "scipy",
+    "seaborn",
+    "sklearn",
+    "xhtml2pdf",
+}
+# seconds to import the CLI, about 10 times the time it takes locally
+CLI_IMPORT_BUDGET = 1.0
+
+
+def test_cli_imports_lazily() -> None:
+    modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, lab_student_survey.cli; print(*sys.modules)",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    assert HEAVY_MODULES.isdisjoint(module.split(".")[0] for module in modules)
+
+
+def test_cli_import_time() -> None:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import lab_student_survey.cli"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    # import time: self [us] | cumulative | imported package
+    cumulative = next(
+        int(line.split("|")[1])
+        for line in stderr.splitlines()
+        if line.split("|")[-1] == " lab_student_survey.cli"
+    )
+    assert cumulative / 1e6 < CLI_IMPORT_BUDGET
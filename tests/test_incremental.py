@@ -0,0 +1,59 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pingouin as pg
+from scipy.stats import pearsonr
+
+from lab_student_survey.incremental import (
+    Moments,
+    SurveyState,
+    cronbach_alpha,
+    pearson_pvalues,
+)
+
+
+def _data() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    X = rng.integers(1, 6, size=(40, 4)).astype(float)
+    X[:, 1] += X[:, 0]
+    X[rng.random(X.shape) < 0.1] = np.nan
+    return pd.DataFrame(X)
+
+
+def test_moments_match_pandas() -> None:
+    df = _data()
+    # accumulating in two batches is the same as computing from scratch
+    moments = Moments.from_array(df.to_numpy()[:25]) + Moments.from_array(
+        df.to_numpy()[25:]
+    )
+    np.testing.assert_allclose(moments.mean(), df.mean())
+    np.testing.assert_allclose(moments.cov(), df.cov())
+    np.testing.assert_allclose(moments.corr(), df.corr())
+
+
+def test_pvalues_and_alpha() -> None:
+    df = _data()
+    moments = Moments.from_array(df.to_numpy())
+    p = pearson_pvalues(moments.corr(), moments.n)
+    complete = df[[0, 1]].dropna()
+    np.testing.assert_allclose(p[0, 1], pearsonr(complete[0], complete[1])[1])
+
+    alpha, ci = cronbach_alpha(moments.cov(), len(df))
+    expected_alpha, expected_ci = pg.cronbach_alpha(df)
+    np.testing.assert_allclose(alpha, expected_alpha)
+    np.testing.assert_allclose(ci, expected_ci)
+
+
+def test_state_roundtrip(tmp_path: Path) -> None:
+    state = SurveyState.empty("signature", 4, 4, 2)
+    X = _data().to_numpy()
+    state.update(np.array(["a", "b"]), X[:2], X[:2], np.ones((2, 2)))
+    state.save(tmp_path / "state.npz")
+    assert SurveyState.load(tmp_path / "state.npz", "other") is None
+    loaded = SurveyState.load(tmp_path / "state.npz", "signature")
+    assert loaded is not None
+    assert loaded.keys.tolist() == ["a", "b"]
+    np.testing.assert_allclose(loaded.items.c, state.items.c)
+    assert loaded.is_consistent(np.array(["a", "b", "c"]))
+    assert not loaded.is_consistent(np.array(["b", "c"]))
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lab_student_survey.likert import (
+    LIKERT_SCALE_TEXTS,
+    LIKERT_SCALES,
+    encode_likert,
+    get_scale,
+)
+
+
+def test_encode_likert() -> None:
+    df = pd.DataFrame(
+        {
+            "a": ["全く当てはまる", "全く当てはまらない", "どちらともいえない"],
+            "b": ["全く当てはまる", "当てはまる", "全く当てはまらない"],
+            "c": ["当てはまる", "当てはまらない", "どちらともいえない"],
+        }
+    )
+    encoding = encode_likert(
+        df,
+        [LIKERT_SCALE_TEXTS, LIKERT_SCALE_TEXTS, LIKERT_SCALES["3"]],
+        [True, False, True],
+    )
+    assert encoding.values.dtype == np.int8
+    np.testing.assert_array_equal(encoding.values, [[5, 1, 3], [1, 2, 1], [3, 5, 2]])
+    assert encoding.to_frame().dtypes.eq(np.int8).all()
+
+
+def test_encode_likert_unknown() -> None:
+    df = pd.DataFrame({"a": ["当てはまる", None, "わからない"]})
+    encoding = encode_likert(df, [LIKERT_SCALE_TEXTS], [True])
+    np.testing.assert_array_equal(encoding.missing[:, 0], [False, True, True])
+    assert encoding.to_frame()["a"].isna().sum() == 2
+    with pytest.raises(ValueError, match="わからない"):
+        encode_likert(df, [LIKERT_SCALE_TEXTS], [True], strict=True)
+
+
+def test_get_scale() -> None:
+    assert get_scale(float("nan")) == LIKERT_SCALE_TEXTS
+    assert get_scale(7.0) == LIKERT_SCALES["7"]
+    assert get_scale("はい|いいえ") == ["はい", "いいえ"]
+    with pytest.raises(ValueError):
+        get_scale("4")
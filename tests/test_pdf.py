@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from pypdf import PdfReader
+
+import lab_student_survey.pdf
+from lab_student_survey.figures import FigureSpec, plot_trend
+from lab_student_survey.pdf import PdfRenderer, resolve_backend, table_pages
+from lab_student_survey.report import PAGED_TABLE_ROWS, export_multiple_frames_to_html
+
+
+def test_resolve_backend(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(lab_student_survey.pdf.shutil, "which", lambda name: None)
+    assert resolve_backend("auto") == "xhtml2pdf"
+    monkeypatch.setattr(
+        lab_student_survey.pdf.shutil, "which", lambda name: f"/usr/bin/{name}"
+    )
+    assert resolve_backend("auto") == "wkhtmltopdf"
+    assert resolve_backend("matplotlib") == "matplotlib"
+    with pytest.raises(ValueError):
+        resolve_backend("pdfkit")
+
+
+def test_table_pages() -> None:
+    df = pd.DataFrame({f"質問{i}": ["x" * 30] * 100 for i in range(10)})
+    parts = list(table_pages(df))
+    # the columns are split by width and the rows by height
+    assert len(parts) > 2
+    assert sum(len(part) for part in parts if part.columns[0] == "質問0") == 100
+    assert {column for part in parts for column in part.columns} == set(df.columns)
+    for part in parts:
+        assert part.shape[1] < 10
+
+
+def test_export_matplotlib(tmp_path: Path) -> None:
+    path = tmp_path / "output.html"
+    artifacts: list[Path] = []
+    items = [
+        "見出し",
+        pd.DataFrame({"a": ["x\\ny", "z"]}),
+        FigureSpec(plot_trend, (pd.DataFrame({"a": [1.0, 2.0]}, index=["p", "q"]),)),
+    ]
+    export_multiple_frames_to_html(
+        items, path, pdf_backend="matplotlib", on_artifact=artifacts.append
+    )
+    assert artifacts == [path, path.with_suffix(".pdf")]
+    assert path.with_suffix(".pdf").read_bytes().startswith(b"%PDF")
+    assert not path.with_suffix(".pdf.html").exists()
+
+
+def test_renderer(tmp_path: Path) -> None:
+    artifacts: list[Path] = []
+    with PdfRenderer() as renderer:
+        for name in ("a", "b"):
+            path = tmp_path / f"{name}.html"
+            export_multiple_frames_to_html(
+                [name, pd.DataFrame({"a": [1, 2]})],
+                path,
+                pdf_backend="matplotlib",
+                pdf_renderer=renderer,
+                on_artifact=artifacts.append,
+            )
+    assert sorted(artifacts) == sorted(
+        tmp_path / name for name in ("a.html", "a.pdf", "b.html", "b.pdf")
+    )
+
+
+def test_export_xhtml2pdf_paged(tmp_path: Path) -> None:
+    path = tmp_path / "output.html"
+    n = PAGED_TABLE_ROWS + 50
+    export_multiple_frames_to_html(
+        ["見出し", pd.DataFrame({"a": [f"row-{i}" for i in range(n)]})],
+        path,
+        pdf_backend="xhtml2pdf",
+        table_mode="paged",
+    )
+    # the paged table is a script in the HTML, the PDF has its first rows
+    assert "<table" not in path.read_text(encoding="utf-8")
+    pdf = path.with_suffix(".pdf")
+    text = "".join(page.extract_text() for page in PdfReader(pdf).pages)
+    assert "row-0" in text
+    assert f"row-{n - 1}" not in text
+    assert b"HeiseiKakuGo-W5" in pdf.read_bytes()
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lab_student_survey.privacy import PrivacyIndex
+
+ANSWERS = pd.Series(["全体", "研究室内", "全体, 研究室内", None, "研究室内, 全体", "全体"])
+
+
+def test_mask() -> None:
+    index = PrivacyIndex(ANSWERS)
+    assert index.scopes == ["全体", "研究室内"]
+    assert list(index.mask(["全体"])) == [1, 0, 1, 0, 1, 1]
+    assert list(index.mask(["全体", "研究室内"])) == [1, 1, 1, 0, 1, 1]
+    assert list(index.mask(["全体", "研究室内"], "all")) == [0, 0, 1, 0, 1, 0]
+    # scopes are matched exactly, not as regular expressions or substrings
+    with pytest.raises(ValueError, match=r"did you mean \['全体'\]"):
+        index.mask(["全"])
+    with pytest.raises(ValueError):
+        index.mask(["全体|研究室内"])
+    assert not index.mask(["全"], missing_ok=True).any()
+    assert list(index.mask(["全体", "全"], missing_ok=True)) == [1, 0, 1, 0, 1, 1]
+    assert not index.mask(["全体", "全"], "all", missing_ok=True).any()
+    assert index.matrix.sum(axis=0).tolist() == [4, 3]
+    with pytest.raises(ValueError):
+        index.mask(["全体"], "none")
+
+
+def test_aggregate() -> None:
+    index = PrivacyIndex(ANSWERS)
+    values = np.array(
+        [[1.0, 2.0], [3.0, np.nan], [5.0, 6.0], [7.0, 8.0], [9.0, 10.0], [11.0, 0.0]]
+    )
+    partial_sums = index.partial_sums(values)
+    for scopes, how in [(["全体"], "any"), (["全体", "研究室内"], "all")]:
+        mask = index.mask(scopes, how)
+        means, counts = index.aggregate(partial_sums, scopes, how)
+        np.testing.assert_allclose(means, np.nanmean(values[mask], axis=0))
+        assert counts.tolist() == (~np.isnan(values[mask])).sum(axis=0).tolist()
@@ -0,0 +1,86 @@
+import json
+import os
+import pstats
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from lab_student_survey.figures import FigureSpec, plot_empty, render_figures
+from lab_student_survey.pdf import PdfRenderer
+from lab_student_survey.profiling import (
+    add_worker_trace,
+    run_traced,
+    stage,
+    trace,
+    trace_options,
+)
+from lab_student_survey.report import export_multiple_frames_to_html
+
+
+def _work(n: int) -> int:
+    with stage("work", n=n):
+        return sum(i * i for i in range(n))
+
+
+def test_trace(tmp_path: Path) -> None:
+    path = tmp_path / "trace.json"
+    with trace(path, profile_stage="work"):
+        with stage("outer"):
+            _work(10**5)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            options = trace_options()
+            result = executor.submit(run_traced, options, _work, 10).result()
+            assert add_worker_trace(result) == 285
+    assert trace_options() is None
+
+    events = json.loads(path.read_text())["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X"]
+    assert [event["name"] for event in spans] == ["work", "outer", "work"]
+    # the worker span is in another process
+    assert spans[0]["pid"] != spans[2]["pid"]
+    assert spans[0]["args"]["n"] == 10**5
+    assert spans[0]["args"]["cpu_ms"] > 0
+    # the RSS so far and how much the span raised it
+    assert spans[1]["args"]["max_rss_so_far_mb"] > 0
+    assert 0 <= spans[1]["args"]["max_rss_growth_mb"]
+    # nested spans are within their parent
+    assert spans[1]["ts"] <= spans[0]["ts"]
+    assert spans[0]["ts"] + spans[0]["dur"] <= spans[1]["ts"] + spans[1]["dur"]
+
+    stats = pstats.Stats(str(tmp_path / "trace.work.prof"))
+    # both the span of this process and the one of the worker
+    assert stats.total_calls > 10**5  # type: ignore[attr-defined]
+
+
+def test_run_traced_without_trace() -> None:
+    assert run_traced(None, _work, 3) == (5, None)
+    assert add_worker_trace((5, None)) == 5
+
+
+def test_trace_figure_workers(tmp_path: Path) -> None:
+    path = tmp_path / "trace.json"
+    specs = [FigureSpec(plot_empty, dpi=dpi) for dpi in [50, 60]]
+    with trace(path):
+        assert len(list(render_figures(specs, max_workers=2))) == 2
+    stages = json.loads(path.read_text())["stages"]
+    assert stages["figure"]["count"] == 2
+
+
+def test_trace_pdf_renderer(tmp_path: Path) -> None:
+    path = tmp_path / "trace.json"
+    with trace(path):
+        with PdfRenderer() as renderer:
+            for name in ("a", "b"):
+                export_multiple_frames_to_html(
+                    [name, pd.DataFrame({"a": [1, 2]})],
+                    tmp_path / f"{name}.html",
+                    pdf_backend="matplotlib",
+                    pdf_renderer=renderer,
+                )
+    events = json.loads(path.read_text())["traceEvents"]
+    # the spans of the renderer process
+    pids = {event["pid"] for event in events if event["name"] == "pdf"}
+    assert len(pids) == 1
+    assert os.getpid() not in pids
+    assert json.loads(path.read_text())["stages"]["pdf"]["count"] == 2
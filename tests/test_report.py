@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import pytest
+from matplotlib.figure import Figure
+from PIL import Image
+
+import lab_student_survey.figures
+from lab_student_survey.figures import FigureSpec, render_figure, render_figures
+from lab_student_survey.report import (
+    PAGED_TABLE_ROWS,
+    PDF_TABLE_ROWS,
+    HTMLReportWriter,
+    ImageEncoding,
+    export_multiple_frames_to_html,
+    truncate_table,
+)
+from lab_student_survey.workers import process_pool
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+
+def test_export_inline(tmp_path: Path) -> None:
+    path = tmp_path / "output.html"
+    items = ["見出し", pd.DataFrame({"a": ["x\\ny"]}), PNG]
+    export_multiple_frames_to_html(items, path, pdf=False)
+    html = path.read_text(encoding="utf-8")
+    assert "<h2>見出し</h2>" in html
+    assert "x<br>y" in html
+    assert "data:image/png;base64," in html
+    # the items of the caller are not modified
+    assert items[0] == "見出し"
+    assert items[2] == PNG
+
+
+@pytest.mark.parametrize("pdf_backend", ["xhtml2pdf", "matplotlib"])
+def test_export_closes_figures(tmp_path: Path, pdf_backend: str) -> None:
+    fig, ax = plt.subplots()
+    ax.plot([1, 2])
+    export_multiple_frames_to_html(
+        [fig], tmp_path / "output.html", pdf_backend=pdf_backend
+    )
+    # the figure is not kept by pyplot
+    assert fig.number not in plt.get_fignums()
+    assert (tmp_path / "output.pdf").exists()
+
+
+def test_export_zip(tmp_path: Path) -> None:
+    path = tmp_path / "output.html"
+    artifacts: list[Path] = []
+    export_multiple_frames_to_html(
+        ["a", PNG, PNG + b"1", PNG],
+        path,
+        pdf=False,
+        image_mode="zip",
+        on_artifact=artifacts.append,
+    )
+    assert artifacts == [path.with_suffix(".zip")]
+    assert not path.exists()
+    with zipfile.ZipFile(path.with_suffix(".zip")) as f:
+        assert sorted(f.namelist()) == [
+            "output.html",
+            "output_files/figure-000.png",
+            "output_files/figure-001.png",
+        ]
+        html = f.read("output.html").decode()
+        assert "output_files/figure-001.png" in html
+        # identical images are written once
+        assert html.count("output_files/figure-000.png") == 2
+
+
+def test_export_paged(tmp_path: Path) -> None:
+    path = tmp_path / "output.html"
+    df = pd.DataFrame({"a": [f"</script>{i}\\n" for i in range(PAGED_TABLE_ROWS + 50)]})
+    with HTMLReportWriter(
+        path, pdf_html_path=tmp_path / "output.pdf.html", table_mode="paged"
+    ) as writer:
+        writer.write(df)
+        writer.write(df.head(2))
+    html = path.read_text(encoding="utf-8")
+    # the long table is in JSON blocks, the short one is HTML
+    assert html.count("<table") == 1
+    assert html.count("data-table='table-000'") == 2
+    assert "<\\/script>0\\n" in html
+    pdf_html = (tmp_path / "output.pdf.html").read_text(encoding="utf-8")
+    assert pdf_html.count("<table") == 2
+    assert f"他{len(df) - PDF_TABLE_ROWS}行" in pdf_html
+
+
+def test_truncate_table() -> None:
+    df = pd.DataFrame(
+        {"a": range(10)}, index=pd.MultiIndex.from_product([["x"], range(10)])
+    )
+    truncated = truncate_table(df, 3)
+    assert truncated.index[-1] == ("他7行", "")
+    assert truncated["a"].tolist() == [0, 1, 2, "…"]
+    assert truncate_table(df, 10) is df
+
+
+def _plot_line(n: int | list[int]) -> Figure:
+    fig = Figure()
+    fig.subplots().plot(range(n) if isinstance(n, int) else n)
+    return fig
+
+
+def test_render_figures_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = []
+
+    def plot_empty() -> Figure:
+        calls.append(1)
+        return Figure()
+
+    specs = [
+        FigureSpec(plot_empty),
+        # unhashable arguments are not compared
+        FigureSpec(_plot_line, ([1, 2],)),
+        FigureSpec(plot_empty),
+    ]
+    images = list(render_figures(specs, max_workers=1))
+    assert len(calls) == 1
+    assert images[0] == images[2] != images[1]
+
+
+def test_image_encoding() -> None:
+    spec = FigureSpec(_plot_line, (3,))
+    png = render_figure(spec)
+    quantized = render_figure(spec, encoding=ImageEncoding(colors=16))
+    assert len(quantized) < len(png)
+    with Image.open(BytesIO(quantized)) as image:
+        assert image.mode == "P"
+    with Image.open(
+        BytesIO(render_figure(FigureSpec(_plot_line, (3,), dpi=50)))
+    ) as image:
+        assert image.width == Figure().get_figwidth() * 50
+    svg = render_figure(spec, "svg", ImageEncoding("svg"))
+    assert svg.startswith(b"<?xml")
+
+
+def test_image_budget() -> None:
+    specs = [FigureSpec(_plot_line, (n,)) for n in range(2, 6)]
+    total = sum(map(len, render_figures(specs, max_workers=1)))
+    budget = total // 3
+    images = list(
+        render_figures(specs, max_workers=1, encoding=ImageEncoding(budget=budget))
+    )
+    assert len(images) == len(specs)
+    assert sum(map(len, images)) <= budget
+
+
+def test_image_budget_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    pools = []
+
+    def figure_workers(max_workers: int | None = None) -> ProcessPoolExecutor:
+        pools.append(max_workers)
+        return process_pool(max_workers)
+
+    monkeypatch.setattr(lab_student_survey.figures, "figure_workers", figure_workers)
+    specs = [FigureSpec(_plot_line, (n,)) for n in range(2, 6)]
+    total = sum(map(len, render_figures(specs, max_workers=1)))
+    images = list(
+        render_figures(specs, max_workers=2, encoding=ImageEncoding(budget=total // 3))
+    )
+    assert sum(map(len, images)) <= total // 3
+    # every attempt renders in the same workers
+    assert pools == [2]
+    # and those of the caller are not shut down
+    with process_pool(2) as executor:
+        assert len(list(render_figures(specs, executor=executor))) == len(specs)
+        assert executor.submit(int, "1").result() == 1
+    assert pools == [2]
+
+
+def test_export_svg(tmp_path: Path) -> None:
+    path = tmp_path / "output.html"
+    export_multiple_frames_to_html(
+        [FigureSpec(_plot_line, (3,))],
+        path,
+        pdf=False,
+        max_workers=1,
+        image_mode="files",
+        image_encoding=ImageEncoding("svg"),
+    )
+    assert "output_files/figure-000.svg" in path.read_text(encoding="utf-8")
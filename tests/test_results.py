@@ -0,0 +1,94 @@
+from io import StringIO
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import lab_student_survey.results
+from lab_student_survey.analyze import report_items, survey_results
+from lab_student_survey.profiling import record_stages
+from lab_student_survey.synthetic import write_survey
+
+
+def test_results_are_lazy(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    csv_content = write_survey(tmp_path, n_responses=40, n_questions=6, seed=1)
+
+    def select_k(*args, **kwargs):
+        raise AssertionError("the clustering is not needed")
+
+    monkeypatch.setattr(lab_student_survey.results, "select_k", select_k)
+    results = survey_results(csv_content)
+    with record_stages() as recorder:
+        corr = results.df_likert_mean_corr
+        assert results.df_likert_mean_corr is corr
+    assert list(corr.columns) == list(results.df_likert_mean.columns)
+    assert "clustering" not in recorder.seconds
+    with pytest.raises(AssertionError):
+        results.embeddings
+
+
+def test_report_items(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    csv_content = write_survey(tmp_path, n_responses=40, n_questions=6, seed=1)
+    results = survey_results(csv_content, add_numeral=False)
+    items = report_items(results)
+    assert results.df_numeral_columns.empty
+    # the free text is not repeated in the raw values
+    assert list(results.free_text_columns) == ["自由記述"]
+    raw = items[-1]
+    assert isinstance(raw, pd.DataFrame)
+    assert "自由記述" not in raw.columns
+    assert len(raw) == len(results.df)
+    assert "df_likert_colwise" in vars(results)
+
+
+def test_free_text_columns(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    csv_content = write_survey(tmp_path, n_responses=40, n_questions=6, seed=1)
+    df = pd.read_csv(StringIO(csv_content))
+    # a choice with long answers and answers which all differ
+    df["所属"] = ["情報理工学系研究科 機械工学専攻", "工学系研究科 精密工学専攻"] * 20
+    df["感想"] = [f"研究テーマ{i}について議論できた" for i in range(40)]
+    df_meta = pd.read_csv("metadata.csv", index_col=0)
+    df_meta.loc["所属"] = df_meta.loc["感想"] = df_meta.loc["年齢"]
+    df_meta.to_csv("metadata.csv")
+    results = survey_results(df.to_csv(index=False))
+    assert list(results.free_text_columns) == ["自由記述", "感想"]
+    # the type in metadata.csv takes precedence
+    df_meta.loc["感想", "type"] = "choice"
+    df_meta.to_csv("metadata.csv")
+    results = survey_results(df.to_csv(index=False))
+    assert list(results.free_text_columns) == ["自由記述"]
+
+
+def test_save_state(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    csv_content = write_survey(tmp_path, n_responses=40, n_questions=6, seed=1)
+    results = survey_results(csv_content, state_dir=tmp_path / "state")
+    assert results.state is not None
+    assert not (tmp_path / "state" / "output.npz").exists()
+    results.save_state()
+    loaded = survey_results(csv_content, state_dir=tmp_path / "state")
+    # all responses are in the saved state
+    assert loaded._loaded_state is not None
+    assert len(loaded._loaded_state.keys) == 40
+    survey_results(csv_content).save_state()
+
+
+def test_scope_means(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    csv_content = write_survey(tmp_path, n_responses=40, n_questions=6, seed=1)
+    everyone = survey_results(csv_content)
+    results = survey_results(
+        csv_content,
+        privacy_scopes=["研究室内"],
+        privacy_index=everyone.privacy_index,
+        scope_sums=everyone.scope_sums,
+    )
+    # the means of the scope are added up from the sums of all responses
+    colwise = results.df_likert_colwise
+    means = results.df_likert_mean.drop(columns="mean").mean()
+    pd.testing.assert_series_equal(
+        colwise["mean"], means.rename("mean"), check_names=False
+    )
@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+from urllib.request import Request, urlopen
+
+import pytest
+from click.testing import CliRunner
+
+import lab_student_survey.analyze
+import lab_student_survey.main
+import lab_student_survey.server
+from lab_student_survey.report import ImageEncoding
+from lab_student_survey.server import ReportService, SingleFlight, make_server, serve
+
+from .fake_drive import FakeDrive
+
+
+def test_single_flight() -> None:
+    flight = SingleFlight()
+    calls = []
+
+    def run() -> int:
+        calls.append(1)
+        time.sleep(0.2)
+        return len(calls)
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: flight.do("a", run), range(4)))
+    assert results == [1, 1, 1, 1]
+    assert flight.do("a", run) == 2
+
+
+@pytest.fixture
+def server(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[tuple[str, FakeDrive, list[list[str]]]]:
+    drive = FakeDrive()
+    drive.add("survey", b"a,b\n", "folder", modifiedDate="2024-01-01")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(lab_student_survey.main, "DEFAULT_CACHE_DIR", tmp_path)
+    calls: list[list[str]] = []
+
+    def analyze_batch(
+        csv_content: str, jobs: dict[str, Any], *, on_artifact: Any, **kwargs: Any
+    ) -> dict[str, list[Path]]:
+        calls.append(list(jobs))
+        time.sleep(0.2)
+        for out_path in jobs:
+            Path(out_path).write_text(csv_content)
+            on_artifact(Path(out_path))
+        return {out_path: [] for out_path in jobs}
+
+    monkeypatch.setattr(lab_student_survey.analyze, "analyze_batch", analyze_batch)
+    service = ReportService("https://sheet/id-0", pdf=False, cache_dir=tmp_path)
+    service.drive = drive
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", drive, calls
+    server.shutdown()
+    server.server_close()
+
+
+def test_server(server: tuple[str, FakeDrive, list[list[str]]]) -> None:
+    url, drive, calls = server
+    with urlopen(f"{url}/health") as response:
+        assert json.load(response)["authorized"]
+
+    def get(_: int) -> bytes:
+        with urlopen(f"{url}/reports/all.html") as response:
+            return response.read()
+
+    # concurrent requests are served by one analysis
+    with ThreadPoolExecutor(3) as executor:
+        assert list(executor.map(get, range(3))) == [b"a,b\n"] * 3
+    assert calls == [["output.html"]]
+    # and the next one from the cache, without uploading
+    assert get(0) == b"a,b\n"
+    assert calls == [["output.html"]]
+    assert not any("md5Checksum" in file for file in drive.files.values())
+
+    request = Request(f"{url}/refresh?scope=%E5%85%A8%E4%BD%93", method="POST")
+    with urlopen(request) as response:
+        assert json.load(response) == {"reports": {"全体": ["output.全体.html"]}}
+    assert calls[-1] == ["output.全体.html"]
+    assert "output.全体.html" in {file["title"] for file in drive.files.values()}
+
+
+def test_serve_options(monkeypatch: pytest.MonkeyPatch) -> None:
+    services: list[ReportService] = []
+
+    class Service(ReportService):
+        def __init__(self, *args: Any, **kwargs: Any) -> None:
+            super().__init__(*args, **kwargs)
+            services.append(self)
+
+        def warm(self) -> None:
+            pass
+
+    class Server:
+        def serve_forever(self) -> None:
+            raise KeyboardInterrupt
+
+        def server_close(self) -> None:
+            pass
+
+    monkeypatch.setattr(lab_student_survey.server, "ReportService", Service)
+    monkeypatch.setattr(lab_student_survey.server, "make_server", lambda *_: Server())
+    # the options of the CLI are shared
+    result = CliRunner().invoke(
+        serve,
+        [
+            "https://sheet/id-0",
+            "--shard-by",
+            "department",
+            "--no-cache",
+            "--correlation",
+            "spearman",
+            "--png-colors",
+            "64",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    (service,) = services
+    assert service.options["shard_by"] == "department"
+    assert service.options["cache_dir"] is None
+    assert service.options["correlation"] == "spearman"
+    assert service.options["image_encoding"] == ImageEncoding(colors=64)
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lab_student_survey.analyze import analyze_batch, survey_results
+from lab_student_survey.shards import (
+    compare_shards,
+    shard_items,
+    shard_labels,
+    shard_slices,
+)
+from lab_student_survey.synthetic import write_survey
+
+
+def test_shard_slices() -> None:
+    labels = shard_labels(pd.Index(["a機械B", "b", "c機械B", "d"]), "department")
+    assert list(labels) == ["機械B", "機械A", "機械B", "機械A"]
+    order, slices = shard_slices(labels)
+    assert order is not None
+    assert list(order) == [1, 3, 0, 2]
+    assert slices == {"機械A": slice(0, 2), "機械B": slice(2, 4)}
+    order, slices = shard_slices(np.array(["a", "a", "b"]))
+    assert order is None
+    assert slices == {"a": slice(0, 2), "b": slice(2, 3)}
+    with pytest.raises(ValueError):
+        shard_labels(pd.Index(["a"]), "lab")
+
+
+def test_compare_shards() -> None:
+    df = pd.DataFrame({"x": [1.0, 3.0, 5.0, 7.0]})
+    comparisons = compare_shards(df, {"a": slice(0, 2), "b": slice(2, 4)})
+    a = comparisons["a"].loc["x"]
+    assert a["平均"] == 2.0
+    assert a["全体の平均"] == 4.0
+    assert a["差"] == -2.0
+    assert a["z"] == pytest.approx(-2.0 / df["x"].std())
+    assert a["順位(%)"] == 50.0
+    assert comparisons["b"].loc["x", "順位(%)"] == 100.0
+
+
+def test_shard_items(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    csv_content = write_survey(tmp_path, n_responses=40, n_questions=6, seed=1)
+    results = survey_results(csv_content)
+    shards = shard_items(results, "supervisor")
+    assert len(shards) == results.df.index.nunique()
+    name = results.df.index[0]
+    table = shards[name][-1]
+    assert isinstance(table, pd.DataFrame)
+    assert len(table) == (results.df.index == name).sum()
+    # the rows of a supervisor are a slice of the means of all responses
+    _, slices = shard_slices(shard_labels(results.df.index, "supervisor"))
+    rows = results.df_likert_mean.iloc[slices[name]]
+    assert np.shares_memory(
+        rows["mean"].to_numpy(), results.df_likert_mean["mean"].to_numpy()
+    )
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_write_shards(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, max_workers: int
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    csv_content = write_survey(tmp_path, n_responses=40, n_questions=6, seed=1)
+    shards = analyze_batch(
+        csv_content,
+        {"output.html": None},
+        pdf=False,
+        shard_by="department",
+        max_workers=max_workers,
+    )
+    assert Path("output.html").exists()
+    assert shards == {"output.html": [Path("output.機械A.html"), Path("output.機械B.html")]}
+    for name in ["機械A", "機械B"]:
+        html = Path(f"output.{name}.html").read_text(encoding="utf-8")
+        assert f"{name}の分析結果" in html
+        assert "全体の標準偏差" in html
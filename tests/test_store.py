@@ -0,0 +1,70 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from lab_student_survey.analyze import (
+    TIMESTAMP_TEXT,
+    read_responses,
+    read_stored_responses,
+)
+from lab_student_survey.incremental import row_keys
+from lab_student_survey.store import ResponseStore
+from lab_student_survey.synthetic import generate_survey
+
+
+def _export(df: pd.DataFrame) -> str:
+    return df.to_csv(index=False)
+
+
+def test_store_round_trip(tmp_path: Path) -> None:
+    csv_content = _export(generate_survey(20, 4, seed=0)[0])
+    df = read_responses(csv_content)
+    store = ResponseStore(tmp_path / "store")
+    assert store.load() is None
+    store.append(df, row_keys(df[TIMESTAMP_TEXT]), "a")
+    assert store.digest == "a"
+
+    loaded = store.load()
+    assert loaded is not None
+    pd.testing.assert_frame_equal(
+        loaded.astype(object), df.astype(object), check_index_type=False
+    )
+    # numeric columns are mapped from the files
+    assert isinstance(loaded["年齢"].to_numpy().base, np.memmap)
+    assert loaded[TIMESTAMP_TEXT].max() == df[TIMESTAMP_TEXT].max()
+
+
+def test_store_deduplicates_on_timestamp(tmp_path: Path) -> None:
+    df_first = generate_survey(10, 4, seed=0)[0]
+    # the next export has the last 5 responses, one of them edited,
+    # 3 new responses and another question
+    df_second = pd.concat([df_first[5:], generate_survey(13, 4, seed=1)[0][10:]])
+    df_second.loc[df_second.index[0], "自由記述"] = "編集済み"
+    df_second["Q4"] = "はい"
+
+    store = ResponseStore(tmp_path / "store")
+    for df in [df_first, df_second]:
+        parsed = read_responses(_export(df))
+        store.append(parsed, row_keys(parsed[TIMESTAMP_TEXT]), _export(df))
+
+    latest = store.load()
+    assert latest is not None
+    assert len(latest) == 8
+    assert latest["自由記述"].iloc[0] == "編集済み"
+    everything = store.load(latest=False)
+    assert everything is not None
+    assert len(everything) == 13
+    assert everything["Q4"].isna().sum() == 5
+    assert len(set(store.keys(latest=False))) == 13
+
+
+def test_read_stored_responses(tmp_path: Path) -> None:
+    csv_content = _export(generate_survey(20, 4, seed=0)[0])
+    first = read_stored_responses(csv_content, tmp_path)
+    second = read_stored_responses(csv_content, tmp_path)
+    # the second call loads the categorical columns from the store
+    assert second["学年"].dtype == "category"
+    pd.testing.assert_frame_equal(
+        second.astype(object), first.astype(object), check_index_type=False
+    )
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+import pytest
+
+from lab_student_survey.trends import (
+    OVERALL,
+    compute_trends,
+    period_labels,
+    period_stats,
+    trend_tables,
+)
+
+
+def test_period_labels() -> None:
+    timestamps = pd.Series(["2023/03/31 23:59:59", "2023/04/01 00:00:00", "2024/01/10"])
+    assert period_labels(timestamps, "year").tolist() == [
+        "2022年度",
+        "2023年度",
+        "2023年度",
+    ]
+    assert period_labels(timestamps, "term").tolist() == [
+        "2022年度後期",
+        "2023年度前期",
+        "2023年度後期",
+    ]
+    with pytest.raises(ValueError):
+        period_labels(timestamps, "month")
+
+
+def _means(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    means = pd.DataFrame(rng.uniform(1, 5, size=(n, 2)), columns=["a", "b"])
+    means.iloc[0, 0] = np.nan
+    means[OVERALL] = means.mean(axis=1)
+    return means
+
+
+def test_trend_tables() -> None:
+    means = _means(30)
+    periods = pd.Series(np.repeat(["2022年度", "2023年度", "2024年度"], 10))
+    supervisors = np.tile(["x", "y"], 15)
+    df_trend, df_supervisor = trend_tables(period_stats(means, periods, supervisors))
+    expected = means.groupby(periods.to_numpy()).agg(["mean", "std"])
+    np.testing.assert_allclose(df_trend["a"], expected[("a", "mean")])
+    np.testing.assert_allclose(df_trend[f"{OVERALL}_std"], expected[(OVERALL, "std")])
+    assert df_trend["回答数"].tolist() == [10, 10, 10]
+    assert df_supervisor.shape == (2, 3)
+    assert df_supervisor.loc["x", "2022年度"] == pytest.approx(
+        means[OVERALL][:10][supervisors[:10] == "x"].mean()
+    )
+
+
+def test_compute_trends_keeps_closed_periods(tmp_path: Path) -> None:
+    means = _means(30)
+    periods = pd.Series(np.repeat(["2022年度", "2023年度", "2024年度"], 10))
+    supervisors = np.tile(["x", "y"], 15)
+    computed = []
+
+    def group_means(rows: npt.NDArray[np.bool_]) -> pd.DataFrame:
+        computed.append(rows.sum())
+        return means[rows]
+
+    path = tmp_path / "trends.npz"
+    expected = compute_trends(periods, supervisors, group_means)
+    for _ in range(2):
+        stats = compute_trends(
+            periods, supervisors, group_means, state_path=path, signature="s"
+        )
+        pd.testing.assert_frame_equal(stats, expected)
+    # only the latest period is computed again
+    assert computed == [30, 30, 10]
+    compute_trends(periods, supervisors, group_means, state_path=path, signature="t")
+    assert computed[-1] == 30